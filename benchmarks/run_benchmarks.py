@@ -0,0 +1,107 @@
+"""Replays the benchmark workloads and reports latency percentiles and throughput
+
+Runs against the API in-process (using the DB_* environment variables like the tests) unless --url is given.
+
+    python -m benchmarks.run_benchmarks --iterations 20 --concurrency 4
+    python -m benchmarks.run_benchmarks --url http://localhost:8000 --workload summary
+"""
+import argparse
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.workloads import WORKLOADS
+
+
+def get_client(url):
+    if url:
+        import httpx
+        return httpx.Client(base_url=url, timeout=None)
+    from fastapi.testclient import TestClient
+    from cda_api import app
+    return TestClient(app)
+
+
+# Nearest-rank percentile of an already sorted list
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(percent / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def send_request(client, method, path, params, body):
+    start_time = time.perf_counter()
+    response = client.request(method, path, params=params, json=body)
+    response.read()
+    return time.perf_counter() - start_time, response.status_code
+
+
+def run_workload(client, workload, iterations, warmup, concurrency):
+    name, method, path, params, body = workload
+    for _ in range(warmup):
+        send_request(client, method, path, params, body)
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda _: send_request(client, method, path, params, body), range(iterations)))
+    wall_time = time.perf_counter() - start_time
+
+    latencies = sorted([latency for latency, _ in results])
+    errors = len([status_code for _, status_code in results if status_code != 200])
+    return {
+        'name': name,
+        'requests': iterations,
+        'errors': errors,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'throughput': iterations / wall_time if wall_time else None,
+    }
+
+
+# Formats a number for the results table. Missing values (ex. percentiles of a workload with no requests) are shown as "-"
+def format_number(value, width, scale=1):
+    if value is None:
+        return f"{'-':>{width}}"
+    return f"{value * scale:>{width}.1f}"
+
+
+def format_results(results):
+    header = f"{'workload':<36}{'requests':>9}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>9}"
+    lines = [header, '-' * len(header)]
+    for result in results:
+        lines.append(
+            f"{result['name']:<36}{result['requests']:>9}{result['errors']:>8}"
+            f"{format_number(result['p50'], 10, 1000)}{format_number(result['p95'], 10, 1000)}{format_number(result['p99'], 10, 1000)}"
+            f"{format_number(result['throughput'], 9)}"
+        )
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replays representative CDA API requests and reports p50/p95/p99 latency and throughput')
+    parser.add_argument('--url', default=None, help='Base URL of a running API. Defaults to running the app in-process')
+    parser.add_argument('--iterations', type=int, default=20, help='Timed requests per workload')
+    parser.add_argument('--warmup', type=int, default=2, help='Untimed requests per workload before timing')
+    parser.add_argument('--concurrency', type=int, default=1, help='Concurrent requests per workload')
+    parser.add_argument('--workload', default=None, help='Only run workloads whose name contains this string')
+    parser.add_argument('--output', default=None, help='Also write the results table to this file')
+    args = parser.parse_args()
+
+    workloads = [workload for workload in WORKLOADS if (args.workload is None) or (args.workload in workload[0])]
+    client = get_client(args.url)
+    results = []
+    for workload in workloads:
+        print(f'Running {workload[0]}', flush=True)
+        results.append(run_workload(client, workload, args.iterations, args.warmup, args.concurrency))
+
+    table = format_results(results)
+    print(table)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(table + '\n')
+
+
+if __name__ == "__main__":
+    main()
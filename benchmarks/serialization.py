@@ -0,0 +1,94 @@
+"""Compares the time spent serializing /data responses with the default FastAPI path and with FAST_JSON_RESPONSES
+
+Doesn't run any queries: the pages are generated rows shaped like /data/file results (including the list
+columns of collated results), encoded the way each path encodes them and reported as milliseconds per 1,000 rows.
+
+    python -m benchmarks.serialization --rows 1000 10000 --iterations 20
+"""
+import argparse
+import time
+
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+
+from cda_api.classes.models import PagedResponseObj
+from cda_api.responses import FastJSONResponse, orjson
+
+FORMATS = ['bam', 'vcf', 'maf', 'svs', 'dicom', 'tsv']
+CATEGORIES = ['sequencing reads', 'simple nucleotide variation', 'imaging', 'clinical']
+DATA_SOURCES = ['gdc', 'pdc', 'idc']
+
+
+def get_row(index):
+    return {
+        'file_id': f'file.{index:08d}',
+        'file_id_alias': index,
+        'access': 'controlled' if index % 3 else 'open',
+        'category': CATEGORIES[index % len(CATEGORIES)],
+        'format': FORMATS[index % len(FORMATS)],
+        'name': f'sample_{index:08d}.{FORMATS[index % len(FORMATS)]}',
+        'size': (index * 7919) % 10000000000,
+        'checksum_value': f'{(index * 2654435761) % (1 << 64):032x}',
+        'drs_uri': f'drs://dg.4dfc:{index:08d}-0000-0000-0000-000000000000',
+        'file_data_at_gdc': index % 2 == 0,
+        'file_data_at_pdc': index % 5 == 0,
+        'file_data_at_idc': index % 7 == 0,
+        'subject_id': [f'subject.{index // 5:07d}'],
+        'species': ['human'],
+        'data_source': [DATA_SOURCES[index % 3], DATA_SOURCES[(index + 1) % 3]],
+        'anatomic_site': ['lung', 'bronchus'] if index % 2 else ['breast'],
+    }
+
+
+def get_page(row_count):
+    return {
+        'result': [get_row(index) for index in range(row_count)],
+        'query_sql': 'SELECT ...',
+        'total_row_count': row_count * 10,
+        'next_url': 'http://localhost:8000/data/file?limit=1000&offset=1000',
+    }
+
+
+# What FastAPI does with a returned dict: validate it against the response model, dump it to JSON types and encode it
+def serialize_default(adapter, page):
+    return JSONResponse(content=adapter.dump_python(adapter.validate_python(page), mode='json')).body
+
+
+# What build_response() does with FAST_JSON_RESPONSES
+def serialize_fast(page):
+    return FastJSONResponse(content={name: page.get(name, field.default) for name, field in PagedResponseObj.model_fields.items()}).body
+
+
+def time_per_thousand_rows(func, row_count, iterations):
+    func()
+    start_time = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start_time) / iterations / row_count * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reports /data response serialization time per 1,000 rows with and without FAST_JSON_RESPONSES')
+    parser.add_argument('--rows', type=int, nargs='+', default=[100, 1000, 10000], help='Page sizes to serialize')
+    parser.add_argument('--iterations', type=int, default=20, help='Timed serializations per page size')
+    parser.add_argument('--output', default=None, help='Also write the results table to this file')
+    args = parser.parse_args()
+
+    adapter = TypeAdapter(PagedResponseObj)
+    header = f"{'rows':>8}{'default ms/1k':>16}{'fast ms/1k':>13}{'speedup':>10}{'bytes':>12}"
+    lines = [f"fast path encoder: {'orjson' if orjson is not None else 'json (orjson not installed)'}", header, '-' * len(header)]
+    for row_count in args.rows:
+        page = get_page(row_count)
+        default_time = time_per_thousand_rows(lambda: serialize_default(adapter, page), row_count, args.iterations)
+        fast_time = time_per_thousand_rows(lambda: serialize_fast(page), row_count, args.iterations)
+        lines.append(f"{row_count:>8}{default_time * 1000:>16.2f}{fast_time * 1000:>13.2f}{default_time / fast_time:>9.1f}x{len(serialize_fast(page)):>12}")
+
+    table = '\n'.join(lines)
+    print(table)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(table + '\n')
+
+
+if __name__ == "__main__":
+    main()
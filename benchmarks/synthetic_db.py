@@ -0,0 +1,420 @@
+"""Builds a synthetic, schema-compatible CDA database for benchmarking
+
+Uses the same DB_* environment variables (or cda_api/config/.env) as the API, so point them at a local
+PostgreSQL database that can be overwritten. Values are derived from hashes of the row number rather than
+random() so the same scale factor always produces the same data.
+
+    python -m benchmarks.synthetic_db --scale 1 --drop
+"""
+import argparse
+import time
+from os import getenv
+
+from dotenv import find_dotenv, load_dotenv
+from sqlalchemy import create_engine, text
+
+# Rows generated per unit of scale factor
+SUBJECTS_PER_SCALE = 10000
+FILES_PER_SCALE = 50000
+
+DATA_SOURCES = ['gdc', 'pdc', 'idc']
+
+# Weighted value lists (repeated values are more common) for categorical columns
+SPECIES = ['human'] * 8 + ['mouse', 'dog']
+RACE = ['white'] * 5 + ['black or african american'] * 2 + ['asian', 'american indian or alaska native', 'native hawaiian or other pacific islander']
+ETHNICITY = ['not hispanic or latino'] * 4 + ['hispanic or latino']
+CAUSE_OF_DEATH = ['cancer related'] * 3 + ['not cancer related', 'infection', 'surgical complications']
+SEX = ['female', 'male']
+VITAL_STATUS = ['alive'] * 2 + ['dead']
+GRADE = ['G1', 'G2', 'G3', 'G4', 'GX']
+STAGE = ['stage i', 'stage ia', 'stage ib', 'stage ii', 'stage iia', 'stage iib', 'stage iii', 'stage iiia', 'stage iv']
+DATA_MODALITY = ['genomic'] * 3 + ['imaging', 'proteomic', 'clinical']
+ANATOMIC_SITE = ['breast', 'lung', 'colon', 'kidney', 'brain', 'skin', 'prostate', 'ovary', 'pancreas', 'liver', 'blood', 'bone marrow']
+DIAGNOSIS_PREFIXES = ['adenocarcinoma', 'squamous cell carcinoma', 'ductal carcinoma', 'glioblastoma', 'melanoma', 'lymphoma', 'leukemia', 'sarcoma']
+FORMAT = ['bam'] * 3 + ['vcf'] * 2 + ['tsv', 'maf', 'dicom', 'svs', 'txt', 'idat']
+FILE_TYPE = ['aligned reads'] * 3 + ['simple nucleotide variation', 'gene expression quantification', 'radiology image', 'slide image', 'proteome profiling']
+CATEGORY = ['sequencing reads', 'simple nucleotide variation', 'transcriptome profiling', 'imaging', 'proteome profiling', 'clinical']
+ACCESS = ['open'] * 3 + ['controlled']
+
+# column: (column_type, summary_returns, data_returns, process_before_display)
+COLUMN_METADATA = {
+    'subject': {
+        'id_alias': ('identifier', False, False, None),
+        'id': ('identifier', False, True, None),
+        'species': ('categorical', True, True, None),
+        'year_of_birth': ('numeric', True, True, None),
+        'year_of_death': ('numeric', True, True, None),
+        'cause_of_death': ('categorical', True, True, None),
+        'race': ('categorical', True, True, None),
+        'ethnicity': ('categorical', True, True, None),
+        **{f'subject_data_at_{data_source}': ('categorical', True, True, 'data_source') for data_source in DATA_SOURCES},
+    },
+    'observation': {
+        'vital_status': ('categorical', True, True, None),
+        'sex': ('categorical', True, True, None),
+        'year_of_observation': ('numeric', True, True, None),
+        'diagnosis': ('categorical', True, True, None),
+        'grade': ('categorical', True, True, None),
+        'stage': ('categorical', True, True, None),
+        'observed_anatomic_site': ('categorical', True, True, None),
+    },
+    'file': {
+        'id_alias': ('identifier', False, False, None),
+        'id': ('identifier', False, True, None),
+        'name': ('textual', False, True, None),
+        'drs_uri': ('textual', False, True, None),
+        'access': ('categorical', True, True, None),
+        'size': ('numeric', True, True, None),
+        'checksum_type': ('categorical', False, True, None),
+        'checksum_value': ('textual', False, True, None),
+        'format': ('categorical', True, True, None),
+        'file_type': ('categorical', True, True, None),
+        'category': ('categorical', True, True, None),
+        'data_modality': ('categorical', True, True, None),
+        **{f'file_data_at_{data_source}': ('categorical', True, True, 'data_source') for data_source in DATA_SOURCES},
+    },
+}
+
+SCHEMA_DDL = """
+CREATE TABLE controlled_term (
+    id_alias integer PRIMARY KEY,
+    name text NOT NULL
+);
+CREATE TABLE subject (
+    id_alias integer PRIMARY KEY,
+    id text NOT NULL,
+    species text,
+    year_of_birth integer,
+    year_of_death integer,
+    cause_of_death text,
+    race text,
+    ethnicity text,
+    subject_data_at_gdc boolean NOT NULL,
+    subject_data_at_pdc boolean NOT NULL,
+    subject_data_at_idc boolean NOT NULL
+);
+CREATE TABLE observation (
+    id_alias integer PRIMARY KEY,
+    observation_of_subject integer NOT NULL REFERENCES subject (id_alias),
+    vital_status text,
+    sex text,
+    year_of_observation integer,
+    diagnosis integer REFERENCES controlled_term (id_alias),
+    grade text,
+    stage text,
+    observed_anatomic_site text
+);
+CREATE TABLE observation_nulls (
+    observation_of_subject integer PRIMARY KEY REFERENCES subject (id_alias),
+    vital_status_null boolean NOT NULL,
+    sex_null boolean NOT NULL,
+    year_of_observation_null boolean NOT NULL,
+    diagnosis_null boolean NOT NULL,
+    grade_null boolean NOT NULL,
+    stage_null boolean NOT NULL,
+    observed_anatomic_site_null boolean NOT NULL
+);
+CREATE TABLE file (
+    id_alias integer PRIMARY KEY,
+    id text NOT NULL,
+    name text,
+    drs_uri text,
+    access text,
+    size bigint,
+    checksum_type text,
+    checksum_value text,
+    format text,
+    file_type text,
+    category text,
+    data_modality text,
+    file_data_at_gdc boolean NOT NULL,
+    file_data_at_pdc boolean NOT NULL,
+    file_data_at_idc boolean NOT NULL
+);
+CREATE TABLE file_describes_subject (
+    file_alias integer NOT NULL REFERENCES file (id_alias),
+    subject_alias integer NOT NULL REFERENCES subject (id_alias),
+    PRIMARY KEY (file_alias, subject_alias)
+);
+CREATE TABLE subject_keywords (
+    id_alias integer PRIMARY KEY,
+    keyword text NOT NULL
+);
+CREATE TABLE subject_keywords_in_subject (
+    subject_alias integer NOT NULL REFERENCES subject (id_alias),
+    keyword_alias integer NOT NULL REFERENCES subject_keywords (id_alias),
+    PRIMARY KEY (subject_alias, keyword_alias)
+);
+CREATE TABLE file_keywords (
+    id_alias integer PRIMARY KEY,
+    keyword text NOT NULL
+);
+CREATE TABLE file_keywords_in_file (
+    file_alias integer NOT NULL REFERENCES file (id_alias),
+    keyword_alias integer NOT NULL REFERENCES file_keywords (id_alias),
+    PRIMARY KEY (file_alias, keyword_alias)
+);
+CREATE TABLE subject_text_search (
+    subject_alias integer PRIMARY KEY REFERENCES subject (id_alias),
+    search_vector tsvector
+);
+CREATE TABLE file_text_search (
+    file_alias integer PRIMARY KEY REFERENCES file (id_alias),
+    search_vector tsvector
+);
+CREATE TABLE column_metadata (
+    cda_table text NOT NULL,
+    cda_column text NOT NULL,
+    column_type text,
+    summary_returns boolean NOT NULL,
+    data_returns boolean NOT NULL,
+    process_before_display text,
+    virtual_table text,
+    PRIMARY KEY (cda_table, cda_column)
+);
+CREATE TABLE release_metadata (
+    cda_table text NOT NULL,
+    cda_column text NOT NULL,
+    data_source text NOT NULL,
+    data_source_version text,
+    data_source_extraction_date date,
+    cda_row_count bigint,
+    PRIMARY KEY (cda_table, cda_column, data_source)
+);
+"""
+
+# Dropped in reverse dependency order
+TABLE_NAMES = [
+    'release_metadata', 'column_metadata', 'file_text_search', 'subject_text_search', 'file_keywords_in_file', 'file_keywords',
+    'subject_keywords_in_subject', 'subject_keywords', 'file_describes_subject', 'file', 'observation_nulls', 'observation',
+    'subject', 'controlled_term',
+]
+
+INDEX_DDL = """
+CREATE INDEX observation_observation_of_subject_idx ON observation (observation_of_subject);
+CREATE INDEX observation_diagnosis_idx ON observation (diagnosis);
+CREATE INDEX file_describes_subject_subject_alias_idx ON file_describes_subject (subject_alias, file_alias);
+CREATE INDEX subject_keywords_in_subject_keyword_alias_idx ON subject_keywords_in_subject (keyword_alias);
+CREATE INDEX file_keywords_in_file_keyword_alias_idx ON file_keywords_in_file (keyword_alias);
+CREATE INDEX subject_keywords_keyword_idx ON subject_keywords (upper(keyword));
+CREATE INDEX file_keywords_keyword_idx ON file_keywords (upper(keyword));
+CREATE INDEX subject_text_search_search_vector_idx ON subject_text_search USING gin (search_vector);
+CREATE INDEX file_text_search_search_vector_idx ON file_text_search USING gin (search_vector);
+"""
+
+
+def get_engine():
+    if not getenv("DB_USERNAME"):
+        load_dotenv(find_dotenv("cda_api/config/.env"))
+    url = f'postgresql://{getenv("DB_USERNAME")}:{getenv("DB_PASSWORD")}@{getenv("DB_HOSTNAME")}:{getenv("DB_PORT")}/{getenv("DB_DATABASE")}'
+    return create_engine(url)
+
+
+# Deterministic pseudo random integer in [0, 2^31) for a row expression and a salt
+def hashed(expression, salt):
+    return f"(hashtext(({expression})::text || '|{salt}') & 2147483647)"
+
+
+def sql_array(values):
+    return 'ARRAY[' + ', '.join("'" + value.replace("'", "''") + "'" for value in values) + ']'
+
+
+# Picks a value from the weighted list, returning null for roughly null_percent of rows
+def pick(values, expression, salt, null_percent=0):
+    value = f"({sql_array(values)})[1 + {hashed(expression, salt)} % {len(values)}]"
+    if null_percent:
+        return f"CASE WHEN {hashed(expression, f'{salt}_null')} % 100 < {null_percent} THEN NULL ELSE {value} END"
+    return value
+
+
+def get_controlled_terms():
+    terms = [f'{prefix}, nos' for prefix in DIAGNOSIS_PREFIXES]
+    terms += [f'{prefix} of {site}' for prefix in DIAGNOSIS_PREFIXES for site in ANATOMIC_SITE]
+    return terms
+
+
+def get_population_statements(scale):
+    subject_count = max(int(SUBJECTS_PER_SCALE * scale), 1)
+    file_count = max(int(FILES_PER_SCALE * scale), 1)
+    controlled_term_count = len(get_controlled_terms())
+    statements = []
+
+    statements.append(f"""
+        INSERT INTO controlled_term (id_alias, name)
+        SELECT ordinality::integer, name FROM unnest({sql_array(get_controlled_terms())}) WITH ORDINALITY AS t(name, ordinality)
+    """)
+
+    statements.append(f"""
+        INSERT INTO subject
+        SELECT
+            i,
+            'subject.' || lpad(i::text, 9, '0'),
+            {pick(SPECIES, 'i', 'species', 2)},
+            CASE WHEN {hashed('i', 'yob_null')} % 100 < 15 THEN NULL ELSE 1920 + {hashed('i', 'yob')} % 100 END,
+            CASE WHEN {hashed('i', 'yod_null')} % 100 < 70 THEN NULL ELSE 1960 + {hashed('i', 'yod')} % 64 END,
+            {pick(CAUSE_OF_DEATH, 'i', 'cause_of_death', 75)},
+            {pick(RACE, 'i', 'race', 20)},
+            {pick(ETHNICITY, 'i', 'ethnicity', 25)},
+            {hashed('i', 'gdc')} % 100 < 70,
+            {hashed('i', 'pdc')} % 100 < 15,
+            {hashed('i', 'idc')} % 100 < 30
+        FROM generate_series(1, {subject_count}) AS i
+    """)
+
+    # 1-3 observations per subject
+    statements.append(f"""
+        INSERT INTO observation
+        SELECT
+            (i - 1) * 3 + k,
+            i,
+            {pick(VITAL_STATUS, 'i * 3 + k', 'vital_status', 20)},
+            {pick(SEX, 'i', 'sex', 5)},
+            CASE WHEN {hashed('i * 3 + k', 'yoo_null')} % 100 < 30 THEN NULL ELSE 1990 + {hashed('i * 3 + k', 'yoo')} % 34 END,
+            CASE WHEN {hashed('i * 3 + k', 'diagnosis_null')} % 100 < 10 THEN NULL ELSE 1 + {hashed('i', 'diagnosis')} % {controlled_term_count} END,
+            {pick(GRADE, 'i * 3 + k', 'grade', 50)},
+            {pick(STAGE, 'i * 3 + k', 'stage', 40)},
+            {pick(ANATOMIC_SITE, 'i', 'site', 10)}
+        FROM generate_series(1, {subject_count}) AS i
+        CROSS JOIN LATERAL generate_series(1, 1 + {hashed('i', 'observations')} % 3) AS k
+    """)
+
+    # A subject is only marked null for a column when all of its observations are null
+    null_columns = ['vital_status', 'sex', 'year_of_observation', 'diagnosis', 'grade', 'stage', 'observed_anatomic_site']
+    statements.append(f"""
+        INSERT INTO observation_nulls
+        SELECT observation_of_subject, {', '.join(f'bool_and({column} IS NULL)' for column in null_columns)}
+        FROM observation
+        GROUP BY observation_of_subject
+    """)
+
+    statements.append(f"""
+        INSERT INTO file
+        SELECT
+            i,
+            'file.' || lpad(i::text, 10, '0'),
+            'synthetic_' || i || '.' || {pick(FORMAT, 'i', 'format')},
+            'drs://synthetic/' || md5(i::text),
+            {pick(ACCESS, 'i', 'access')},
+            ({hashed('i', 'size')}::bigint * 7) % 50000000000,
+            'md5',
+            md5('file' || i),
+            {pick(FORMAT, 'i', 'format', 1)},
+            {pick(FILE_TYPE, 'i', 'file_type', 5)},
+            {pick(CATEGORY, 'i', 'category', 5)},
+            {pick(DATA_MODALITY, 'i', 'data_modality', 5)},
+            {hashed('i', 'file_gdc')} % 100 < 75,
+            {hashed('i', 'file_pdc')} % 100 < 10,
+            {hashed('i', 'file_idc')} % 100 < 25
+        FROM generate_series(1, {file_count}) AS i
+    """)
+
+    # Every file describes one subject and roughly 20% describe a second one
+    statements.append(f"""
+        INSERT INTO file_describes_subject
+        SELECT DISTINCT i, subject_alias
+        FROM generate_series(1, {file_count}) AS i
+        CROSS JOIN LATERAL (
+            SELECT 1 + {hashed('i', 'describes')} % {subject_count} AS subject_alias
+            UNION ALL
+            SELECT 1 + {hashed('i', 'describes_second')} % {subject_count} WHERE {hashed('i', 'second')} % 100 < 20
+        ) AS subjects
+    """)
+
+    subject_values = """
+        SELECT id_alias AS alias, unnest(ARRAY[species, cause_of_death, race, ethnicity]) AS value FROM subject
+        UNION ALL
+        SELECT o.observation_of_subject, unnest(ARRAY[o.vital_status, o.sex, ct.name, o.grade, o.stage, o.observed_anatomic_site])
+        FROM observation o LEFT JOIN controlled_term ct ON ct.id_alias = o.diagnosis
+    """
+    file_values = "SELECT id_alias AS alias, unnest(ARRAY[access, format, file_type, category, data_modality]) AS value FROM file"
+    for table_name, values_query in [('subject', subject_values), ('file', file_values)]:
+        statements.append(f"""
+            INSERT INTO {table_name}_keywords
+            SELECT row_number() OVER (ORDER BY keyword), keyword
+            FROM (SELECT DISTINCT lower(value) AS keyword FROM ({values_query}) AS v WHERE value IS NOT NULL) AS k
+        """)
+        statements.append(f"""
+            INSERT INTO {table_name}_keywords_in_{table_name}
+            SELECT DISTINCT v.alias, k.id_alias
+            FROM ({values_query}) AS v
+            JOIN {table_name}_keywords k ON k.keyword = lower(v.value)
+        """)
+
+    statements.append("""
+        INSERT INTO subject_text_search
+        SELECT s.id_alias, to_tsvector('english', concat_ws(' ', s.id, s.species, s.cause_of_death, s.race, s.ethnicity, string_agg(ct.name, ' ')))
+        FROM subject s
+        LEFT JOIN observation o ON o.observation_of_subject = s.id_alias
+        LEFT JOIN controlled_term ct ON ct.id_alias = o.diagnosis
+        GROUP BY s.id_alias
+    """)
+    statements.append("""
+        INSERT INTO file_text_search
+        SELECT id_alias, to_tsvector('english', concat_ws(' ', id, name, format, file_type, category, data_modality))
+        FROM file
+    """)
+    return statements
+
+
+def get_metadata_statements(scale):
+    column_metadata_rows = []
+    for table_name, column_map in COLUMN_METADATA.items():
+        for column_name, (column_type, summary_returns, data_returns, process_before_display) in column_map.items():
+            column_metadata_rows.append({
+                'cda_table': table_name,
+                'cda_column': column_name,
+                'column_type': column_type,
+                'summary_returns': summary_returns,
+                'data_returns': data_returns,
+                'process_before_display': process_before_display,
+            })
+    release_metadata_rows = [
+        {'cda_table': row['cda_table'], 'cda_column': row['cda_column'], 'data_source': data_source.upper(), 'data_source_version': f'synthetic-{scale}'}
+        for row in column_metadata_rows
+        for data_source in DATA_SOURCES
+    ]
+    column_metadata_insert = text("""
+        INSERT INTO column_metadata (cda_table, cda_column, column_type, summary_returns, data_returns, process_before_display, virtual_table)
+        VALUES (:cda_table, :cda_column, :column_type, :summary_returns, :data_returns, :process_before_display, NULL)
+    """)
+    release_metadata_insert = text("""
+        INSERT INTO release_metadata (cda_table, cda_column, data_source, data_source_version, data_source_extraction_date, cda_row_count)
+        SELECT :cda_table, :cda_column, :data_source, :data_source_version, DATE '2024-01-01',
+               (SELECT reltuples::bigint FROM pg_class WHERE relname = :cda_table)
+    """)
+    return [(column_metadata_insert, column_metadata_rows), (release_metadata_insert, release_metadata_rows)]
+
+
+def build_synthetic_database(engine, scale, drop=False):
+    with engine.begin() as connection:
+        if drop:
+            for table_name in TABLE_NAMES:
+                connection.execute(text(f'DROP TABLE IF EXISTS {table_name} CASCADE'))
+        print('Creating tables')
+        connection.execute(text(SCHEMA_DDL))
+        for statement in get_population_statements(scale):
+            start_time = time.time()
+            table_name = statement.split('INSERT INTO')[1].split()[0]
+            connection.execute(text(statement))
+            print(f'Populated {table_name} in {time.time() - start_time:.1f}s')
+        print('Creating indexes')
+        connection.execute(text(INDEX_DDL))
+    # Analyze before filling release_metadata so it can use the planner row counts
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text('ANALYZE'))
+    with engine.begin() as connection:
+        for statement, rows in get_metadata_statements(scale):
+            connection.execute(statement, rows)
+    print('Synthetic database complete')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Builds a synthetic CDA database in the database configured by the DB_* environment variables')
+    parser.add_argument('--scale', type=float, default=1.0, help=f'Scale factor ({SUBJECTS_PER_SCALE} subjects and {FILES_PER_SCALE} files per unit)')
+    parser.add_argument('--drop', action='store_true', help='Drop existing CDA tables before building')
+    args = parser.parse_args()
+    build_synthetic_database(get_engine(), args.scale, drop=args.drop)
+
+
+if __name__ == "__main__":
+    main()
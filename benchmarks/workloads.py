@@ -0,0 +1,40 @@
+"""Representative requests replayed by the benchmark runner
+
+Each workload is (name, method, path, params, json body). Column names and values match the synthetic
+database built by benchmarks/synthetic_db.py.
+"""
+
+WORKLOADS = [
+    # /data
+    ('data_subject_unfiltered', 'POST', '/data/subject', {'limit': 100}, {}),
+    ('data_subject_equals', 'POST', '/data/subject', {'limit': 100}, {'MATCH_ALL': ['species = human']}),
+    ('data_subject_wildcard', 'POST', '/data/subject', {'limit': 100}, {'MATCH_ALL': ['race like *american*']}),
+    ('data_subject_foreign_filter', 'POST', '/data/subject', {'limit': 100}, {'MATCH_ALL': ['sex = female', 'vital_status = dead']}),
+    ('data_subject_controlled_term', 'POST', '/data/subject', {'limit': 100}, {'MATCH_ALL': ['diagnosis like adenocarcinoma*']}),
+    ('data_subject_match_some', 'POST', '/data/subject', {'limit': 100},
+     {'MATCH_ALL': ['species = human'], 'MATCH_SOME': ['year_of_birth < 1940', 'year_of_birth > 2000']}),
+    ('data_subject_add_columns', 'POST', '/data/subject', {'limit': 100}, {'MATCH_ALL': ['ethnicity = hispanic or latino'], 'ADD_COLUMNS': ['observation.*']}),
+    ('data_subject_file_filter', 'POST', '/data/subject', {'limit': 100}, {'MATCH_ALL': ['format = bam', 'subject_data_at_pdc = true']}),
+    ('data_subject_in_list', 'POST', '/data/subject', {'limit': 100}, {'MATCH_ALL': [f'subject_id_alias in [{", ".join(str(i) for i in range(1, 1001))}]']}),
+    ('data_subject_search', 'POST', '/data/subject', {'limit': 100}, {'SEARCH_LIST': ['melanoma', 'female']}),
+    ('data_subject_deep_page', 'POST', '/data/subject', {'limit': 100, 'offset': 5000}, {'MATCH_ALL': ['species = human']}),
+    ('data_file_unfiltered', 'POST', '/data/file', {'limit': 100}, {}),
+    ('data_file_filtered', 'POST', '/data/file', {'limit': 100}, {'MATCH_ALL': ['size < 1000000000', 'format like b*']}),
+    ('data_file_subject_filter', 'POST', '/data/file', {'limit': 100}, {'MATCH_ALL': ['species = mouse'], 'ADD_COLUMNS': ['sex']}),
+    ('data_file_collated', 'POST', '/data/file', {'limit': 100}, {'MATCH_ALL': ['category = imaging'], 'ADD_COLUMNS': ['subject.*'], 'COLLATE_RESULTS': True}),
+    # /summary
+    ('summary_subject_unfiltered', 'POST', '/summary/subject', {}, {}),
+    ('summary_subject_filtered', 'POST', '/summary/subject', {}, {'MATCH_ALL': ['species = human', 'cause_of_death is not null']}),
+    ('summary_subject_foreign', 'POST', '/summary/subject', {}, {'MATCH_ALL': ['sex = male'], 'ADD_COLUMNS': ['diagnosis', 'stage']}),
+    ('summary_subject_search', 'POST', '/summary/subject', {}, {'SEARCH_LIST': ['lung']}),
+    ('summary_file_unfiltered', 'POST', '/summary/file', {}, {}),
+    ('summary_file_filtered', 'POST', '/summary/file', {}, {'MATCH_ALL': ['access = open', 'file_data_at_gdc = true']}),
+    ('summary_file_subject_filter', 'POST', '/summary/file', {}, {'MATCH_ALL': ['race = asian']}),
+    # /column_values
+    ('column_values_species', 'POST', '/column_values/species', {'limit': 100}, None),
+    ('column_values_diagnosis', 'POST', '/column_values/diagnosis', {'limit': 100}, None),
+    ('column_values_format_data_source', 'POST', '/column_values/format', {'limit': 100, 'data_source': 'GDC'}, None),
+    # metadata
+    ('columns', 'GET', '/columns/', {}, None),
+    ('release_metadata', 'GET', '/release_metadata/', {}, None),
+]
@@ -10,6 +10,12 @@ from cda_api.classes.exceptions import (
     SystemNotFound,
     TableNotFound,
     InvalidFilterError,
-    InvalidSearchError
+    InvalidSearchError,
+    CohortNotFound,
+    InvalidCohortError,
+    QueryCostExceeded,
+    LaneQueueFull,
+    InvalidBatchRequest,
+    InvalidExportFormat
 )
 from cda_api.main import app
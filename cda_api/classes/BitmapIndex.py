@@ -0,0 +1,220 @@
+import threading
+from os import getenv
+
+from sqlalchemy import Boolean, String, func
+
+from cda_api import get_logger
+from cda_api.db.connection import session
+
+try:
+    from pyroaring import BitMap
+except ImportError:
+    BitMap = None
+
+log = get_logger('BitmapIndex.py')
+
+# Evaluate MATCH_ALL/MATCH_SOME filters on file and subject columns against in-memory roaring bitmaps (off by default, requires pyroaring)
+BITMAP_INDEX_ENABLED = getenv("BITMAP_INDEX_ENABLED", "false").lower() == "true"
+# Comma separated columns to index (ex. "sex,file_data_at_gdc"). Defaults to every categorical and boolean column of file and subject
+BITMAP_INDEX_COLUMNS = [column_name.strip() for column_name in getenv("BITMAP_INDEX_COLUMNS", "").split(",") if column_name.strip()]
+# Columns with more distinct values than this are not indexed
+BITMAP_INDEX_MAX_VALUES = int(getenv("BITMAP_INDEX_MAX_VALUES", 1000))
+# ID sets larger than this are filtered in the database instead of being bound to the query
+BITMAP_INDEX_MAX_IDS = int(getenv("BITMAP_INDEX_MAX_IDS", 500000))
+
+BITMAP_OPERATORS = ['=', '!=', 'in', 'not in', 'is', 'is not']
+
+
+class ColumnBitmapIndex:
+    """Bitmaps of the endpoint aliases having each value of a column.
+    String values are keyed on upper(value) to match the case insensitive filters. Null values are keyed on None."""
+    def __init__(self, column_info, all_ids, value_bitmaps):
+        self.column_info = column_info
+        self.all_ids = all_ids
+        self.value_bitmaps = value_bitmaps
+        self.is_string = isinstance(column_info.db_column.type, String)
+
+    def __repr__(self):
+        return f"ColumnBitmapIndex({self.column_info.name}, values={len(self.value_bitmaps)})"
+
+    def _get_value_type_matches(self, value):
+        if self.is_string:
+            return isinstance(value, str)
+        return isinstance(value, bool) or ((not isinstance(value, str)) and (value is not None))
+
+    def can_evaluate(self, filter_operator, filter_value):
+        if filter_operator not in BITMAP_OPERATORS:
+            return False
+        if filter_operator in ['is', 'is not']:
+            # Strings treat null as an empty string so "is null" can't be told apart from "= ''"
+            return (not self.is_string) and (filter_value is None or isinstance(filter_value, bool))
+        values = filter_value if filter_operator in ['in', 'not in'] else [filter_value]
+        return all(self._get_value_type_matches(value) for value in values)
+
+    def _get_bitmap(self, key):
+        return self.value_bitmaps.get(key, BitMap())
+
+    # Mirrors case_insensitive_equals() where an empty string also matches null
+    def _equals(self, value):
+        if self.is_string:
+            bitmap = self._get_bitmap(value.upper())
+            if value == '':
+                bitmap = bitmap | self._get_bitmap(None)
+            return bitmap
+        return self._get_bitmap(value)
+
+    def evaluate(self, filter_operator, filter_value):
+        match filter_operator:
+            case '=' | 'is':
+                return self._equals(filter_value)
+            case '!=':
+                bitmap = self.all_ids - self._equals(filter_value)
+            case 'in':
+                return BitMap.union(BitMap(), *[self._equals(value) for value in filter_value])
+            case 'not in':
+                bitmap = self.all_ids - BitMap.union(BitMap(), *[self._equals(value) for value in filter_value])
+            case 'is not':
+                return self.all_ids - self._get_bitmap(filter_value)
+        # SQL comparisons with null are never true for non-string columns
+        if not self.is_string:
+            bitmap = bitmap - self._get_bitmap(None)
+        return bitmap
+
+
+class BitmapIndex:
+    """Per release bitmaps of the endpoint aliases (file_alias and subject_alias) having each value of the indexed columns.
+    Bitmaps are stored by table and column name so they stay valid when DB_INFO.reset() rebuilds the same release"""
+    def __init__(self, db_info):
+        self.all_ids = {}
+        self.column_indexes = {}
+        db = session()
+        try:
+            for table_info in db_info.local_table_infos:
+                self._build_table_indexes(db, table_info)
+        finally:
+            db.close()
+
+    def __repr__(self):
+        return f"BitmapIndex(columns={list(self.column_indexes.keys())})"
+
+    def _is_indexable(self, column_info, table_info):
+        if column_info == table_info.primary_key_column_info:
+            return False
+        if (column_info.selectable_table_info != table_info) or column_info.controlled_term:
+            return False
+        if BITMAP_INDEX_COLUMNS:
+            return column_info.name in BITMAP_INDEX_COLUMNS
+        return (column_info.column_type == 'categorical') or isinstance(column_info.db_column.type, Boolean)
+
+    def _build_table_indexes(self, db, table_info):
+        alias_column = table_info.primary_key_column_info.db_column
+        all_ids = BitMap(value for (value,) in db.query(alias_column).yield_per(100000))
+        self.all_ids[table_info.name] = all_ids
+        for column_info in table_info.column_infos:
+            if not self._is_indexable(column_info, table_info):
+                continue
+            is_string = isinstance(column_info.db_column.type, String)
+            value_column = func.upper(column_info.db_column) if is_string else column_info.db_column
+            result = db.query(value_column, func.array_agg(alias_column)).group_by(value_column).limit(BITMAP_INDEX_MAX_VALUES + 1).all()
+            if len(result) > BITMAP_INDEX_MAX_VALUES:
+                log.info(f'Not indexing {column_info} because it has more than {BITMAP_INDEX_MAX_VALUES} values')
+                continue
+            self.column_indexes[column_info.table_column_name] = ColumnBitmapIndex(column_info, all_ids, {value: BitMap(ids) for value, ids in result})
+            log.info(f'Built bitmap index for {column_info} with {len(result)} values')
+
+    def get_filtered_ids(self, query_object, filter_preselect_map):
+        """Evaluates the MATCH_ALL and MATCH_SOME filters of a query against the bitmaps
+
+        Args:
+            query_object (DataQuery | SummaryQuery): Query whose filters are evaluated
+            filter_preselect_map (dict): Map of table_info to the column_info selected for it in the preselect
+
+        Returns:
+            BitMap | None: Matching endpoint aliases or None if any filter can't be evaluated with the bitmaps
+        """
+        endpoint_table_info = query_object.endpoint_table_info
+        # The preselect has to consist of only the endpoint alias for it to be replaced by an ID set
+        if (list(filter_preselect_map.keys()) != [endpoint_table_info]) or query_object.search_filter_info:
+            return None
+        match_all_bitmaps = []
+        match_some_bitmaps = []
+        for filter_info in query_object.get_filter_infos():
+            column_index = self.column_indexes.get(filter_info.filter_column_info.table_column_name)
+            if (column_index is None) or (filter_info.filter_column_info.parent_table_info != endpoint_table_info):
+                return None
+            if not column_index.can_evaluate(filter_info.filter_operator, filter_info.filter_value):
+                return None
+            bitmap = column_index.evaluate(filter_info.filter_operator, filter_info.filter_value)
+            if filter_info.filter_type == 'match_all':
+                match_all_bitmaps.append(bitmap)
+            else:
+                match_some_bitmaps.append(bitmap)
+
+        filtered_ids = self.all_ids[endpoint_table_info.name]
+        if match_all_bitmaps:
+            filtered_ids = BitMap.intersection(*match_all_bitmaps)
+        if match_some_bitmaps:
+            filtered_ids = filtered_ids & BitMap.union(*match_some_bitmaps)
+        return filtered_ids
+
+
+if BITMAP_INDEX_ENABLED and (BitMap is None):
+    log.warning('BITMAP_INDEX_ENABLED is set but pyroaring is not installed. Filtering in the database instead')
+
+
+class BitmapIndexLoader:
+    """Loads the BitmapIndex of the current release in a background thread (once per release_key) so neither startup
+    nor the request that rebuilds DatabaseInfo waits on it. Filters are evaluated in the database until it is loaded"""
+    def __init__(self):
+        self.bitmap_index = None
+        self.release_key = None
+        self.loading_release_key = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"BitmapIndexLoader(release={self.release_key}, loading={self.loading_release_key})"
+
+    def start_loading(self, db_info):
+        """Starts loading the bitmap index of the current release unless it is already loaded or loading
+
+        Args:
+            db_info (DatabaseInfo): Database info of the current release
+        """
+        if (not BITMAP_INDEX_ENABLED) or (BitMap is None):
+            return
+        with self._lock:
+            if db_info.release_key in [self.release_key, self.loading_release_key]:
+                return
+            self.loading_release_key = db_info.release_key
+        thread = threading.Thread(target=self._load, args=(db_info, db_info.release_key), name='bitmap-index', daemon=True)
+        thread.start()
+
+    def _load(self, db_info, release_key):
+        log.info(f'Building bitmap index for release {release_key}')
+        try:
+            bitmap_index = BitmapIndex(db_info)
+            with self._lock:
+                self.bitmap_index = bitmap_index
+                self.release_key = release_key
+            log.info(f'Built bitmap index for release {release_key}')
+        except Exception as e:
+            log.error(f'Failed to build the bitmap index for release {release_key}: {e}')
+        finally:
+            # A failed load is retried by the next request
+            with self._lock:
+                if self.loading_release_key == release_key:
+                    self.loading_release_key = None
+
+    def get(self, db_info):
+        self.start_loading(db_info)
+        if self.release_key != db_info.release_key:
+            return None
+        return self.bitmap_index
+
+
+BITMAP_INDEX_LOADER = BitmapIndexLoader()
+
+
+# Returns the current release's BitmapIndex or None if bitmap indexing is disabled, pyroaring is not installed or the index is still loading
+def get_bitmap_index(db_info):
+    return BITMAP_INDEX_LOADER.get(db_info)
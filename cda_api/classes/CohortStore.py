@@ -0,0 +1,90 @@
+import threading
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import Column, DateTime, MetaData, Table, Text, delete, select, text
+from sqlalchemy.dialects.postgresql import JSONB
+
+from cda_api import get_logger
+from cda_api.db.connection import session
+from .TTLCache import TTLCache
+
+log = get_logger('CohortStore.py')
+
+
+class DatabaseCohortStore:
+    """Cohorts stored in a table of the database so every worker and replica behind a load balancer sees the same handles
+    and they survive restarts. The table lives in its own schema so it is never automapped as a CDA table.
+    Recently used cohorts are also kept in memory so paging through a cohort filter doesn't fetch its IDs every time.
+    Has the get/set/expires_in interface of the TTLCache used when cohorts are kept in memory"""
+    def __init__(self, schema, table_name, ttl_seconds, max_entries):
+        self.schema = schema
+        self.ttl_seconds = ttl_seconds
+        self.table = Table(
+            table_name,
+            MetaData(schema=schema),
+            Column('handle', Text, primary_key=True),
+            Column('ids', JSONB, nullable=False),
+            Column('expires_at', DateTime(timezone=True), nullable=False, index=True),
+        )
+        # Entries are (ids, expires_at) and are checked against expires_at since it may be sooner than the local TTL
+        self.local_cache = TTLCache('cohort', ttl_seconds, max_entries)
+        self._table_created = False
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"DatabaseCohortStore({self.schema}.{self.table.name}, local={self.local_cache})"
+
+    def _create_table(self, db):
+        with self._lock:
+            if self._table_created:
+                return
+            log.info(f'Creating {self.schema}.{self.table.name} if it does not exist')
+            db.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{self.schema}"'))
+            self.table.create(db.connection(), checkfirst=True)
+            db.commit()
+            self._table_created = True
+
+    def set(self, handle, ids):
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=self.ttl_seconds)
+        db = session()
+        try:
+            self._create_table(db)
+            # Expired cohorts are removed whenever a new one is stored
+            db.execute(delete(self.table).where(self.table.c.expires_at <= datetime.now(timezone.utc)))
+            db.execute(self.table.insert().values(handle=handle, ids=list(ids), expires_at=expires_at))
+            db.commit()
+        finally:
+            db.close()
+        self.local_cache.set(handle, (ids, expires_at))
+
+    def _get_entry(self, handle):
+        entry = self.local_cache.get(handle)
+        if entry is not None:
+            if entry[1] > datetime.now(timezone.utc):
+                return entry
+            self.local_cache.delete(handle)
+            return None
+        db = session()
+        try:
+            self._create_table(db)
+            row = db.execute(
+                select(self.table.c.ids, self.table.c.expires_at).where(self.table.c.handle == handle, self.table.c.expires_at > datetime.now(timezone.utc))
+            ).first()
+        finally:
+            db.close()
+        if row is None:
+            return None
+        entry = (tuple(sorted(row.ids)), row.expires_at)
+        self.local_cache.set(handle, entry)
+        return entry
+
+    def get(self, handle, default=None):
+        entry = self._get_entry(handle)
+        return default if entry is None else entry[0]
+
+    def expires_in(self, handle):
+        entry = self._get_entry(handle)
+        if entry is None:
+            return None
+        return max((entry[1] - datetime.now(timezone.utc)).total_seconds(), 0)
+
@@ -0,0 +1,168 @@
+import threading
+import time
+from os import getenv
+
+from sqlalchemy import String, func
+
+from cda_api import get_logger
+from cda_api.db.connection import session
+from cda_api.db.filter_functions import like_pattern_to_regex
+
+log = get_logger('ColumnValueIndex.py')
+
+# Columns with more distinct values than this fall back to a like filter in the database (backed by a trigram index).
+# 0 turns the expansion off
+LIKE_EXPANSION_MAX_VALUES = int(getenv("LIKE_EXPANSION_MAX_VALUES", 10000))
+# Indexes older than this are rebuilt in the background and not used until they are (like filters run in the database meanwhile)
+LIKE_EXPANSION_MAX_AGE_SECONDS = int(getenv("LIKE_EXPANSION_MAX_AGE_SECONDS", 3600))
+
+
+class ColumnValueIndex:
+    """In-memory trigram index over the distinct values of a column.
+    Used to expand like filters into the list of matching values before the query is built.
+    Values are matched on their upper() computed by the database so the expansion agrees with upper(column) LIKE upper(pattern)"""
+    def __init__(self, column_info, rows):
+        self.column_info = column_info
+        rows = [(value, upper_value) for value, upper_value in rows if value is not None]
+        self.values = [value for value, _ in rows]
+        self.upper_values = [upper_value for _, upper_value in rows]
+        self.trigram_map = {}
+        for index, upper_value in enumerate(self.upper_values):
+            for trigram in self._get_trigrams(upper_value):
+                if trigram not in self.trigram_map.keys():
+                    self.trigram_map[trigram] = set()
+                self.trigram_map[trigram].add(index)
+
+    def __repr__(self):
+        return f"ColumnValueIndex({self.column_info.name}, values={len(self.values)})"
+
+    def _get_trigrams(self, string):
+        return set([string[i:i + 3] for i in range(len(string) - 2)])
+
+    def _get_candidate_indexes(self, upper_pattern):
+        # Every literal piece of the pattern has to appear in a matching value so only values sharing all of their trigrams need checking
+        candidate_indexes = None
+        for literal in upper_pattern.replace('_', '%').split('%'):
+            for trigram in self._get_trigrams(literal):
+                trigram_indexes = self.trigram_map.get(trigram, set())
+                candidate_indexes = trigram_indexes if candidate_indexes is None else candidate_indexes & trigram_indexes
+                if not candidate_indexes:
+                    return set()
+        if candidate_indexes is None:
+            return range(len(self.values))
+        return candidate_indexes
+
+    def match(self, pattern):
+        """Returns the values of the column matching a case insensitive like pattern
+
+        Args:
+            pattern (str): SQL like pattern
+
+        Returns:
+            list | None: Matching values or None if the pattern has to be evaluated in the database
+                         (non-ASCII patterns, whose upper() can differ between Python and the database locale)
+        """
+        if not pattern.isascii():
+            return None
+        upper_pattern = pattern.upper()
+        regex = like_pattern_to_regex(upper_pattern, ignore_case=False)
+        return [self.values[index] for index in sorted(self._get_candidate_indexes(upper_pattern)) if regex.fullmatch(self.upper_values[index])]
+
+
+def can_expand(column_info):
+    return (column_info.column_type == 'categorical') and isinstance(column_info.db_column.type, String) and (not column_info.controlled_term)
+
+
+def build_column_value_index(db, column_info):
+    """Fetches the distinct values of a column and indexes them
+
+    Args:
+        db (Session): Database session
+        column_info (ColumnInfo): Categorical string column
+
+    Returns:
+        ColumnValueIndex | None: Index of the column or None if it has more than LIKE_EXPANSION_MAX_VALUES values
+    """
+    db_column = column_info.db_column
+    rows = db.query(db_column, func.upper(db_column)).distinct().limit(LIKE_EXPANSION_MAX_VALUES + 1).all()
+    if len(rows) > LIKE_EXPANSION_MAX_VALUES:
+        return None
+    return ColumnValueIndex(column_info, rows)
+
+
+class ColumnValueIndexes:
+    """Column value indexes of the current release, built in a background thread once per release (keyed on its release_key)
+    and rebuilt once they are older than LIKE_EXPANSION_MAX_AGE_SECONDS. Requests never build an index themselves.
+    Indexes are stored by table and column name since DB_INFO.reset() rebuilds the ColumnInfo objects of the same release"""
+    def __init__(self):
+        self.indexes = {}
+        self.release_key = None
+        self.built_at = None
+        self.building = False
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"ColumnValueIndexes(release={self.release_key}, indexes={len(self.indexes)})"
+
+    def _is_fresh(self):
+        return (self.built_at is not None) and (time.monotonic() - self.built_at <= LIKE_EXPANSION_MAX_AGE_SECONDS)
+
+    def start_building(self, db_info):
+        """Builds the indexes of every expandable column of the current release in a background thread
+        unless they are already built (and fresh) or being built
+
+        Args:
+            db_info (DatabaseInfo): Database info of the current release
+        """
+        if LIKE_EXPANSION_MAX_VALUES <= 0:
+            return
+        with self._lock:
+            if self.building or ((self.release_key == db_info.release_key) and self._is_fresh()):
+                return
+            self.building = True
+        thread = threading.Thread(target=self._build, args=(db_info, db_info.release_key), name='column-value-indexes', daemon=True)
+        thread.start()
+
+    def _build(self, db_info, release_key):
+        log.info(f'Building column value indexes for release {release_key}')
+        indexes = {}
+        db = session()
+        try:
+            for column_info in db_info.all_column_infos:
+                if can_expand(column_info):
+                    indexes[column_info.table_column_name] = build_column_value_index(db, column_info)
+            with self._lock:
+                self.indexes = indexes
+                self.release_key = release_key
+                self.built_at = time.monotonic()
+            log.info(f'Built column value indexes of {len([index for index in indexes.values() if index is not None])} columns for release {release_key}')
+        except Exception as e:
+            log.error(f'Failed to build column value indexes for release {release_key}: {e}')
+        finally:
+            db.close()
+            with self._lock:
+                self.building = False
+
+    def get(self, db_info, column_info):
+        """Returns the index of a column or None if the column can't be expanded or the current release's index isn't (freshly) built.
+        Starts building the indexes when they are missing or stale
+
+        Args:
+            db_info (DatabaseInfo): Database info of the current release
+            column_info (ColumnInfo): Filtered column
+
+        Returns:
+            ColumnValueIndex | None: Index of the column
+        """
+        self.start_building(db_info)
+        if (self.release_key != db_info.release_key) or (not self._is_fresh()):
+            return None
+        return self.indexes.get(column_info.table_column_name)
+
+
+COLUMN_VALUE_INDEXES = ColumnValueIndexes()
+
+
+# Returns the ColumnValueIndex of a column or None when the filter has to run in the database
+def get_column_value_index(db_info, column_info):
+    return COLUMN_VALUE_INDEXES.get(db_info, column_info)
@@ -1,7 +1,7 @@
 from cda_api import SystemNotFound
 from cda_api.classes.DatabaseInfo import DatabaseInfo
-from cda_api.db.query_functions import get_selectable_db_column_and_possible_join
-from sqlalchemy import func
+from cda_api.db.query_functions import bind_array, get_selectable_db_column_and_possible_join
+from sqlalchemy import Integer, Text, cast, func
 
 
 class ColumnValuesQuery:
@@ -10,15 +10,25 @@ class ColumnValuesQuery:
         self.db_info = db_info
 
         column_info = self.db_info.get_column_info(column_name)
+        self.column_info = column_info
 
         db_column, join = get_selectable_db_column_and_possible_join(column_info)
 
         column_values_query = db.query(db_column, func.count().label("value_count"))\
-                                .select_from(column_info.parent_table_info.db_table)\
-                                .group_by(db_column)\
-                                .order_by(db_column)
+                                .select_from(column_info.parent_table_info.db_table)
         if join:
             column_values_query = column_values_query.join(**join)
+        if column_info.controlled_term:
+            # Values are stored as controlled_term id_alias but are returned (and paged) ordered by name
+            controlled_term_names = self._get_controlled_term_names()
+            column_values_query = column_values_query\
+                                    .join(controlled_term_names, controlled_term_names.c.id_alias == db_column, isouter=True)\
+                                    .group_by(db_column, controlled_term_names.c.name)\
+                                    .order_by(func.coalesce(controlled_term_names.c.name, cast(db_column, Text)).collate('C').asc().nulls_last(), db_column)
+        else:
+            column_values_query = column_values_query\
+                                    .group_by(db_column)\
+                                    .order_by(db_column)
 
         if data_source_string:
             for source in data_source_string.split(','):
@@ -33,6 +43,14 @@ class ColumnValuesQuery:
 
         self.column_values_query = column_values_query.subquery("column_json")
 
+    # In memory controlled_term map as a table -> unnest(:id_aliases, :names) AS controlled_term_names(id_alias, name)
+    def _get_controlled_term_names(self):
+        controlled_term_map = self.db_info.controlled_term_map
+        return func.unnest(
+            bind_array(controlled_term_map.keys(), Integer()),
+            bind_array(controlled_term_map.values(), Text())
+        ).table_valued('id_alias', 'name').render_derived(name='controlled_term_names')
+
     def get_query(self):
         query = self.db.query(func.row_to_json(self.column_values_query.table_valued()))
         return query
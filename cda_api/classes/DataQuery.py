@@ -6,6 +6,9 @@ from sqlalchemy import func, Label
 from cda_api.db.query_functions import get_selectable_db_column_and_possible_join
 
 class DataQuery:
+    # Budget used by the admission check (see db/admission.py)
+    query_type = 'data'
+
     def __init__(self, db, db_info: DatabaseInfo, endpoint_table_name, request_body: DataRequestBody, log):
         # Initailize arguments
         self.db = db
@@ -13,6 +16,8 @@ class DataQuery:
         self.endpoint_table_info = self.db_info.get_table_info(endpoint_table_name)
         self.request_body = request_body
         self.log = log
+        # Data queries always return every matching row
+        self.sample_rate = None
 
         # Set useful variables
         self.endpoint_alias = self.endpoint_table_info.primary_key_column_info
@@ -61,6 +66,9 @@ class DataQuery:
     def _build_select_columns_and_joins(self):
         self.select_map = {}
         self.select_joins = []
+        # Map of select column name to (construct_type, column_infos) used to type exports: construct_type is None for
+        # endpoint table columns, 'array' for arrays of one column and 'json' for collated lists of the columns' objects
+        self.select_column_info_map = {}
         for table_info, value in self.table_column_and_filter_map.items():
             column_infos = value['column_infos']
             filter_infos = value['filter_infos']
@@ -83,6 +91,7 @@ class DataQuery:
                         continue
                     db_column, join = get_selectable_db_column_and_possible_join(column_info) 
                     local_select_columns.append(db_column)
+                    self.select_column_info_map[column_info.name] = (None, [column_info])
                     if join:
                         select_joins.append(join)
                 self.select_map[table_info][table_info.name] = local_select_columns
@@ -104,6 +113,8 @@ class DataQuery:
                         virtual_select_columns, virtual_select_joins = build_foreign_preselect(construct_type, self.db, self.endpoint_table_info, virtual_table_info.primary_table_info, related_filtered_preselect_query, virtual_table_info, v_column_infos, filter_infos, self.log)
                         select_columns.extend(virtual_select_columns)
                         select_joins.extend(virtual_select_joins)
+                        for column_info in v_column_infos:
+                            self.select_column_info_map[column_info.name] = (construct_type, [column_info])
             
             # Add foreign table select columns:
             else:
@@ -124,6 +135,14 @@ class DataQuery:
                 foreign_select_columns, foreign_select_joins = build_foreign_preselect(construct_type, self.db, self.endpoint_table_info, relating_table_info, related_filtered_preselect_query, table_info, column_infos, filter_infos, self.log)
                 select_columns.extend(foreign_select_columns)
                 select_joins.extend(foreign_select_joins)
+                if construct_type == 'array':
+                    for column_info in column_infos:
+                        self.select_column_info_map[column_info.name] = (construct_type, [column_info])
+                else:
+                    # build_foreign_preselect puts the table's own columns before the arrays of its virtual tables' columns
+                    own_column_infos = [column_info for column_info in column_infos if column_info.parent_table_info == table_info]
+                    virtual_column_infos = [column_info for column_info in column_infos if column_info.parent_table_info != table_info]
+                    self.select_column_info_map[f'{table_info.name}_columns'] = (construct_type, own_column_infos + virtual_column_infos)
             
 
             # Add the select columns where they belong in the select_map
@@ -1,8 +1,11 @@
+import hashlib
+
 from .ColumnInfo import ColumnInfo
 from .TableInfo import TableInfo
 from .TableRelationship import TableRelationship
 from cda_api import get_logger, TableNotFound, ColumnNotFound, RelationshipNotFound
 from cda_api.db.connection import session
+from cda_api.metrics import DATABASE_INFO_REBUILDS
 from sqlalchemy import func
 from sqlalchemy.sql.schema import Column, Table
 
@@ -21,6 +24,10 @@ class DatabaseInfo:
         self._assign_null_columns()
         self._assign_foreign_key_column_infos()
         self._assign_primary_table_infos()
+        self._build_controlled_term_map()
+        self._build_release_key()
+        # Lazily populated by get_summary_snapshot()
+        self.summary_snapshot = None
         
     def _build_sqlalchemy_components(self):
         setup_log.info("Building variables from automapped Base")
@@ -114,6 +121,31 @@ class DatabaseInfo:
         for table_info in self.table_infos:
             table_info.set_primary_table_info()
     
+    def _build_controlled_term_map(self):
+        # controlled_term is small and static per release so keep it in memory instead of joining to it in every query
+        setup_log.info("Fetching info from the controlled_term table")
+        controlled_term_table_info = self.get_table_info('controlled_term')
+        id_alias_column = controlled_term_table_info.get_column_info('id_alias').db_column
+        name_column = controlled_term_table_info.get_column_info('name').db_column
+        db = session()
+        try:
+            result = db.query(id_alias_column, name_column).all()
+        finally:
+            db.close()
+        self.controlled_term_map = {id_alias: name for id_alias, name in result}
+
+    def _build_release_key(self):
+        # Identifies the loaded release so results shared or cached between requests are never mixed across releases
+        setup_log.info("Fetching info from the release_metadata table")
+        release_metadata = self.db_tables["release_metadata"]
+        db = session()
+        try:
+            result = db.query(release_metadata).all()
+        finally:
+            db.close()
+        release_rows = sorted([str(tuple(row)) for row in result])
+        self.release_key = hashlib.sha256('\n'.join(release_rows).encode()).hexdigest()[:16]
+
     def get_column_info(self, column, table = None) -> ColumnInfo:
         if table is None:
             potential_column_infos = []
@@ -159,4 +191,5 @@ class DatabaseInfo:
         return local_table_info.get_table_relationship(foreign_table)
     
     def reset(self, db_base):
+        DATABASE_INFO_REBUILDS.inc()
         self.__init__(db_base)
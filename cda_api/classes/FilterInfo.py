@@ -1,7 +1,8 @@
 from sqlalchemy.sql import select, exists
 from .DatabaseInfo import DatabaseInfo
+from .ColumnValueIndex import get_column_value_index
 from cda_api import RelationshipError
-from cda_api.db.filter_functions import parse_filter_string, apply_filter_operator
+from cda_api.db.filter_functions import parse_filter_string, apply_filter_operator, match_controlled_term_ids, format_filter_value, expanded_like
 
 class FilterInfo:
     def __init__(self, filter_string, filter_type, db_info: DatabaseInfo, log):
@@ -15,7 +16,7 @@ class FilterInfo:
     
     def __repr__(self):
         repr_components = [
-            f'FilterInfo({self.filter_column_info.name} {self.filter_operator} {self.filter_value})'
+            f'FilterInfo({self.filter_column_info.name} {self.filter_operator} {format_filter_value(self.filter_value)})'
         ]
         return '\n'.join(repr_components)
     
@@ -26,6 +27,14 @@ class FilterInfo:
         self.local_filter_clause = apply_filter_operator(self.filter_column_info.db_column, self.filter_value, self.filter_operator, self.log)
         self.exclusively_null = False
 
+        # Expand wildcard filters on low cardinality columns into the list of matching values so they don't scan the table
+        if (self.filter_operator in ['like', 'not like']) and isinstance(self.filter_value, str):
+            column_value_index = get_column_value_index(self.db_info, self.filter_column_info)
+            matching_values = None if column_value_index is None else column_value_index.match(self.filter_value)
+            if matching_values is not None:
+                self.log.debug(f'Expanded {self.filter_string} to {len(matching_values)} matching values')
+                self.local_filter_clause = expanded_like(self.filter_column_info.db_column, matching_values, self.filter_value, negate=(self.filter_operator == 'not like'))
+
         # Override if exclusively null
         if (self.filter_operator == 'is') and (self.filter_value is None):
             self.exclusively_null = True
@@ -46,6 +55,20 @@ class FilterInfo:
                 self.exclusively_null = False
         
     
+    def get_controlled_term_filter_clause(self):
+        # Resolve the filter against the in-memory controlled_term map so the query only has to compare id_alias integers
+        controlled_term_ids = match_controlled_term_ids(self.db_info.controlled_term_map, self.filter_value, self.filter_operator)
+        if controlled_term_ids is not None:
+            self.log.debug(f'Resolved {self} to {len(controlled_term_ids)} controlled_term ids')
+            return self.filter_column_info.db_column.in_(controlled_term_ids)
+
+        # Fall back to filtering the controlled_term table for operators that can't be evaluated in memory
+        controlled_term_table_info = self.db_info.get_table_info('controlled_term')
+        controlled_term_filter_clause = apply_filter_operator(controlled_term_table_info.get_column_info('name').db_column, self.filter_value, self.filter_operator, self.log)
+        controlled_term_filter_subquery = select(controlled_term_table_info.primary_key_column_info.db_column)\
+                                                .filter(controlled_term_filter_clause)
+        return self.filter_column_info.db_column.in_(controlled_term_filter_subquery)
+
     def get_filterable_preselect(self, filter_preselect_map, endpoint_table_info):
         filter_table_info = self.filter_column_info.parent_table_info
         filterable_table_info = filter_table_info.primary_table_info
@@ -81,14 +104,10 @@ class FilterInfo:
                 subquery = subquery.filter(additional_filter)
         
         if self.filter_column_info.controlled_term and self.filter_value is not None:
-            controlled_term_table_info = self.db_info.get_table_info('controlled_term')
-            controlled_term_filter_clause = apply_filter_operator(controlled_term_table_info.get_column_info('name').db_column, self.filter_value, self.filter_operator, self.log)
-            controlled_term_filter_subquery = select(controlled_term_table_info.primary_key_column_info.db_column)\
-                                                    .filter(controlled_term_filter_clause)
-            
+            controlled_term_filter_clause = self.get_controlled_term_filter_clause()
             if local_controlled_term_filter:
-                return self.filter_column_info.db_column.in_(controlled_term_filter_subquery)
-            subquery = subquery.filter(self.filter_column_info.db_column.in_(controlled_term_filter_subquery))
+                return controlled_term_filter_clause
+            subquery = subquery.filter(controlled_term_filter_clause)
                                 
         
         elif self.local_filter_clause is not None:
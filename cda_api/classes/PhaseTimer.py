@@ -0,0 +1,36 @@
+import time
+from contextlib import contextmanager
+
+
+class PhaseTimer:
+    """Accumulates the time spent in each phase of a request (build, compile, execute, fetch, format, serialize).
+    Reported in the Server-Timing header and the phase duration metrics."""
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.phases = {}
+
+    def __repr__(self):
+        return f"PhaseTimer({', '.join(f'{name}={seconds:.4f}s' for name, seconds in self.phases.items())})"
+
+    @contextmanager
+    def phase(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start_time)
+
+    def record(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0) + seconds
+
+    def get(self, name):
+        return self.phases.get(name, 0)
+
+    def get_elapsed(self):
+        return time.perf_counter() - self.start_time
+
+    def get_recorded(self):
+        return sum(self.phases.values())
+
+    def get_server_timing_header(self):
+        return ', '.join(f'{name};dur={seconds * 1000:.1f}' for name, seconds in self.phases.items())
@@ -0,0 +1,133 @@
+import copy
+import threading
+import time
+from os import getenv
+
+from cda_api import get_logger
+from cda_api.db.filter_functions import parse_filter_string
+
+log = get_logger('PrecomputedSummaries.py')
+
+# Unfiltered and single data_at filter summaries computed in the background once per release and served from memory
+PRECOMPUTED_SUMMARIES_ENABLED = getenv("PRECOMPUTED_SUMMARIES_ENABLED", "true").lower() == "true"
+# Summaries that failed to compute are retried by the first summary request made this long after the failure
+PRECOMPUTED_SUMMARIES_RETRY_SECONDS = int(getenv("PRECOMPUTED_SUMMARIES_RETRY_SECONDS", 300))
+
+
+class PrecomputedSummaries:
+    """Summaries of the requests every landing page makes (no filters, or a single "<endpoint>_data_at_<source> = true" filter),
+    computed once per release in a background thread and served from memory.
+    A release is only marked complete once every summary has been computed. Failed ones are retried by a later warm"""
+    def __init__(self, endpoint_table_names):
+        self.endpoint_table_names = endpoint_table_names
+        self.summaries = {}
+        self.release_key = None
+        self.complete = False
+        self.warming = False
+        self.retry_after = 0.0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"PrecomputedSummaries(release={self.release_key}, summaries={len(self.summaries)}, complete={self.complete})"
+
+    def get_data_at_column_names(self, db_info, endpoint_table_name):
+        endpoint_table_info = db_info.get_table_info(endpoint_table_name)
+        return [column_info.name for column_info in endpoint_table_info.column_infos if column_info.name.startswith(f'{endpoint_table_name}_data_at_')]
+
+    def get_key(self, db_info, endpoint_table_name, request_body):
+        """Returns the key of a precomputed summary matching the request or None if the request isn't precomputed
+
+        Args:
+            db_info (DatabaseInfo): Database info of the current release
+            endpoint_table_name (str): Name of the endpoint table
+            request_body (SummaryRequestBody): JSON input query
+
+        Returns:
+            tuple | None: (release_key, endpoint_table_name, data_at_column_name or None)
+        """
+        if endpoint_table_name not in self.endpoint_table_names:
+            return None
+        if request_body.SEARCH_LIST or request_body.MATCH_SOME or request_body.ADD_COLUMNS or request_body.EXCLUDE_COLUMNS:
+            return None
+        match_all = request_body.MATCH_ALL or []
+        if len(match_all) == 0:
+            return (db_info.release_key, endpoint_table_name, None)
+        if len(match_all) > 1:
+            return None
+        try:
+            column_name, operator, value = parse_filter_string(match_all[0], log)
+        except Exception:
+            return None
+        if (operator != '=') or (value is not True) or (column_name not in self.get_data_at_column_names(db_info, endpoint_table_name)):
+            return None
+        return (db_info.release_key, endpoint_table_name, column_name)
+
+    def get(self, key):
+        summary = self.summaries.get(key)
+        if summary is None:
+            return None
+        # Callers (and request coalescing) may add to the top level of the response
+        return copy.copy(summary)
+
+    def get_request_bodies(self, db_info, endpoint_table_name):
+        request_bodies = [{'MATCH_ALL': [], 'MATCH_SOME': []}]
+        for column_name in self.get_data_at_column_names(db_info, endpoint_table_name):
+            request_bodies.append({'MATCH_ALL': [f'{column_name} = true'], 'MATCH_SOME': []})
+        return request_bodies
+
+    def start_warming(self, db_info, summarize):
+        """Computes the missing summaries of the current release in a background thread unless they are all computed,
+        are being computed, or failed less than PRECOMPUTED_SUMMARIES_RETRY_SECONDS ago
+
+        Args:
+            db_info (DatabaseInfo): Database info of the current release
+            summarize (Callable): Takes an endpoint table name and request body dict and returns the summary response
+        """
+        with self._lock:
+            if self.release_key != db_info.release_key:
+                # Stops a warm of the previous release and drops its summaries which are never served again
+                self.release_key = db_info.release_key
+                self.complete = False
+                self.retry_after = 0.0
+                self.summaries = {key: summary for key, summary in self.summaries.items() if key[0] == db_info.release_key}
+            if self.warming or self.complete or (time.monotonic() < self.retry_after):
+                return
+            self.warming = True
+        thread = threading.Thread(target=self._warm, args=(db_info, db_info.release_key, summarize), name='precomputed-summaries', daemon=True)
+        thread.start()
+
+    def _warm(self, db_info, release_key, summarize):
+        log.info(f'Precomputing summaries for release {release_key}')
+        failure_count = 0
+        try:
+            for endpoint_table_name in self.endpoint_table_names:
+                for request_body in self.get_request_bodies(db_info, endpoint_table_name):
+                    if self.release_key != release_key:
+                        log.info(f'Release changed while precomputing summaries for {release_key}. Stopping')
+                        return
+                    match_all = request_body['MATCH_ALL']
+                    key = (release_key, endpoint_table_name, None if not match_all else match_all[0].split()[0])
+                    if key in self.summaries.keys():
+                        continue
+                    try:
+                        self.summaries[key] = summarize(endpoint_table_name, request_body)
+                    except Exception as e:
+                        failure_count += 1
+                        log.error(f'Failed to precompute the {endpoint_table_name} summary of {request_body}: {e}')
+        except Exception as e:
+            failure_count += 1
+            log.error(f'Failed to precompute summaries for release {release_key}: {e}')
+        finally:
+            with self._lock:
+                self.warming = False
+                if self.release_key == release_key:
+                    if failure_count == 0:
+                        self.complete = True
+                    else:
+                        self.retry_after = time.monotonic() + PRECOMPUTED_SUMMARIES_RETRY_SECONDS
+        if failure_count == 0:
+            log.info(f'Precomputed {len(self.summaries)} summaries for release {release_key}')
+        else:
+            log.warning(f'{failure_count} summaries of release {release_key} failed to precompute. Retrying in {PRECOMPUTED_SUMMARIES_RETRY_SECONDS} seconds')
+
+PRECOMPUTED_SUMMARIES = PrecomputedSummaries(['file', 'subject'])
@@ -1,11 +1,15 @@
-from cda_api.db.query_functions import get_cte_column, column_distinct_count_subquery, foreign_table_distinct_count, data_source_counts, basic_categorical_summary, null_aware_categorical_summary, numeric_summary, get_selectable_db_column_and_possible_join
+from cda_api.db.query_functions import get_cte_column, column_distinct_count_subquery, foreign_table_distinct_count, data_source_counts, basic_categorical_summaries, null_aware_categorical_summary, numeric_summaries, get_selectable_db_column_and_possible_join
 from .models import SummaryRequestBody
 from .DatabaseInfo import DatabaseInfo
 from .shared_class_functions import construct_search_filter_info, construct_filter_infos, get_table_column_and_filter_map, get_filtered_preselect
+from cda_api.db import SUMMARY_SAMPLE_RATE
 from sqlalchemy import func
 
 class SummaryQuery:
-    def __init__(self, db, db_info: DatabaseInfo, endpoint_table_name, request_body: SummaryRequestBody, log):
+    # Budget used by the admission check (see db/admission.py)
+    query_type = 'summary'
+
+    def __init__(self, db, db_info: DatabaseInfo, endpoint_table_name, request_body: SummaryRequestBody, log, filtered_preselect_source=None, approximate=False):
         # Initailize arguments
         self.db = db
         self.db_info = db_info
@@ -16,12 +20,26 @@ class SummaryQuery:
 
         # Set useful variables
         self.endpoint_alias = self.endpoint_table_info.primary_key_column_info
+        # Approximate summaries are computed over a sample of the filtered endpoint rows (see scale_sampled_summary)
+        self.sample_rate = SUMMARY_SAMPLE_RATE if approximate else None
 
         # Construct filter preselect
-        self.search_filter_info = construct_search_filter_info(self)
-        self.filter_infos = construct_filter_infos(self)
-        self.table_column_and_filter_map = get_table_column_and_filter_map(self, 'summary')
-        self.filtered_preselect, self.filtered_preselect_cte_query_map, self.filtered_preselect_column_map = get_filtered_preselect(self)
+        if filtered_preselect_source is None:
+            self.search_filter_info = construct_search_filter_info(self)
+            self.filter_infos = construct_filter_infos(self)
+            self.table_column_and_filter_map = get_table_column_and_filter_map(self, 'summary')
+            self.filtered_preselect, self.filtered_preselect_cte_query_map, self.filtered_preselect_column_map = get_filtered_preselect(self)
+        else:
+            # Reuse the filters and filtered preselect of a query built from the same request body (ex. a DataQuery)
+            # The preselect only depends on the tables being filtered and added which are the same for data and summary queries
+            self.log.debug(f"Reusing the filtered preselect of {filtered_preselect_source.__class__.__name__}")
+            self.search_filter_info = filtered_preselect_source.search_filter_info
+            self.filter_infos = filtered_preselect_source.filter_infos
+            self.table_column_and_filter_map = get_table_column_and_filter_map(self, 'summary')
+            self.filtered_preselect = filtered_preselect_source.filtered_preselect
+            self.filtered_preselect_cte_query_map = filtered_preselect_source.filtered_preselect_cte_query_map
+            self.filtered_preselect_column_map = filtered_preselect_source.filtered_preselect_column_map
+            self.filtered_endpoint_ids = filtered_preselect_source.filtered_endpoint_ids
 
         # Build select query
         self._build_select_clause()
@@ -61,6 +79,8 @@ class SummaryQuery:
         self.log.debug("Constructing summary select clause")
         self.select_map = {'total_count': [], 'other_local_table_counts': []}
         self.select_clause_columns = []
+        # Keys of the result counting endpoint rows (see scale_sampled_summary)
+        self.sampled_count_keys = {'total_count'}
         self._get_total_count()
         self._get_other_local_table_counts()
         self._get_column_summaries()
@@ -126,7 +146,8 @@ class SummaryQuery:
                     all_table_columns.append(db_column)
                     if join:
                         table_preselect_joins.append(join)
-            all_table_columns = list(set(all_table_columns))
+            # Keep the column order stable so the data_source combination names don't change between requests
+            all_table_columns = list(dict.fromkeys(all_table_columns))
             if table_info not in self.filtered_preselect_cte_query_map.keys():
                 if table_info.name == 'upstream_identifiers':
                     filtered_table_info = self.endpoint_table_info
@@ -152,17 +173,20 @@ class SummaryQuery:
             preselect_connecting_column = get_cte_column(table_preselect_cte, connecting_column_info.name)
 
             data_source_columns = []
+            summarizable_columns = []
             for column in table_preselect_cte.columns:
                 matching_column_info = self.db_info.get_column_info(column.name, table_info)
                 if matching_column_info in column_type_map['summarizable_columns']:
-                    self.get_summarized_select(filtered_table_info, table_info, matching_column_info, column, preselect_connecting_column)
+                    summarizable_columns.append((matching_column_info, column))
                 elif matching_column_info in column_type_map['data_source_columns']:
                     data_source_columns.append(column)
+            self.get_summarized_selects(filtered_table_info, table_info, summarizable_columns, preselect_connecting_column)
             
             if data_source_columns:
                 self.log.debug(f"Cosntructing select statement for the combinations of data_sources for {table_info}")
                 if table_info == self.endpoint_table_info:
                     label = 'data_source'
+                    self.sampled_count_keys.add(label)
                 else:
                     label = f'{table_info.name}_data_source'
                 self.select_map[table_info].append(data_source_counts(self.db, data_source_columns).label(label))
@@ -177,23 +201,33 @@ class SummaryQuery:
                 self.summary_column_map[table_info]['summarizable_columns'].append(column_info)
 
 
-    def get_summarized_select(self, filtered_table_info, table_info, summarizable_column_info, db_column, connecting_column):
-        if summarizable_column_info.column_type == 'categorical':
-            if table_info in self.db_info.local_table_infos:
-                self.log.debug(f"Constructing basic categorical summary for {summarizable_column_info}")
-                column_summary = basic_categorical_summary(self.db, db_column)
-            else:
+    def get_summarized_selects(self, filtered_table_info, table_info, summarizable_columns, connecting_column):
+        # The numeric columns of a table, and the categorical columns of a local table, are each summarized in one pass over the table preselect
+        numeric_columns = [db_column for column_info, db_column in summarizable_columns if column_info.column_type == 'numeric']
+        basic_categorical_columns = []
+        if table_info in self.db_info.local_table_infos:
+            basic_categorical_columns = [db_column for column_info, db_column in summarizable_columns if column_info.column_type == 'categorical']
+        column_summaries = {}
+        if numeric_columns:
+            self.log.debug(f"Constructing numeric summaries for {table_info}: {[db_column.name for db_column in numeric_columns]}")
+            column_summaries.update(numeric_summaries(self.db, numeric_columns, f'{table_info.name}_numeric_summaries'))
+        if basic_categorical_columns:
+            self.log.debug(f"Constructing basic categorical summaries for {table_info}: {[db_column.name for db_column in basic_categorical_columns]}")
+            column_summaries.update(basic_categorical_summaries(self.db, basic_categorical_columns, f'{table_info.name}_categorical_summaries'))
+
+        for summarizable_column_info, db_column in summarizable_columns:
+            if db_column.name in column_summaries.keys():
+                column_summary = column_summaries[db_column.name]
+            elif summarizable_column_info.column_type == 'categorical':
                 self.log.debug(f"Constructing null-aware categorical summary for {summarizable_column_info}")
                 column_summary = null_aware_categorical_summary(self.db, db_column, connecting_column, summarizable_column_info, self.filtered_preselect_cte_query_map[filtered_table_info])
-
-        elif summarizable_column_info.column_type == 'numeric':
-            self.log.debug(f"Constructing numeric summary for {summarizable_column_info}")
-            column_summary = numeric_summary(self.db, db_column)
-        else:
-            self.log.debug(f'Skipping summarizing {summarizable_column_info} because it is of type: {summarizable_column_info.column_type}')
-            return
-
-        self.select_map[table_info].append(column_summary.label(f'{db_column.name}_summary'))
+            else:
+                self.log.debug(f'Skipping summarizing {summarizable_column_info} because it is of type: {summarizable_column_info.column_type}')
+                continue
+            # Categorical summaries connected through the endpoint alias count endpoint rows
+            if (summarizable_column_info.column_type == 'categorical') and (filtered_table_info == self.endpoint_table_info):
+                self.sampled_count_keys.add(f'{db_column.name}_summary')
+            self.select_map[table_info].append(column_summary.label(f'{db_column.name}_summary'))
 
 
     def get_query(self):
@@ -0,0 +1,277 @@
+import math
+import threading
+from os import getenv
+
+from sqlalchemy import Float, Integer
+
+from cda_api import get_logger
+from cda_api.db.connection import session
+from cda_api.db.query_functions import get_data_source_combinations
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+log = get_logger('SummarySnapshot.py')
+
+# Engine used for /summary when the filtered endpoint IDs are already in memory: "sql" (default) or "numpy" (requires numpy)
+SUMMARY_ENGINE = getenv("SUMMARY_ENGINE", "sql").lower()
+
+
+class TableSnapshot:
+    """Column arrays of one local table (file or subject) ordered by its alias.
+    Columns are loaded the first time a query needs them and kept for the life of the release."""
+    def __init__(self, table_info):
+        self.table_info = table_info
+        self.alias_column_info = table_info.primary_key_column_info
+        self.aliases = None
+        self.categorical_columns = {}
+        self.numeric_columns = {}
+        self.data_source_columns = {}
+        self.mapping_columns = {}
+
+    def __repr__(self):
+        column_count = len(self.categorical_columns) + len(self.numeric_columns) + len(self.data_source_columns)
+        return f"TableSnapshot({self.table_info.name}, rows={0 if self.aliases is None else len(self.aliases)}, columns={column_count})"
+
+    def _query_column(self, db, column_info):
+        alias_column = self.alias_column_info.db_column
+        return db.query(alias_column, column_info.db_column).order_by(alias_column).yield_per(100000)
+
+    def load_aliases(self, db):
+        alias_column = self.alias_column_info.db_column
+        self.aliases = np.fromiter((alias for (alias,) in db.query(alias_column).order_by(alias_column).yield_per(100000)), dtype=np.int64)
+
+    def load_categorical_column(self, db, column_info):
+        # Stored as codes into a list of categories so grouping is a bincount. None is kept as its own category
+        category_codes = {}
+        codes = np.empty(len(self.aliases), dtype=np.int32)
+        for index, (_, value) in enumerate(self._query_column(db, column_info)):
+            codes[index] = category_codes.setdefault(value, len(category_codes))
+        self.categorical_columns[column_info] = (codes, list(category_codes.keys()))
+
+    def load_numeric_column(self, db, column_info):
+        values = np.fromiter((math.nan if value is None else float(value) for (_, value) in self._query_column(db, column_info)), dtype=np.float64)
+        # NUMERIC columns keep their fractions but are rounded like integers by round(avg())
+        is_integer = isinstance(column_info.db_column.type, Integer)
+        is_float = isinstance(column_info.db_column.type, Float)
+        self.numeric_columns[column_info] = (values, is_integer, is_float)
+
+    def load_data_source_column(self, db, column_info):
+        # 1 for true, 0 for false and -1 for null (which matches neither in SQL)
+        values = np.fromiter((-1 if value is None else int(value) for (_, value) in self._query_column(db, column_info)), dtype=np.int8)
+        self.data_source_columns[column_info] = values
+
+    def load_mapping_columns(self, db, table_relationship):
+        if table_relationship.requires_mapping_table:
+            local_column = table_relationship.local_mapping_column_info.db_column
+            foreign_column = table_relationship.foreign_mapping_column_info.db_column
+        else:
+            local_column = table_relationship.local_column_info.db_column
+            foreign_column = table_relationship.foreign_column_info.db_column
+        rows = [(local, foreign) for local, foreign in db.query(local_column, foreign_column).order_by(local_column).yield_per(100000) if (local is not None) and (foreign is not None)]
+        local_values = np.fromiter((local for local, _ in rows), dtype=np.int64, count=len(rows))
+        foreign_values = np.fromiter((foreign for _, foreign in rows), dtype=np.int64, count=len(rows))
+        self.mapping_columns[table_relationship] = (local_values, foreign_values)
+
+
+class SummarySnapshot:
+    """Per release columnar snapshot of the local tables used to summarize an in-memory set of endpoint IDs without a database round trip.
+    Produces the same result row as SummaryQuery.get_query() for summaries that only use columns of the endpoint table.
+    Columns are loaded in a background thread the first time a query needs them; until then that query is summarized in the database"""
+    def __init__(self, db_info):
+        self.db_info = db_info
+        self.table_snapshots = {table_info: TableSnapshot(table_info) for table_info in db_info.local_table_infos}
+        self.loading = False
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"SummarySnapshot({list(self.table_snapshots.values())})"
+
+    def _get_column_kind(self, column_info, column_type_map):
+        if column_info in column_type_map['data_source_columns']:
+            return 'data_source'
+        if column_info.column_type in ['categorical', 'numeric']:
+            return column_info.column_type
+        return None
+
+    def can_summarize(self, summary_query):
+        """Returns whether the query can be summarized from the snapshot. Starts loading whatever it needs that isn't loaded yet
+
+        Args:
+            summary_query (SummaryQuery): Built summary query
+
+        Returns:
+            bool: True if every ID and column the query needs is in memory
+        """
+        endpoint_table_info = summary_query.endpoint_table_info
+        if summary_query.filtered_endpoint_ids is None:
+            return False
+        if endpoint_table_info not in self.table_snapshots.keys():
+            return False
+        if list(summary_query.summary_column_map.keys()) not in [[], [endpoint_table_info]]:
+            return False
+        for column_infos in summary_query.summary_column_map.get(endpoint_table_info, {}).values():
+            for column_info in column_infos:
+                if (column_info.selectable_table_info != endpoint_table_info) or (column_info == endpoint_table_info.primary_key_column_info):
+                    return False
+        table_snapshot = self.table_snapshots[endpoint_table_info]
+        missing_loads = self._get_missing_loads(table_snapshot, summary_query)
+        if missing_loads:
+            self._start_loading(table_snapshot, missing_loads)
+            return False
+        return True
+
+    def _get_missing_loads(self, table_snapshot, summary_query):
+        # Lists whatever the query needs that isn't already in the snapshot as (kind, item) pairs
+        column_type_map = summary_query.summary_column_map.get(table_snapshot.table_info, {'data_source_columns': [], 'summarizable_columns': []})
+        other_local_table_infos = [table_info for table_info in self.db_info.local_table_infos if table_info != table_snapshot.table_info]
+        missing_loads = []
+        if table_snapshot.aliases is None:
+            missing_loads.append(('aliases', None))
+        for table_info in other_local_table_infos:
+            table_relationship = table_snapshot.table_info.get_table_relationship(table_info)
+            if table_relationship not in table_snapshot.mapping_columns.keys():
+                missing_loads.append(('mapping', table_relationship))
+        loaded_columns = {
+            'data_source': table_snapshot.data_source_columns,
+            'categorical': table_snapshot.categorical_columns,
+            'numeric': table_snapshot.numeric_columns,
+        }
+        for column_infos in column_type_map.values():
+            for column_info in column_infos:
+                column_kind = self._get_column_kind(column_info, column_type_map)
+                if (column_kind is not None) and (column_info not in loaded_columns[column_kind].keys()):
+                    missing_loads.append((column_kind, column_info))
+        return missing_loads
+
+    def _start_loading(self, table_snapshot, missing_loads):
+        # One load runs at a time. Requests arriving while it runs start the next one for whatever is still missing
+        with self._lock:
+            if self.loading:
+                return
+            self.loading = True
+        thread = threading.Thread(target=self._load_table, args=(table_snapshot, missing_loads), name='summary-snapshot', daemon=True)
+        thread.start()
+
+    def _load_table(self, table_snapshot, missing_loads):
+        db = session()
+        try:
+            for kind, item in missing_loads:
+                if kind == 'aliases':
+                    log.info(f'Loading {table_snapshot.table_info.name} aliases into the summary snapshot')
+                    table_snapshot.load_aliases(db)
+                    continue
+                if kind == 'mapping':
+                    table_snapshot.load_mapping_columns(db, item)
+                elif kind == 'data_source':
+                    table_snapshot.load_data_source_column(db, item)
+                elif kind == 'categorical':
+                    table_snapshot.load_categorical_column(db, item)
+                elif kind == 'numeric':
+                    table_snapshot.load_numeric_column(db, item)
+                log.info(f'Loaded {item} into the summary snapshot')
+        except Exception as e:
+            log.error(f'Failed to load {table_snapshot.table_info.name} into the summary snapshot: {e}')
+        finally:
+            db.close()
+            with self._lock:
+                self.loading = False
+
+    def summarize(self, summary_query):
+        """Computes the summary of a SummaryQuery from the snapshot
+
+        Args:
+            summary_query (SummaryQuery): Built summary query that can_summarize() accepted
+
+        Returns:
+            list[dict]: Single summary row matching the database result
+        """
+        endpoint_table_info = summary_query.endpoint_table_info
+        table_snapshot = self.table_snapshots[endpoint_table_info]
+
+        ids = np.asarray(summary_query.filtered_endpoint_ids, dtype=np.int64)
+        positions = np.searchsorted(table_snapshot.aliases, ids)
+        result = {'total_count': len(ids)}
+
+        for table_info in self.db_info.local_table_infos:
+            if table_info == endpoint_table_info:
+                continue
+            local_values, foreign_values = table_snapshot.mapping_columns[endpoint_table_info.get_table_relationship(table_info)]
+            result[f'{table_info.name}_count'] = len(np.unique(foreign_values[np.isin(local_values, ids)]))
+
+        column_type_map = summary_query.summary_column_map.get(endpoint_table_info, {'data_source_columns': [], 'summarizable_columns': []})
+        for column_info in column_type_map['summarizable_columns']:
+            if column_info.column_type == 'categorical':
+                codes, categories = table_snapshot.categorical_columns[column_info]
+                result[f'{column_info.name}_summary'] = categorical_summary(column_info.name, codes[positions], categories)
+            elif column_info.column_type == 'numeric':
+                values, is_integer, is_float = table_snapshot.numeric_columns[column_info]
+                result[f'{column_info.name}_summary'] = numeric_summary(values[positions], is_integer, is_float)
+
+        if column_type_map['data_source_columns']:
+            data_source_values = {column_info.name: table_snapshot.data_source_columns[column_info][positions] for column_info in column_type_map['data_source_columns']}
+            result['data_source'] = data_source_summary(data_source_values)
+        return [result]
+
+
+# Mirrors basic_categorical_summaries(). Returns None when there are no rows like array_agg()
+def categorical_summary(column_name, codes, categories):
+    counts = np.bincount(codes, minlength=len(categories))
+    summary = [{column_name: categories[code], 'count_result': int(count)} for code, count in enumerate(counts) if count > 0]
+    return summary if summary else None
+
+
+def _to_json_number(value, is_integer):
+    if value is None:
+        return None
+    if is_integer or float(value).is_integer():
+        return int(value)
+    return float(value)
+
+
+# Mirrors numeric_summaries(): percentile_disc() takes the first value whose cumulative distribution reaches the fraction
+# and round(avg()) rounds half away from zero for exact types (integer and numeric) and half to even for floats
+def numeric_summary(values, is_integer, is_float=False):
+    values = np.sort(values[~np.isnan(values)])
+    if len(values) == 0:
+        return [{'min': None, 'max': None, 'mean': None, 'median': None, 'lower_quartile': None, 'upper_quartile': None}]
+
+    def percentile_disc(fraction):
+        return values[max(math.ceil(fraction * len(values)) - 1, 0)]
+
+    mean = values.mean()
+    mean = np.rint(mean) if is_float else math.copysign(math.floor(abs(mean) + 0.5), mean)
+    return [{
+        'min': _to_json_number(values[0], is_integer),
+        'max': _to_json_number(values[-1], is_integer),
+        'mean': _to_json_number(mean, True),
+        'median': _to_json_number(percentile_disc(0.5), is_integer),
+        'lower_quartile': _to_json_number(percentile_disc(0.25), is_integer),
+        'upper_quartile': _to_json_number(percentile_disc(0.75), is_integer),
+    }]
+
+
+# Mirrors data_source_counts()
+def data_source_summary(data_source_values):
+    data_source_combinations = get_data_source_combinations(list(data_source_values.keys()))
+    summary = {}
+    for name, data_source_boolean_map in data_source_combinations.items():
+        mask = np.ones(len(next(iter(data_source_values.values()))), dtype=bool)
+        for column_name, boolean in data_source_boolean_map.items():
+            mask &= data_source_values[column_name] == int(boolean)
+        summary[name] = int(mask.sum())
+    return summary
+
+
+# Returns the release's SummarySnapshot or None if the numpy engine is not selected or numpy is not installed
+def get_summary_snapshot(db_info):
+    if SUMMARY_ENGINE != 'numpy':
+        return None
+    if np is None:
+        log.warning('SUMMARY_ENGINE is set to numpy but numpy is not installed. Summarizing in the database instead')
+        return None
+    if db_info.summary_snapshot is None:
+        db_info.summary_snapshot = SummarySnapshot(db_info)
+    return db_info.summary_snapshot
@@ -0,0 +1,71 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Thread safe in-memory cache whose entries expire after ttl_seconds.
+    Once max_entries is reached the least recently used entry is evicted."""
+    # Every cache by name so their hit ratios can be reported in /metrics
+    instances = {}
+
+    def __init__(self, name, ttl_seconds, max_entries):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        TTLCache.instances[name] = self
+
+    def __repr__(self):
+        return f"TTLCache({self.name}, entries={len(self._entries)}, hits={self.hits}, misses={self.misses})"
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _is_expired(self, expires_at):
+        return (expires_at is not None) and (expires_at <= time.monotonic())
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._is_expired(entry[1]):
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        expires_at = None
+        if self.ttl_seconds is not None:
+            expires_at = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def items(self):
+        # Snapshot of the unexpired entries
+        with self._lock:
+            return [(key, value) for key, (value, expires_at) in self._entries.items() if not self._is_expired(expires_at)]
+
+    def expires_in(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] is None:
+                return None
+            return max(entry[1] - time.monotonic(), 0)
@@ -14,6 +14,11 @@ class InternalErrorException(CDABaseException):
         super().__init__(message)
         self.status_code = 500
 
+class ServiceUnavailableException(CDABaseException):
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.status_code = 503
+
 class ColumnNotFound(ClientErrorException):
     """ Custom exception for when a referenced column is not found"""
     pass
@@ -61,4 +66,28 @@ class InvalidFilterError(ClientErrorException):
 
 class InvalidSearchError(ClientErrorException):
     """Custom exception for when a search is invalid"""
-    pass
\ No newline at end of file
+    pass
+
+class CohortNotFound(ClientErrorException):
+    """Custom exception for when a referenced cohort handle does not exist or has expired"""
+    pass
+
+class InvalidCohortError(ClientErrorException):
+    """Custom exception for when an uploaded cohort is invalid"""
+    pass
+
+class QueryCostExceeded(ClientErrorException):
+    """Custom exception for when a query's estimated cost is over the configured budget"""
+    pass
+
+class InvalidBatchRequest(ClientErrorException):
+    """Custom exception for when a batch request or one of its sub-requests is invalid"""
+    pass
+
+class InvalidExportFormat(ClientErrorException):
+    """Custom exception for when a requested export format is unknown or unavailable"""
+    pass
+
+class LaneQueueFull(ServiceUnavailableException):
+    """Custom exception for when too many requests are already queued for a scheduler lane"""
+    pass
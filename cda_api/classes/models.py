@@ -73,6 +73,20 @@ class SummaryRequestBody(BaseModel):
     def __eq__(self, value: object) -> bool:
         return super().__eq__(value)
 
+class CohortRequestBody(BaseModel):
+    IDS: list[str] | list[int] = Field(description="List of IDs making up the cohort")
+
+
+class BatchSubRequest(BaseModel):
+    endpoint: str = Field(description="Endpoint to run (ex. /data/subject, /summary/file or /column_values/sex)")
+    body: dict[str, Any] | None = Field(default=None, description="Request body for /data and /summary sub-requests")
+    params: dict[str, Any] | None = Field(default={}, description="Query parameters (limit, offset and data_source)")
+
+
+class BatchRequestBody(BaseModel):
+    REQUESTS: list[BatchSubRequest] = Field(description="Sub-requests to run against the same snapshot of the database")
+
+
 class PagedResponseObj(BaseModel):
     result: list[dict[str, Any] | None] = Field(description="List of query result json objects")
     query_sql: str | None = Field(description="SQL Query generated to yield the results")
@@ -86,6 +100,19 @@ class PagedResponseObj(BaseModel):
 class SummaryResponseObj(BaseModel):
     result: list[dict[str, Any] | None] = Field(description="List of query result json objects")
     query_sql: str | None = Field(description="SQL Query generated to yield the results")
+    sample_rate: float | None = Field(default=None, description="Fraction of the filtered rows summarized when approximate=true")
+    error_bounds: list[dict[str, Any] | None] | None = Field(default=None, description="95% error bound of each count in result when approximate=true")
+
+
+class DataSummaryResponseObj(BaseModel):
+    result: list[dict[str, Any] | None] = Field(description="List of query result json objects")
+    query_sql: str | None = Field(description="SQL Query generated to yield the results and summary")
+    total_row_count: int | None = Field(default=None, description="Count of total number of results from the query")
+    next_url: Optional[str] = Field(
+        default=None,
+        description="URL to get to next page of results",
+    )
+    summary: list[dict[str, Any] | None] = Field(description="Summary of the query (the result of the matching /summary endpoint)")
 
 
 class ColumnResponseObj(BaseModel):
@@ -108,6 +135,25 @@ class ReleaseMetadataObj(BaseModel):
     result: list[dict[str, Any] | None]
 
 
+class CohortResponseObj(BaseModel):
+    handle: str = Field(description="Handle used to reference the cohort")
+    filter_reference: str = Field(description="Value to use in place of a list in MATCH_ALL/MATCH_SOME filters (ex. subject_id in @cohort:<handle>)")
+    id_count: int = Field(description="Number of unique IDs in the cohort")
+    expires_in: int | None = Field(default=None, description="Number of seconds until the cohort expires")
+
+
+class BatchSubResponseObj(BaseModel):
+    endpoint: str = Field(description="Endpoint of the sub-request")
+    status_code: int = Field(description="Status code the sub-request would have returned on its own")
+    result: dict[str, Any] | None = Field(default=None, description="Response of the sub-request")
+    error_type: str | None = Field(default=None, description="Error type if the sub-request failed")
+    message: str | None = Field(default=None, description="Error message if the sub-request failed")
+
+
+class BatchResponseObj(BaseModel):
+    results: list[BatchSubResponseObj] = Field(description="Sub-request responses in the order they were requested")
+
+
 class InternalError(BaseModel):
     error_type: str
     message: str
@@ -1,7 +1,11 @@
+from cda_api.classes.BitmapIndex import BITMAP_INDEX_MAX_IDS, get_bitmap_index
 from cda_api.classes.FilterInfo import FilterInfo
 from cda_api.classes.SearchFilterInfo import SearchFilterInfo
-from cda_api.db.query_functions import get_cte_column, apply_match_all_and_some_filters
-from sqlalchemy import select
+from cda_api.db import PRESELECT_CACHE, PRESELECT_CACHE_ENABLED, PRESELECT_CACHE_MAX_ROWS
+from cda_api.db.admission import is_within_budget
+from cda_api.db.query_functions import get_cte_column, apply_match_all_and_some_filters, bind_array
+from cda_api.metrics import PRESELECT_REFINEMENTS
+from sqlalchemy import Integer, func, select, tuple_
 
 def construct_filter_infos(query_object):
     log = query_object.log
@@ -119,6 +123,7 @@ def get_filtered_preselect(query_object):
     preselect_query = query_object.db.query(*preselect_columns)
     for mapping_join in filtered_preselect_joins:
         preselect_query = preselect_query.join(**mapping_join)
+    unfiltered_preselect_query = preselect_query
     
     if query_object.search_filter_info:
         log.debug(f'Applying SEARCH_STRING filters to the filtered preselect')
@@ -129,7 +134,24 @@ def get_filtered_preselect(query_object):
 
     preselect_cte_name = f'filtered_preselect'
     log.debug(f'Applying MATCH_ALL and MATCH_SOME filters to the filtered preselect')
-    preselect_cte = apply_match_all_and_some_filters(preselect_query, match_all_db_filters, match_some_db_filters).cte(preselect_cte_name)
+    preselect_query = apply_match_all_and_some_filters(preselect_query, match_all_db_filters, match_some_db_filters)
+    if query_object.sample_rate is not None:
+        log.debug(f'Sampling {query_object.sample_rate:.2%} of the filtered preselect')
+        preselect_query = preselect_query.filter(get_sample_filter(filter_preselect_map[query_object.endpoint_table_info], query_object.sample_rate))
+        preselect_arrays = None
+    else:
+        preselect_arrays = get_bitmap_preselect_arrays(query_object, filter_preselect_map)
+    if preselect_arrays is None:
+        preselect_arrays = get_materialized_preselect_arrays(query_object, filter_preselect_map, preselect_query, unfiltered_preselect_query)
+    if preselect_arrays is None:
+        preselect_cte = preselect_query.cte(preselect_cte_name)
+    else:
+        preselect_cte = build_array_preselect_cte(filter_preselect_map, preselect_arrays, preselect_cte_name)
+
+    # Sorted endpoint IDs when they are already held in memory (used by the in-memory summary engine)
+    query_object.filtered_endpoint_ids = None
+    if (preselect_arrays is not None) and (list(filter_preselect_map.keys()) == [query_object.endpoint_table_info]):
+        query_object.filtered_endpoint_ids = preselect_arrays[0]
     filtered_preselect = query_object.db.query(preselect_cte.c)
     filtered_preselect_cte_query_map = {}
     filtered_preselect_column_map = {}
@@ -138,4 +160,135 @@ def get_filtered_preselect(query_object):
         filtered_preselect_cte_query_map[table_info] = query_object.db.query(cte_column)
         filtered_preselect_column_map[table_info] = cte_column
     log.debug('Filtered preselect construction complete')
-    return filtered_preselect, filtered_preselect_cte_query_map, filtered_preselect_column_map
\ No newline at end of file
+    return filtered_preselect, filtered_preselect_cte_query_map, filtered_preselect_column_map
+
+# Deterministic Bernoulli sample of the endpoint aliases. Hashing the alias (instead of random()) keeps the same rows
+# in the sample for every request so approximate summaries are stable and can be cached and coalesced
+def get_sample_filter(endpoint_column_info, sample_rate):
+    return func.abs(func.hashint8(endpoint_column_info.db_column, type_=Integer) % 10000) < int(sample_rate * 10000)
+
+# The preselect only depends on the endpoint, the tables it maps through, the filters (not their order) and the sample rate
+# MATCH_ALL is kept last so get_refinable_preselect() can compare everything else at once
+def get_preselect_cache_key(query_object, filter_preselect_map):
+    request_body = query_object.request_body
+    return (
+        query_object.db_info.release_key,
+        query_object.endpoint_table_info.name,
+        query_object.sample_rate,
+        tuple(column_info.table_column_name for column_info in filter_preselect_map.values()),
+        tuple(request_body.SEARCH_LIST or []),
+        tuple(sorted(filter_string.strip() for filter_string in request_body.MATCH_SOME or [])),
+        tuple(sorted(filter_string.strip() for filter_string in request_body.MATCH_ALL or [])),
+    )
+
+def get_refinable_preselect(key):
+    """Finds the smallest cached preselect whose request differs from this one only by having fewer MATCH_ALL filters.
+    Refining a cohort one MATCH_ALL filter at a time then only evaluates the new filter against the previous step's IDs
+
+    Args:
+        key (tuple): Preselect cache key of the request (see get_preselect_cache_key)
+
+    Returns:
+        tuple[list[list], set[str]] | None: Cached arrays and the MATCH_ALL filter strings they weren't filtered by
+    """
+    match_all_filters = set(key[-1])
+    refinable_preselect = None
+    for cached_key, cached_arrays in PRESELECT_CACHE.items():
+        if (cached_arrays is False) or (cached_key[:-1] != key[:-1]) or (not set(cached_key[-1]) < match_all_filters):
+            continue
+        if (refinable_preselect is None) or (len(cached_arrays[0]) < len(refinable_preselect[0][0])):
+            refinable_preselect = (cached_arrays, match_all_filters - set(cached_key[-1]))
+    return refinable_preselect
+
+def get_materialized_preselect_arrays(query_object, filter_preselect_map, preselect_query, unfiltered_preselect_query):
+    """Returns the filtered preselect as sorted arrays of its IDs (one per column), materializing it on the first request.
+    Later pages of the same query and the matching summary reuse the arrays instead of evaluating the filters again.
+
+    Args:
+        query_object (DataQuery | SummaryQuery): Query the preselect is being built for
+        filter_preselect_map (dict): Map of table_info to the column_info selected for it in the preselect
+        preselect_query (Query): Filtered preselect query
+        unfiltered_preselect_query (Query): Preselect query before any filters are applied
+
+    Returns:
+        list[list] | None: None when caching is disabled, the admission check finds the preselect over budget
+                           or it has more than PRESELECT_CACHE_MAX_ROWS rows
+    """
+    if not PRESELECT_CACHE_ENABLED:
+        return None
+    log = query_object.log
+    key = get_preselect_cache_key(query_object, filter_preselect_map)
+    preselect_arrays = PRESELECT_CACHE.get(key)
+    if preselect_arrays is None:
+        refinable_preselect = get_refinable_preselect(key)
+        if refinable_preselect is not None:
+            cached_arrays, added_filter_strings = refinable_preselect
+            log.debug(f'Refining a cached preselect of {len(cached_arrays[0])} rows with {len(added_filter_strings)} added MATCH_ALL filters')
+            PRESELECT_REFINEMENTS.inc()
+            # Rows of the cached preselect already satisfy every other filter
+            cached_cte = build_array_preselect_cte(filter_preselect_map, cached_arrays, 'cached_preselect')
+            preselect_columns = [column_info.db_column for column_info in filter_preselect_map.values()]
+            preselect_query = unfiltered_preselect_query.filter(tuple_(*preselect_columns).in_(select(*cached_cte.c)))
+            added_db_filters = [
+                filter_info.get_filterable_preselect(filter_preselect_map, query_object.endpoint_table_info)
+                for filter_info in query_object.get_filter_infos('match_all') if filter_info.filter_string.strip() in added_filter_strings
+            ]
+            preselect_query = apply_match_all_and_some_filters(preselect_query, added_db_filters, [])
+        # Fetching stops one row past the limit, so preselects too large to cache cost no more than that.
+        # De-duplicating and sorting the rows is left to Python
+        materialize_statement = preselect_query.limit(PRESELECT_CACHE_MAX_ROWS + 1).statement
+        # The materialization is held to the same budget as the query. Over budget preselects are filtered inline
+        # so the query's own admission check decides what happens to them (this check never rejects)
+        if not is_within_budget(query_object.db, materialize_statement, query_object.query_type, log):
+            log.debug('Filtered preselect is over budget. Not materializing it')
+            return None
+        log.debug('Materializing the filtered preselect')
+        rows = query_object.db.execute(materialize_statement).all()
+        if len(rows) > PRESELECT_CACHE_MAX_ROWS:
+            log.debug(f'Filtered preselect has more than {PRESELECT_CACHE_MAX_ROWS} rows. Not materializing it')
+            preselect_arrays = False
+        else:
+            preselect_arrays = [list(column_values) for column_values in zip(*sort_preselect_rows(rows))] or [[] for _ in filter_preselect_map]
+        PRESELECT_CACHE.set(key, preselect_arrays)
+    else:
+        log.debug('Reusing the materialized filtered preselect')
+
+    if preselect_arrays is False:
+        return None
+    return preselect_arrays
+
+# Distinct rows in the database's ascending order (nulls last). Duplicate rows only come from mapping joins and every
+# use of the preselect is an "in" or a distinct count
+def sort_preselect_rows(rows):
+    return sorted(set(tuple(row) for row in rows), key=lambda row: tuple((value is None, value if value is not None else 0) for value in row))
+
+def get_bitmap_preselect_arrays(query_object, filter_preselect_map):
+    # Filters evaluated in memory against the release's bitmap index (see BitmapIndex.py) skip filtering in the database entirely
+    bitmap_index = get_bitmap_index(query_object.db_info)
+    if bitmap_index is None:
+        return None
+    filtered_ids = bitmap_index.get_filtered_ids(query_object, filter_preselect_map)
+    if filtered_ids is None:
+        return None
+    if len(filtered_ids) > BITMAP_INDEX_MAX_IDS:
+        query_object.log.debug(f'Bitmap index matched more than {BITMAP_INDEX_MAX_IDS} ids. Filtering in the database instead')
+        return None
+    query_object.log.debug(f'Filters evaluated with the bitmap index: {len(filtered_ids)} matching ids')
+    return [list(filtered_ids)]
+
+# Builds the filtered preselect from one (sorted) array of IDs per preselect column
+def build_array_preselect_cte(filter_preselect_map, preselect_arrays, preselect_cte_name):
+    # Arrays of the same length unnested in the select list are zipped back into rows
+    preselect_columns = [
+        func.unnest(bind_array(column_values, column_info.db_column.type, placeholder=f'{len(column_values)} {column_info.name} values of the {preselect_cte_name}')).label(column_info.name)
+        for column_info, column_values in zip(filter_preselect_map.values(), preselect_arrays)
+    ]
+    return select(*preselect_columns).cte(preselect_cte_name)
+
+def get_controlled_term_column_names(query_object):
+    controlled_term_column_names = set()
+    for table_info, column_filter_infos in query_object.table_column_and_filter_map.items():
+        for column_info in column_filter_infos['column_infos']:
+            if column_info.controlled_term:
+                controlled_term_column_names.add(column_info.name)
+    return controlled_term_column_names
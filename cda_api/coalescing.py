@@ -0,0 +1,93 @@
+import copy
+import json
+import time
+from os import getenv
+
+import anyio
+
+from cda_api.db import DB_INFO
+from cda_api.metrics import COALESCED_REQUESTS
+
+# Share one execution between concurrent identical /data and /summary requests (on by default)
+QUERY_COALESCING_ENABLED = getenv("QUERY_COALESCING_ENABLED", "true").lower() == "true"
+
+
+class InFlightQuery:
+    def __init__(self):
+        self.done = anyio.Event()
+        self.result = None
+        self.error = None
+        self.cancelled = False
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one execution whose result (or error) is shared.
+    Only used from the event loop so the in-flight map needs no lock.
+
+    If the leading call is cancelled (ex. its client disconnected) the waiting calls retry and one of them runs it instead."""
+    def __init__(self):
+        self.in_flight = {}
+
+    def __repr__(self):
+        return f"SingleFlight(in_flight={len(self.in_flight)})"
+
+    async def run(self, key, func, endpoint, phase_timer=None):
+        while key in self.in_flight:
+            in_flight = self.in_flight[key]
+            start_time = time.perf_counter()
+            await in_flight.done.wait()
+            if phase_timer is not None:
+                phase_timer.record('coalesced', time.perf_counter() - start_time)
+            if in_flight.cancelled:
+                continue
+            COALESCED_REQUESTS.labels(endpoint).inc()
+            if in_flight.error is not None:
+                raise in_flight.error
+            # Each caller gets its own top level dict since routers add to the result (ex. next_url)
+            return copy.copy(in_flight.result)
+
+        in_flight = InFlightQuery()
+        self.in_flight[key] = in_flight
+        try:
+            in_flight.result = await func()
+            return copy.copy(in_flight.result)
+        except anyio.get_cancelled_exc_class():
+            in_flight.cancelled = True
+            raise
+        except Exception as e:
+            in_flight.error = e
+            raise
+        finally:
+            del self.in_flight[key]
+            in_flight.done.set()
+
+
+SINGLE_FLIGHT = SingleFlight()
+
+
+# Filter order within MATCH_ALL and MATCH_SOME does not change the result so it is not part of the key
+def get_request_key(endpoint, request_body, **params):
+    request_dict = request_body.to_dict()
+    for attribute in ['MATCH_ALL', 'MATCH_SOME']:
+        if request_dict.get(attribute):
+            request_dict[attribute] = sorted([filter_string.strip() for filter_string in request_dict[attribute]])
+    return (endpoint, DB_INFO.release_key, json.dumps(request_dict, sort_keys=True), json.dumps(params, sort_keys=True))
+
+
+async def run_coalesced(endpoint, request_body, func, phase_timer=None, **params):
+    """Runs func, sharing the execution with any identical request already in flight
+
+    Args:
+        endpoint (str): Endpoint path (ex. '/summary/subject')
+        request_body (DataRequestBody | SummaryRequestBody): Request body
+        func (Callable): Async callable that runs the query
+        phase_timer (PhaseTimer, optional): Records the time spent waiting on another request as 'coalesced'
+        **params: Query parameters that change the result (ex. limit and offset)
+
+    Returns:
+        dict: Query result
+    """
+    if not QUERY_COALESCING_ENABLED:
+        return await func()
+    key = get_request_key(endpoint, request_body, **params)
+    return await SINGLE_FLIGHT.run(key, func, endpoint, phase_timer)
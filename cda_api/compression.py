@@ -0,0 +1,182 @@
+import zlib
+from os import getenv
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from cda_api import get_logger
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+log = get_logger('compression.py')
+
+# Compress responses with the best encoding the client accepts (on by default)
+RESPONSE_COMPRESSION_ENABLED = getenv("RESPONSE_COMPRESSION_ENABLED", "true").lower() == "true"
+# Encodings to offer in order of preference. zstd and br are skipped when zstandard/brotli aren't installed
+COMPRESSION_ENCODINGS = [encoding.strip() for encoding in getenv("COMPRESSION_ENCODINGS", "zstd,br,gzip").split(",") if encoding.strip()]
+# Responses smaller than this (in bytes) are sent uncompressed
+COMPRESSION_MIN_SIZE = int(getenv("COMPRESSION_MIN_SIZE", 1024))
+# Higher levels trade CPU time for smaller responses
+COMPRESSION_GZIP_LEVEL = int(getenv("COMPRESSION_GZIP_LEVEL", 6))
+COMPRESSION_ZSTD_LEVEL = int(getenv("COMPRESSION_ZSTD_LEVEL", 3))
+COMPRESSION_BROTLI_LEVEL = int(getenv("COMPRESSION_BROTLI_LEVEL", 4))
+
+
+class GzipCompressor:
+    def __init__(self):
+        self.compressor = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data=b''):
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_FINISH)
+
+
+class ZstdCompressor:
+    def __init__(self):
+        self.compressor = zstandard.ZstdCompressor(level=COMPRESSION_ZSTD_LEVEL).compressobj()
+
+    def compress(self, data):
+        return self.compressor.compress(data) + self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self, data=b''):
+        return self.compressor.compress(data) + self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+class BrotliCompressor:
+    def __init__(self):
+        self.compressor = brotli.Compressor(quality=COMPRESSION_BROTLI_LEVEL)
+
+    def compress(self, data):
+        return self.compressor.process(data) + self.compressor.flush()
+
+    def finish(self, data=b''):
+        return self.compressor.process(data) + self.compressor.finish()
+
+
+COMPRESSORS = {'gzip': GzipCompressor}
+if zstandard is not None:
+    COMPRESSORS['zstd'] = ZstdCompressor
+if brotli is not None:
+    COMPRESSORS['br'] = BrotliCompressor
+
+for encoding in COMPRESSION_ENCODINGS:
+    if encoding not in COMPRESSORS.keys():
+        log.warning(f'Response encoding {encoding} is unknown or its library is not installed. It will not be offered')
+
+
+def get_accepted_encodings(accept_encoding):
+    """Parses an Accept-Encoding header
+
+    Args:
+        accept_encoding (str): Accept-Encoding header (ex. "gzip, br;q=0.8, *;q=0")
+
+    Returns:
+        dict: Map of encoding to its quality value
+    """
+    accepted_encodings = {}
+    for item in accept_encoding.split(','):
+        encoding, *parameters = [part.strip() for part in item.split(';')]
+        if not encoding:
+            continue
+        quality = 1.0
+        for parameter in parameters:
+            name, _, value = parameter.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted_encodings[encoding.lower()] = quality
+    return accepted_encodings
+
+
+# Returns the offered encoding the client prefers (ties go to the order of COMPRESSION_ENCODINGS) or None
+def choose_encoding(accept_encoding):
+    accepted_encodings = get_accepted_encodings(accept_encoding)
+    chosen_encoding = None
+    chosen_quality = 0.0
+    for encoding in COMPRESSION_ENCODINGS:
+        if encoding not in COMPRESSORS.keys():
+            continue
+        quality = accepted_encodings.get(encoding, accepted_encodings.get('*', 0.0))
+        if quality > chosen_quality:
+            chosen_encoding = encoding
+            chosen_quality = quality
+    return chosen_encoding
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing responses with the encoding negotiated from Accept-Encoding.
+    Streamed responses are compressed chunk by chunk and each compressed chunk is flushed to the client as it is produced"""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get('accept-encoding', ''))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await CompressionResponder(self.app, encoding)(scope, receive, send)
+
+
+class CompressionResponder:
+    def __init__(self, app, encoding):
+        self.app = app
+        self.encoding = encoding
+        self.send = None
+        self.start_message = None
+        self.compressor = None
+        self.started = False
+
+    async def __call__(self, scope, receive, send):
+        self.send = send
+        await self.app(scope, receive, self.send_compressed)
+
+    async def send_compressed(self, message):
+        if message['type'] == 'http.response.start':
+            # Held until the first body message shows whether the response is worth compressing
+            self.start_message = message
+            return
+        if message['type'] != 'http.response.body':
+            await self.send(message)
+            return
+
+        body = message.get('body', b'')
+        more_body = message.get('more_body', False)
+        if not self.started:
+            self.started = True
+            headers = MutableHeaders(raw=self.start_message['headers'])
+            if ('content-encoding' in headers) or ((not more_body) and (len(body) < COMPRESSION_MIN_SIZE)):
+                await self.send(self.start_message)
+                await self.send(message)
+                return
+            self.compressor = COMPRESSORS[self.encoding]()
+            headers['Content-Encoding'] = self.encoding
+            headers.add_vary_header('Accept-Encoding')
+            if more_body:
+                del headers['Content-Length']
+                body = self.compressor.compress(body)
+            else:
+                body = self.compressor.finish(body)
+                headers['Content-Length'] = str(len(body))
+            await self.send(self.start_message)
+            await self.send({'type': 'http.response.body', 'body': body, 'more_body': more_body})
+            return
+
+        if self.compressor is None:
+            await self.send(message)
+            return
+        body = self.compressor.compress(body) if more_body else self.compressor.finish(body)
+        await self.send({'type': 'http.response.body', 'body': body, 'more_body': more_body})
@@ -1,5 +1,9 @@
+from os import getenv
+
 from cda_api import get_logger
+from cda_api.classes.CohortStore import DatabaseCohortStore
 from cda_api.classes.DatabaseInfo import DatabaseInfo
+from cda_api.classes.TTLCache import TTLCache
 from .connection import get_db
 from .schema import Base
 
@@ -7,4 +11,32 @@ from .schema import Base
 DB_INFO = DatabaseInfo(Base)
 log = get_logger("Utility: db/__init__.py")
 
+# Server-side cohorts of uploaded IDs referenced in filters as "<column> in @cohort:<handle>"
+COHORT_TTL_SECONDS = int(getenv("COHORT_TTL_SECONDS", 3600))
+COHORT_MAX_ENTRIES = int(getenv("COHORT_MAX_ENTRIES", 1000))
+COHORT_MAX_SIZE = int(getenv("COHORT_MAX_SIZE", 500000))
+# Where cohorts are kept:
+#   memory   - in each worker process (a handle only works on the worker that created it and is lost on restart)
+#   database - in COHORT_STORE_SCHEMA.COHORT_STORE_TABLE (created if missing), shared by every worker and replica
+COHORT_STORAGE = getenv("COHORT_STORAGE", "memory").lower()
+COHORT_STORE_SCHEMA = getenv("COHORT_STORE_SCHEMA", "cda_api")
+COHORT_STORE_TABLE = getenv("COHORT_STORE_TABLE", "cohort")
+if COHORT_STORAGE == 'database':
+    COHORT_STORE = DatabaseCohortStore(COHORT_STORE_SCHEMA, COHORT_STORE_TABLE, COHORT_TTL_SECONDS, COHORT_MAX_ENTRIES)
+elif COHORT_STORAGE == 'memory':
+    COHORT_STORE = TTLCache('cohort', COHORT_TTL_SECONDS, COHORT_MAX_ENTRIES)
+else:
+    raise Exception(f"COHORT_STORAGE: {COHORT_STORAGE} not recognized please select from ['memory', 'database']")
+
+
+
+# Filtered preselects materialized as sorted ID arrays so later pages (and the matching summary) skip re-filtering
+# (off by default: every new request body pays an EXPLAIN and a probe query, and the cached IDs are held per worker)
+PRESELECT_CACHE_ENABLED = getenv("PRESELECT_CACHE_ENABLED", "false").lower() == "true"
+PRESELECT_CACHE_TTL_SECONDS = int(getenv("PRESELECT_CACHE_TTL_SECONDS", 600))
+PRESELECT_CACHE_MAX_ENTRIES = int(getenv("PRESELECT_CACHE_MAX_ENTRIES", 200))
+PRESELECT_CACHE_MAX_ROWS = int(getenv("PRESELECT_CACHE_MAX_ROWS", 100000))
+PRESELECT_CACHE = TTLCache('filtered_preselect', PRESELECT_CACHE_TTL_SECONDS, PRESELECT_CACHE_MAX_ENTRIES)
 
+# Fraction of the filtered endpoint rows summarized by /summary requests with approximate=true
+SUMMARY_SAMPLE_RATE = float(getenv("SUMMARY_SAMPLE_RATE", 0.05))
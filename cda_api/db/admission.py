@@ -0,0 +1,100 @@
+import json
+from os import getenv
+
+from cda_api import QueryCostExceeded
+from cda_api.metrics import ADMISSION_DECISIONS
+
+# Pre-flight EXPLAIN of data and summary queries before they are run (off by default)
+QUERY_ADMISSION_ENABLED = getenv("QUERY_ADMISSION_ENABLED", "false").lower() == "true"
+# What to do with a query estimated to be over budget:
+#   reject       - return a QueryCostExceeded error
+#   low_priority - run it in the low_priority scheduler lane
+#   log          - log a warning and run it anyway
+QUERY_ADMISSION_ACTIONS = ['reject', 'low_priority', 'log']
+QUERY_OVER_BUDGET_ACTION = getenv("QUERY_OVER_BUDGET_ACTION", "reject").lower()
+if QUERY_OVER_BUDGET_ACTION not in QUERY_ADMISSION_ACTIONS:
+    raise Exception(f'QUERY_OVER_BUDGET_ACTION: {QUERY_OVER_BUDGET_ACTION} not recognized please select from {QUERY_ADMISSION_ACTIONS}')
+
+
+# Budgets can be set per query type (ex. SUMMARY_QUERY_MAX_COST) and fall back to the shared budget (ex. QUERY_MAX_COST)
+def get_query_budget(query_type, budget_name, default):
+    return float(getenv(f"{query_type.upper()}_QUERY_{budget_name}", getenv(f"QUERY_{budget_name}", default)))
+
+
+QUERY_BUDGETS = {
+    query_type: {
+        'cost': get_query_budget(query_type, 'MAX_COST', 1e8),
+        'rows': get_query_budget(query_type, 'MAX_ROWS', 1e8),
+    }
+    for query_type in ['data', 'summary']
+}
+
+
+def explain_query(db, statement):
+    # Bound parameters are passed to the driver rather than rendered so the plan matches the real query
+    compiled = statement.compile(dialect=db.get_bind().dialect, compile_kwargs={"render_postcompile": True})
+    plan = db.connection().exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']
+
+
+# Largest row estimate of any node in the plan (the top node of a paged query only estimates the page)
+def get_max_plan_rows(plan):
+    return max([plan['Plan Rows']] + [get_max_plan_rows(child_plan) for child_plan in plan.get('Plans', [])])
+
+
+def estimate_query(db, statement, log):
+    plan = explain_query(db, statement)
+    cost = plan['Total Cost']
+    rows = get_max_plan_rows(plan)
+    log.info(f"Estimated query cost: {cost} | Estimated rows: {rows}")
+    return cost, rows
+
+
+def is_within_budget(db, statement, query_type, log):
+    """Checks a statement against the query type's budget without applying QUERY_OVER_BUDGET_ACTION or counting a decision.
+    Used for optional work (ex. materializing a preselect) that can be skipped when it is over budget
+
+    Args:
+        db (Session): Database session object
+        statement (Select): Statement that would be executed
+        query_type (str): 'data' or 'summary'
+
+    Returns:
+        bool: True if the statement is within budget (always True when admission control is off)
+    """
+    if not QUERY_ADMISSION_ENABLED:
+        return True
+    cost, rows = estimate_query(db, statement, log)
+    budget = QUERY_BUDGETS[query_type]
+    return (cost <= budget['cost']) and (rows <= budget['rows'])
+
+
+def check_query_admission(db, statement, query_type, log):
+    """Estimates the cost of a query with EXPLAIN and applies QUERY_OVER_BUDGET_ACTION when it is over budget
+
+    Args:
+        db (Session): Database session object
+        statement (Select): Statement about to be executed
+        query_type (str): 'data' or 'summary'
+
+    Returns:
+        str | None: The action applied to an over budget query, None if the query was admitted
+    """
+    if not QUERY_ADMISSION_ENABLED:
+        return None
+
+    cost, rows = estimate_query(db, statement, log)
+    budget = QUERY_BUDGETS[query_type]
+    if (cost <= budget['cost']) and (rows <= budget['rows']):
+        ADMISSION_DECISIONS.labels(query_type, 'admit').inc()
+        return None
+
+    ADMISSION_DECISIONS.labels(query_type, QUERY_OVER_BUDGET_ACTION).inc()
+    message = f"Query is estimated to be too expensive to run (cost: {cost:.0f}, rows: {rows:.0f}, budget: {budget['cost']:.0f} cost, {budget['rows']:.0f} rows)"
+    if QUERY_OVER_BUDGET_ACTION == 'reject':
+        log.warning(message)
+        raise QueryCostExceeded(f"{message}. Please narrow the query with additional MATCH_ALL filters or fewer ADD_COLUMNS")
+    log.warning(f"{message}. Running anyway ({QUERY_OVER_BUDGET_ACTION})")
+    return QUERY_OVER_BUDGET_ACTION
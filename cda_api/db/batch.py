@@ -0,0 +1,179 @@
+import re
+import threading
+from contextlib import contextmanager
+from functools import partial
+from os import getenv
+
+import anyio
+from pydantic import ValidationError
+from sqlalchemy import text
+
+from cda_api import CDABaseException, EmptyQueryError, InvalidBatchRequest
+from cda_api.application_functions import convert_exceptions
+from cda_api.classes.models import DataRequestBody, SummaryRequestBody
+from cda_api.db.connection import session
+from cda_api.metrics import observe_error
+from cda_api.scheduler import LANES, run_in_lane
+from .query_builders import column_values_query, data_query, summary_query
+
+BATCH_MAX_REQUESTS = int(getenv("BATCH_MAX_REQUESTS", 20))
+# Sub-requests of one batch run at the same time. With the default of 1 they run one after another on the batch's own
+# session; above 1 the additional sub-requests run on sessions importing the batch's snapshot
+BATCH_CONCURRENCY = int(getenv("BATCH_CONCURRENCY", 1))
+
+SNAPSHOT_ID_PATTERN = re.compile(r'^[0-9A-Fa-f-]+$')
+
+
+class SnapshotSessions:
+    """Sessions that all read from the same snapshot of the database.
+    The batch's own session runs in a REPEATABLE READ transaction. When sub-requests run concurrently it exports its
+    snapshot with pg_export_snapshot() and sub-requests that find it busy run on a new session importing that snapshot.
+    Imported sessions only live for their sub-request, which holds a slot of its lane, so they are counted against the lanes.
+
+    Each sub-request runs in a savepoint so an error in one does not abort the transaction for the rest."""
+    def __init__(self, db):
+        self.db = db
+        self.snapshot_id = None
+        self._db_idle = False
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"SnapshotSessions({self.snapshot_id})"
+
+    def begin(self, export_snapshot):
+        self.db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+        if export_snapshot:
+            self.snapshot_id = self.db.execute(text("SELECT pg_export_snapshot()")).scalar()
+            if not SNAPSHOT_ID_PATTERN.match(self.snapshot_id):
+                raise Exception(f'Unexpected snapshot id: {self.snapshot_id}')
+        self._db_idle = True
+
+    def _import_snapshot(self):
+        db = session()
+        db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+        # SET TRANSACTION SNAPSHOT does not accept bound parameters
+        db.execute(text(f"SET TRANSACTION SNAPSHOT '{self.snapshot_id}'"))
+        return db
+
+    @contextmanager
+    def checkout(self):
+        with self._lock:
+            use_batch_session = self._db_idle
+            self._db_idle = False
+        if use_batch_session:
+            try:
+                yield self.db
+            finally:
+                with self._lock:
+                    self._db_idle = True
+            return
+        if self.snapshot_id is None:
+            raise Exception('The batch session is busy and no snapshot was exported for concurrent sub-requests')
+        db = self._import_snapshot()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def run(self, query):
+        with self.checkout() as db:
+            with db.begin_nested():
+                return query(db)
+
+
+# Returns the scheduler lane and the query function (taking only the session) for a sub-request
+def get_sub_request_query(sub_request, log):
+    path_components = [component for component in sub_request.endpoint.split('/') if component]
+    params = sub_request.params or {}
+    body = sub_request.body or {}
+    if len(path_components) != 2:
+        raise InvalidBatchRequest(f'Unsupported batch endpoint: {sub_request.endpoint}. Expected /data/<table>, /summary/<table> or /column_values/<column>')
+    router, path_parameter = path_components
+
+    try:
+        if (router == 'data') and (path_parameter in ['file', 'subject']):
+            request_body = DataRequestBody(**body)
+        elif (router == 'summary') and (path_parameter in ['file', 'subject']):
+            request_body = SummaryRequestBody(**body)
+        elif router != 'column_values':
+            raise InvalidBatchRequest(f'Unsupported batch endpoint: {sub_request.endpoint}. Expected /data/<table>, /summary/<table> or /column_values/<column>')
+    except ValidationError as e:
+        raise InvalidBatchRequest(f'Invalid body for {sub_request.endpoint}: {e}')
+
+    if router == 'column_values':
+        return 'column_values', partial(
+            column_values_query,
+            column_name=path_parameter,
+            data_source_string=params.get('data_source', ''),
+            limit=params.get('limit'),
+            offset=params.get('offset'),
+            log=log,
+        )
+    if request_body.is_empty():
+        raise EmptyQueryError("Must provide either/both of 'MATCH_ALL' or 'MATCH_SOME' within the request body")
+    if router == 'data':
+        return 'data', partial(
+            data_query,
+            endpoint_table_name=path_parameter,
+            request_body=request_body,
+            limit=params.get('limit', 100),
+            offset=params.get('offset', 0),
+            log=log,
+        )
+    return 'summary', partial(summary_query, endpoint_table_name=path_parameter, request_body=request_body, log=log, approximate=params.get('approximate', False))
+
+
+async def run_sub_request(snapshot_sessions, sub_request, log):
+    try:
+        lane_name, query = get_sub_request_query(sub_request, log)
+        result = await run_in_lane(lane_name, partial(snapshot_sessions.run, query))
+        return {'endpoint': sub_request.endpoint, 'status_code': 200, 'result': result}
+    except Exception as e:
+        if not isinstance(e, CDABaseException):
+            e = convert_exceptions(e, log)
+        log.error(f'Batch sub-request {sub_request.endpoint} failed: {e.message}')
+        observe_error(e.name)
+        return {'endpoint': sub_request.endpoint, 'status_code': e.status_code, 'error_type': e.name, 'message': e.message}
+
+
+async def batch_query(db, sub_requests, log):
+    """Runs a list of /data, /summary and /column_values sub-requests against one snapshot of the database
+
+    Args:
+        db (Session): Database session object
+        sub_requests (list[BatchSubRequest]): Sub-requests to run
+        log (Logger): Logger
+
+    Returns:
+        BatchResponseObj:
+        {
+            'results': [{'endpoint': '/data/subject', 'status_code': 200, 'result': {'result': [...], ...}}]
+        }
+    """
+    if not sub_requests:
+        raise InvalidBatchRequest('REQUESTS must contain at least one sub-request')
+    if len(sub_requests) > BATCH_MAX_REQUESTS:
+        raise InvalidBatchRequest(f'Too many sub-requests ({len(sub_requests)}). A batch can contain at most {BATCH_MAX_REQUESTS}')
+
+    log.info(f'Running batch of {len(sub_requests)} sub-requests')
+    concurrency = min(BATCH_CONCURRENCY, len(sub_requests))
+    results = [None] * len(sub_requests)
+    # The batch lane bounds how many batches (and so batch sessions) are open at once
+    async with LANES['batch'].occupy():
+        snapshot_sessions = SnapshotSessions(db)
+        await anyio.to_thread.run_sync(snapshot_sessions.begin, concurrency > 1)
+        if concurrency <= 1:
+            for index, sub_request in enumerate(sub_requests):
+                results[index] = await run_sub_request(snapshot_sessions, sub_request, log)
+            return {'results': results}
+
+        limiter = anyio.CapacityLimiter(concurrency)
+
+        async def run_indexed_sub_request(index, sub_request):
+            async with limiter:
+                results[index] = await run_sub_request(snapshot_sessions, sub_request, log)
+
+        async with anyio.create_task_group() as task_group:
+            for index, sub_request in enumerate(sub_requests):
+                task_group.start_soon(run_indexed_sub_request, index, sub_request)
+    return {'results': results}
@@ -39,7 +39,10 @@ SQLALCHEMY_DATABASE_URL = f"postgresql://{DB_USERNAME}:{DB_PASSWORD}@{DB_HOSTNAM
 
 # Create sqlalchemy database engine object and Session
 log.info("Creating database engine and session objects")
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+# Connection pool shared by every request and background thread (SQLAlchemy's defaults)
+DB_POOL_SIZE = int(getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(getenv("DB_MAX_OVERFLOW", 10))
+engine = create_engine(SQLALCHEMY_DATABASE_URL, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
 # TODO determine if there is a better (more secure) way to set up sessions
 session = sessionmaker(bind=engine)
 
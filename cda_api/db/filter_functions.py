@@ -1,6 +1,18 @@
 import ast
-from sqlalchemy import func, and_, or_
-from cda_api import ParsingError
+import json
+import re
+from os import getenv
+from sqlalchemy import func, and_, or_, any_, all_, Text
+from cda_api import ParsingError, CohortNotFound
+from cda_api.db import COHORT_STORE
+from cda_api.db.query_functions import bind_array
+
+
+# Lists with more values than this are bound as a single array parameter instead of being inlined
+IN_LIST_ARRAY_THRESHOLD = int(getenv("IN_LIST_ARRAY_THRESHOLD", 100))
+
+# Prefix used to reference an uploaded cohort in place of a list value -> "subject_id in @cohort:<handle>"
+COHORT_REFERENCE_PREFIX = "@cohort:"
 
 
 # Parse out the key components from the filter string
@@ -64,11 +76,16 @@ def parse_filter_string(filter_string, log):
 
 
         # Use ast.literal_eval() to safely evaluate the value
-        try:
-            value = ast.literal_eval(value_string)
-        except Exception:
-            # If there is an error, just handle as a string
-            value = value_string
+        if value_string.startswith(COHORT_REFERENCE_PREFIX):
+            value = get_cohort_values(value_string[len(COHORT_REFERENCE_PREFIX):])
+        else:
+            try:
+                value = parse_list_value_string(value_string)
+                if value is None:
+                    value = ast.literal_eval(value_string)
+            except Exception:
+                # If there is an error, just handle as a string
+                value = value_string
 
         # Check if value is null
         if isinstance(value, str):
@@ -98,7 +115,7 @@ def parse_filter_string(filter_string, log):
                 f'Value: {value_string} must be a list (ex. [1,2,3] or ["a","b","c"]) when using "in" or "not in" operators -> filter: "{filter_string}"'
             )
 
-        log.debug(f"columnname: {columnname}, operator: {operator}, value: {value}, value type: {type(value)}")
+        log.debug(f"columnname: {columnname}, operator: {operator}, value: {format_filter_value(value)}, value type: {type(value)}")
 
         return columnname.lower(), operator.lower(), value
     
@@ -107,8 +124,53 @@ def parse_filter_string(filter_string, log):
 
 
 
+# Large "in" lists are common for cohort queries and json.loads() parses them much faster than ast.literal_eval()
+def parse_list_value_string(value_string):
+    if not (value_string.startswith('[') and value_string.endswith(']')):
+        return None
+    try:
+        value = json.loads(value_string)
+    except ValueError:
+        # Lists using single quotes or tuples are left to ast.literal_eval()
+        return None
+    # json's true/false/null aren't python literals, so lists using them are left to fail in ast.literal_eval() like before
+    if not isinstance(value, list) or any((item is None) or isinstance(item, (bool, list, dict)) for item in value):
+        return None
+    return value
+
+
+# Keeps logs readable when a filter uses a large list or cohort
+def format_filter_value(value):
+    if isinstance(value, CohortValues):
+        return f'{value.reference} ({len(value)} values)'
+    if isinstance(value, list) and len(value) > IN_LIST_ARRAY_THRESHOLD:
+        return f'[{len(value)} values]'
+    return value
+
+
+class CohortValues(list):
+    """IDs of an uploaded cohort. Filters on them are always bound as an array and shown by their cohort reference
+    in query_sql so the IDs aren't sent back with every response"""
+    def __init__(self, handle, values):
+        super().__init__(values)
+        self.handle = handle
+        self.reference = f'{COHORT_REFERENCE_PREFIX}{handle}'
+
+    def with_values(self, values):
+        return CohortValues(self.handle, values)
+
+
+# Returns the list of IDs stored for an uploaded cohort
+def get_cohort_values(handle):
+    handle = handle.strip()
+    values = COHORT_STORE.get(handle)
+    if values is None:
+        raise CohortNotFound(f'Cohort not found: "{handle}". Cohorts expire so it may need to be uploaded again')
+    return CohortValues(handle, values)
+
+
 def apply_filter_operator(filter_column, filter_value, filter_operator, log):
-    log.debug(f"Building SQLAlchemy filter: {filter_column} {filter_operator} {filter_value}")
+    log.debug(f"Building SQLAlchemy filter: {filter_column} {filter_operator} {format_filter_value(filter_value)}")
     if isinstance(filter_operator, tuple):
         first_operator, second_operator = filter_operator
         first_value, second_value = filter_value
@@ -172,24 +234,46 @@ def apply_filter_operator(filter_column, filter_value, filter_operator, log):
                 raise ParsingError(f"Unexpected operator: {filter_operator}")
 
 
+# The case insensitive filters compare upper(column) so they can use expression indexes on upper(column)
+# (btree for equality/in and gin upper(column) gin_trgm_ops for like). Null values are handled as empty strings,
+# but only need an extra "column is null" check when an empty string would satisfy the filter.
+
+
+# Returns true if the like pattern also matches an empty string (ex. "%")
+def like_pattern_matches_empty_string(value):
+    return isinstance(value, str) and value.replace('%', '') == ''
+
+
 # Returns a case insensitive like filter conditional object
 def case_insensitive_like(column, value):
-    return func.coalesce(func.upper(column), "").like(func.upper(value))
+    clause = func.upper(column).like(func.upper(value))
+    if like_pattern_matches_empty_string(value):
+        return or_(column.is_(None), clause)
+    return clause
 
 
 # Returns a case insensitive equals filter conditional object
 def case_insensitive_equals(column, value):
-    return func.coalesce(func.upper(column), "") == func.upper(value)
+    clause = func.upper(column) == func.upper(value)
+    if value == '':
+        return or_(column.is_(None), clause)
+    return clause
 
 
 # Returns a case insensitive like filter conditional object
 def case_insensitive_not_like(column, value):
-    return func.coalesce(func.upper(column), "").not_like(func.upper(value))
+    clause = func.upper(column).not_like(func.upper(value))
+    if like_pattern_matches_empty_string(value):
+        return clause
+    return or_(column.is_(None), clause)
 
 
 # Returns a case insensitive equals filter conditional object
 def case_insensitive_not_equals(column, value):
-    return func.coalesce(func.upper(column), "") == func.upper(value)
+    clause = func.upper(column) != func.upper(value)
+    if value == '':
+        return clause
+    return or_(column.is_(None), clause)
 
 
 # Returns a case insensitive 'is not' filter conditional object
@@ -197,15 +281,94 @@ def case_insensitive_is_not(column, value):
     return func.coalesce(func.upper(column), "").is_not(func.upper(value))
 
 
+# Uppercases string list values, keeping track of the cohort they came from
+def upper_list_values(value):
+    upper_values = [item.upper() for item in value]
+    if isinstance(value, CohortValues):
+        return value.with_values(upper_values)
+    return upper_values
+
+
 def in_array(column, value):
     if isinstance(value[0], str):
-        return func.coalesce(func.upper(column), "").in_([item.upper() for item in value]) 
+        upper_values = upper_list_values(value)
+        clause = bound_in(func.upper(column), upper_values, Text())
+        if '' in upper_values:
+            return or_(column.is_(None), clause)
+        return clause
     else:
-        return column.in_(value)
+        return bound_in(column, value, column.type)
 
 
 def not_in_array(column, value):
     if isinstance(value[0], str):
-        return func.coalesce(func.upper(column), "").not_in([item.upper() for item in value]) 
+        upper_values = upper_list_values(value)
+        clause = bound_not_in(func.upper(column), upper_values, Text())
+        if '' in upper_values:
+            return clause
+        return or_(column.is_(None), clause)
     else:
+        return bound_not_in(column, value, column.type)
+
+
+# Returns the equivalent of a case insensitive (not) like filter given the values already known to match the pattern
+def expanded_like(column, matching_values, pattern, negate=False):
+    if negate:
+        clause = bound_not_in(column, matching_values, column.type)
+        if like_pattern_matches_empty_string(pattern):
+            return clause
+        return or_(column.is_(None), clause)
+    clause = bound_in(column, matching_values, column.type)
+    if like_pattern_matches_empty_string(pattern):
+        return or_(column.is_(None), clause)
+    return clause
+
+
+# Returns an "in" filter which binds large lists as a single array parameter -> column = ANY(:array)
+# This keeps the size of the SQL (and the query_sql of the response) constant and the plan stable regardless of how many values are provided
+def bound_in(column, value, item_type):
+    if isinstance(value, CohortValues):
+        return column == any_(bind_array(value, item_type, placeholder=value.reference))
+    if len(value) <= IN_LIST_ARRAY_THRESHOLD:
+        return column.in_(value)
+    return column == any_(bind_array(value, item_type))
+
+
+# Returns a "not in" filter which binds large lists as a single array parameter -> column != ALL(:array)
+def bound_not_in(column, value, item_type):
+    if isinstance(value, CohortValues):
+        return column != all_(bind_array(value, item_type, placeholder=value.reference))
+    if len(value) <= IN_LIST_ARRAY_THRESHOLD:
         return column.not_in(value)
+    return column != all_(bind_array(value, item_type))
+
+
+# Translates a SQL like pattern into a compiled (case insensitive by default) regular expression
+def like_pattern_to_regex(pattern, ignore_case=True):
+    regex = ''.join(['.*' if char == '%' else '.' if char == '_' else re.escape(char) for char in pattern])
+    return re.compile(regex, (re.IGNORECASE | re.DOTALL) if ignore_case else re.DOTALL)
+
+
+# Returns the controlled_term id_alias values whose name satisfies the filter, or None if the filter can't be evaluated in memory
+def match_controlled_term_ids(controlled_term_map, filter_value, filter_operator):
+    if isinstance(filter_operator, tuple):
+        return None
+    filter_operator = filter_operator.lower()
+    if filter_operator in ["like", "not like", "=", "!="]:
+        if not isinstance(filter_value, str):
+            return None
+        if filter_operator in ["like", "not like"]:
+            pattern = like_pattern_to_regex(filter_value)
+            matches = lambda name: pattern.fullmatch(name or '') is not None
+        else:
+            matches = lambda name: (name or '').upper() == filter_value.upper()
+        negate = filter_operator in ["not like", "!="]
+    elif filter_operator in ["in", "not in"]:
+        if not all(isinstance(item, str) for item in filter_value):
+            return None
+        values = set([item.upper() for item in filter_value])
+        matches = lambda name: (name or '').upper() in values
+        negate = filter_operator == "not in"
+    else:
+        return None
+    return [id_alias for id_alias, name in controlled_term_map.items() if matches(name) != negate]
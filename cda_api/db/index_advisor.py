@@ -0,0 +1,113 @@
+import re
+
+from sqlalchemy import String, text
+
+from cda_api import get_logger
+from cda_api.db import DB_INFO
+from cda_api.db.connection import session
+
+log = get_logger("Utility: index_advisor.py")
+
+# Postgres limits identifiers to 63 characters
+MAX_INDEX_NAME_LENGTH = 63
+
+
+# Returns a map of table name to the normalized "method + expression" portion of each index definition
+# ex. 'CREATE INDEX x ON public.subject USING btree (upper((species)::text))' -> 'btreeupperspecies'
+def get_normalized_index_map(db):
+    index_definitions = db.execute(text("SELECT tablename, indexdef FROM pg_indexes WHERE schemaname = current_schema()")).all()
+    index_map = {}
+    for table_name, index_definition in index_definitions:
+        index_definition = index_definition.lower().split(' where ')[0]
+        index_definition = re.sub(r'::(character varying|[a-z_]+)', '', index_definition)
+        index_definition = index_definition.split(' using ', 1)[-1]
+        index_definition = re.sub(r'[\s"()]', '', index_definition)
+        if table_name not in index_map.keys():
+            index_map[table_name] = []
+        index_map[table_name].append(index_definition)
+    return index_map
+
+
+def has_matching_index(table_indexes, expected_index):
+    return any((index == expected_index) or index.startswith(f'{expected_index},') for index in table_indexes)
+
+
+def get_index_name(table_name, column_name, suffix):
+    return f'{table_name}_{column_name}_{suffix}'[:MAX_INDEX_NAME_LENGTH]
+
+
+# Returns the indexes the filter builder expects for a column as (index_type, normalized index, DDL)
+def get_expected_indexes(column_info):
+    table_name = column_info.parent_table_info.name
+    column_name = column_info.db_column.name
+    if isinstance(column_info.db_column.type, String):
+        # Case insensitive filters compare upper(column) -> btree for =/in and trigram for like
+        return [
+            ('upper_btree', f'btreeupper{column_name}',
+             f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {get_index_name(table_name, column_name, "upper_idx")} ON {table_name} (upper({column_name}));'),
+            ('upper_trigram', f'ginupper{column_name}gin_trgm_ops',
+             f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {get_index_name(table_name, column_name, "upper_trgm_idx")} ON {table_name} USING gin (upper({column_name}) gin_trgm_ops);'),
+        ]
+    return [
+        ('btree', f'btree{column_name}',
+         f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {get_index_name(table_name, column_name, "idx")} ON {table_name} ({column_name});'),
+    ]
+
+
+# Gets the filterable columns listed in column_metadata along with the keyword columns used by SEARCH_LIST
+def get_filterable_column_infos(db_info):
+    filterable_column_infos = []
+    for table_name, column_metadata in db_info.column_metadata_map.items():
+        for column_name in column_metadata.keys():
+            try:
+                filterable_column_infos.append(db_info.get_column_info(column_name, table_name))
+            except Exception:
+                log.warning(f'{table_name}.{column_name} is in column_metadata but not in the database')
+    for local_table_info in db_info.local_table_infos:
+        try:
+            filterable_column_infos.append(db_info.get_column_info('keyword', f'{local_table_info.name}_keywords'))
+        except Exception:
+            log.warning(f'No keyword table found for {local_table_info.name}')
+    return filterable_column_infos
+
+
+def get_missing_indexes(db, db_info):
+    """Reports which filterable columns lack an index matching the predicates emitted by the filter builder
+
+    Args:
+        db (Session): Database session object
+        db_info (DatabaseInfo): DatabaseInfo object
+
+    Returns:
+        list: [{'table': 'table name', 'column': 'column name', 'index_type': 'btree | upper_btree | upper_trigram', 'ddl': 'CREATE INDEX ...'}]
+    """
+    index_map = get_normalized_index_map(db)
+    missing_indexes = []
+    for column_info in get_filterable_column_infos(db_info):
+        table_name = column_info.parent_table_info.name
+        table_indexes = index_map.get(table_name, [])
+        for index_type, expected_index, ddl in get_expected_indexes(column_info):
+            if not has_matching_index(table_indexes, expected_index):
+                missing_indexes.append({'table': table_name, 'column': column_info.db_column.name, 'index_type': index_type, 'ddl': ddl})
+    return missing_indexes
+
+
+def main():
+    db = session()
+    try:
+        missing_indexes = get_missing_indexes(db, DB_INFO)
+    finally:
+        db.close()
+    if not missing_indexes:
+        print('All filterable columns have matching indexes')
+        return
+    print(f'-- {len(missing_indexes)} missing indexes')
+    if any(missing_index['index_type'] == 'upper_trigram' for missing_index in missing_indexes):
+        print('CREATE EXTENSION IF NOT EXISTS pg_trgm;')
+    for missing_index in missing_indexes:
+        print(f"-- {missing_index['table']}.{missing_index['column']} ({missing_index['index_type']})")
+        print(missing_index['ddl'])
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,123 @@
-import time
+import json
+import uuid
+from contextlib import ExitStack
+from os import getenv
 
 from sqlalchemy import func
 
-from cda_api import SystemNotFound, RelationshipError, RelationshipNotFound, MappingError, TableNotFound, ColumnNotFound
-from cda_api.db import DB_INFO
+from cda_api import CDABaseException, SystemNotFound, RelationshipError, RelationshipNotFound, MappingError, TableNotFound, ColumnNotFound, CohortNotFound, InvalidCohortError, get_logger
+from cda_api.db import DB_INFO, COHORT_STORE, COHORT_MAX_SIZE
+from cda_api.db.connection import session
 from cda_api.db.schema import load_base
 from cda_api.classes.DataQuery import DataQuery
 from cda_api.classes.SummaryQuery import SummaryQuery
 from cda_api.classes.ColumnsQuery import ColumnsQuery
 from cda_api.classes.ColumnValuesQuery import ColumnValuesQuery
 from cda_api.classes.ReleaseMetadataQuery import ReleaseMetadataQuery
+from cda_api.classes.models import SummaryRequestBody
+from cda_api.classes.PhaseTimer import PhaseTimer
+from cda_api.classes.PrecomputedSummaries import PRECOMPUTED_SUMMARIES, PRECOMPUTED_SUMMARIES_ENABLED
+from cda_api.classes.SummarySnapshot import get_summary_snapshot
+from cda_api.classes.shared_class_functions import get_controlled_term_column_names
+from cda_api.exports import check_export_format, export_rows, get_arrow_schema
+from cda_api.application_functions import convert_exceptions
+from cda_api.metrics import observe_error, observe_result, observe_row_counts, PRECOMPUTED_SUMMARY_HITS, SUMMARY_SNAPSHOT_HITS
+from cda_api.scheduler import get_admission_lane_context
+from .admission import check_query_admission
 
 from .query_functions import (
     query_to_string,
+    decode_controlled_terms,
+    scale_sampled_summary,
 )
 
+# Rows fetched per round trip from the server-side cursors of data and column_values queries
+FETCH_BATCH_SIZE = int(getenv("FETCH_BATCH_SIZE", 1000))
 
 
-def data_query(db, endpoint_table_name, request_body, limit, offset, log):
+
+# Runs a statement on a server-side (named) cursor that fetches FETCH_BATCH_SIZE rows per round trip (psycopg2 itersize)
+# so neither psycopg2 nor SQLAlchemy buffers the whole result
+def execute_server_side(db, statement):
+    return db.execute(statement, execution_options={"yield_per": FETCH_BATCH_SIZE})
+
+
+def fetch_formatted_batches(cursor_result, format_rows, timer, lane_context=None):
+    """Fetches the rows of a server-side cursor one batch at a time and yields each batch after formatting it.
+    Only one batch of unformatted rows is held in memory at a time
+
+    Args:
+        cursor_result (CursorResult): Result of execute_server_side()
+        format_rows (Callable): Formats a list of rows
+        timer (PhaseTimer): Records the time spent fetching and formatting
+        lane_context (ExitStack, optional): Lane the query was moved to by the admission check, left once the rows are fetched. Defaults to None.
+
+    Yields:
+        Any: Formatted batch
+    """
+    batches = cursor_result.partitions()
+    try:
+        while True:
+            with timer.phase('fetch'):
+                rows = next(batches, None)
+            if rows is None:
+                return
+            with timer.phase('format'):
+                formatted_rows = format_rows(rows)
+            yield formatted_rows
+    finally:
+        cursor_result.close()
+        if lane_context is not None:
+            lane_context.close()
+
+
+# Returns a function formatting a batch of data query rows into (total_row_count, [{column1: value}, ...])
+def get_data_rows_formatter(data_query):
+    controlled_term_column_names = get_controlled_term_column_names(data_query)
+
+    def format_rows(rows):
+        row_count = rows[0][1] if rows else None
+        result = [row[0] for row in rows] # [({column1: value}, count), ({column2: value}, count)] -> [{column1: value}, {column2: value}]
+        if controlled_term_column_names:
+            result = decode_controlled_terms(result, DB_INFO.controlled_term_map, controlled_term_column_names)
+        return row_count, result
+
+    return format_rows
+
+
+def prepare_data_query(db, endpoint_table_name, request_body, limit, offset, log, timer):
+    """Builds a data query, compiles it and runs the admission check
+
+    Returns:
+        tuple: (DataQuery, query_sql, paged statement, admission action)
+    """
+    log.info("Building data query")
+    with timer.phase('build'):
+        try:
+            data_query = DataQuery(db, DB_INFO, endpoint_table_name, request_body, log)
+        except (SystemNotFound, RelationshipError, RelationshipNotFound, MappingError, TableNotFound, ColumnNotFound) as e:
+            log.warning('An error occured when building DataQuery. Rebuilding DatabaseInfo')
+            Base = load_base()
+            DB_INFO.reset(Base)
+            log.info('DatabaseInfo has been rebuilt. Rebuilding DataQuery')
+            data_query = DataQuery(db, DB_INFO, endpoint_table_name, request_body, log)
+
+        log.debug(data_query)
+        query = data_query.get_query()
+        # count_query = data_query.get_count_query()
+
+    with timer.phase('compile'):
+        query_sql = query_to_string(query)
+    log.debug(f'Query:\n{"-"*100}\n{query_sql}\n{"-"*100}')
+    # log.debug(f'Count Query:\n{"-"*100}\n{query_to_string(count_query)}\n{"-"*100}')
+
+    statement = query.offset(offset).limit(limit).statement
+    with timer.phase('admission'):
+        admission_action = check_query_admission(db, statement, 'data', log)
+    return data_query, query_sql, statement, admission_action
+
+
+def data_query(db, endpoint_table_name, request_body, limit, offset, log, timer=None):
     """Generates json formatted row data based on input query
 
     Args:
@@ -26,6 +126,7 @@ def data_query(db, endpoint_table_name, request_body, limit, offset, log):
         request_body (request_body): JSON input query
         limit (int): Offset for paged results
         offset (int): Offset for paged results.
+        timer (PhaseTimer, optional): Records the time spent in each phase. Defaults to None.
 
     Returns:
         PagedResponseObj:
@@ -36,93 +137,329 @@ def data_query(db, endpoint_table_name, request_body, limit, offset, log):
             'next_url': 'URL to acquire next paged result'
         }
     """
-    log.info("Building data query")
-    try:
-        data_query = DataQuery(db, DB_INFO, endpoint_table_name, request_body, log)
-    except (SystemNotFound, RelationshipError, RelationshipNotFound, MappingError, TableNotFound, ColumnNotFound) as e:
-        log.warning('An error occured when building DataQuery. Rebuilding DatabaseInfo')
-        Base = load_base()
-        DB_INFO.reset(Base)
-        log.info('DatabaseInfo has been rebuilt. Rebuilding DataQuery')
-        data_query = DataQuery(db, DB_INFO, endpoint_table_name, request_body, log)
+    if timer is None:
+        timer = PhaseTimer()
+    data_query, query_sql, statement, admission_action = prepare_data_query(db, endpoint_table_name, request_body, limit, offset, log, timer)
 
-    log.debug(data_query)
-    query = data_query.get_query()
-    # count_query = data_query.get_count_query()
+    # Get results from the database, formatting each batch as it is fetched
+    log.info("Running the query")
+    result = []
+    row_count = 0
+    with get_admission_lane_context(admission_action, timer):
+        with timer.phase('execute'):
+            cursor_result = execute_server_side(db, statement)
+        for batch_row_count, rows in fetch_formatted_batches(cursor_result, get_data_rows_formatter(data_query), timer):
+            if batch_row_count is not None:
+                row_count = batch_row_count
+            result.extend(rows)
+    log.info(f"Query execution time: {timer.get('execute') + timer.get('fetch')}s")
+    log.info(f"Row formatting time: {timer.get('format')}s")
+    log.info(f"Returning {len(result)} rows out of {row_count} results | limit={limit} & offset={offset}")
 
-    log.debug(f'Query:\n{"-"*100}\n{query_to_string(query)}\n{"-"*100}')
-    # log.debug(f'Count Query:\n{"-"*100}\n{query_to_string(count_query)}\n{"-"*100}')
+    ret = {"result": result, "query_sql": query_sql, "total_row_count": row_count, "next_url": ""}
+    observe_result('data', endpoint_table_name, ret)
+    return ret
+
+
+def start_data_query_batches(db, endpoint_table_name, request_body, limit, offset, log, timer):
+    """Starts a data query on a server-side cursor and fetches its first batch so errors are raised before a response is sent
+
+    Returns:
+        tuple: (DataQuery, query_sql, (total_row_count, first batch of rows), iterator of the remaining (total_row_count, rows) batches)
+    """
+    data_query, query_sql, statement, admission_action = prepare_data_query(db, endpoint_table_name, request_body, limit, offset, log, timer)
 
-    # Get results from the database
     log.info("Running the query")
-    q_start_time = time.time()
-    result = query.offset(offset).limit(limit).all()
-    # row_count = count_query.scalar()
-    # row_count = 100
-    query_time = time.time() - q_start_time
-    log.info(f"Query execution time: {query_time}s")
+    # The remaining batches are fetched while the response is sent so the query stays in its admission lane until then
+    lane_context = ExitStack()
+    lane_context.enter_context(get_admission_lane_context(admission_action, timer))
+    try:
+        with timer.phase('execute'):
+            cursor_result = execute_server_side(db, statement)
+    except BaseException:
+        lane_context.close()
+        raise
+    batches = fetch_formatted_batches(cursor_result, get_data_rows_formatter(data_query), timer, lane_context)
+    first_batch = next(batches, (None, []))
+    return data_query, query_sql, first_batch, batches
+
+
+def stream_data_query(db, endpoint_table_name, request_body, limit, offset, log, get_next_url, timer=None):
+    """Generates the same json document as data_query() as an iterator of chunks so a page is written to the response
+    one fetched batch at a time instead of being held in memory.
+    The query is started and its first batch fetched before returning so errors are still returned as error responses.
+    Errors fetching a later batch end the document with an "error" object (and a null next_url) since the status was already sent
 
-    # Format the results
-    f_start_time = time.time()
-    if result:
-        row_count = result[0][1]
-    else:
-        row_count = 0
-    result = [row[0] for row in result] # [({column1: value},), ({column2: value},)] -> [{column1: value}, {column2: value}]
-    format_time = time.time() - f_start_time
-    log.info(f"Row formatting time: {format_time}s")
-    log.info(f"Returning {len(result)} rows out of {row_count} results | limit={limit} & offset={offset}")
+    Args:
+        db (Session): Database session object (has to stay open until the iterator is exhausted)
+        endpoint_table_name (str): Name of the endpoint table
+        request_body (DataRequestBody): JSON input query
+        limit (int): Limit for paged results
+        offset (int): Offset for paged results
+        get_next_url (Callable): Takes the total_row_count and returns the next_url of the response
+        timer (PhaseTimer, optional): Records the time spent in each phase. Defaults to None.
 
-    ret = {"result": result, "query_sql": query_to_string(query), "total_row_count": row_count, "next_url": ""}
-    return ret
+    Returns:
+        Iterator[str]: Chunks of the PagedResponseObj json document
+    """
+    if timer is None:
+        timer = PhaseTimer()
+    _, query_sql, first_batch, batches = start_data_query_batches(db, endpoint_table_name, request_body, limit, offset, log, timer)
+    return _stream_data_rows(first_batch, batches, query_sql, endpoint_table_name, get_next_url, log)
+
+
+def export_data_query(db, endpoint_table_name, request_body, limit, offset, log, export_format, timer=None):
+    """Generates the rows of a data query as an Arrow IPC stream or Parquet file written one fetched batch at a time
+
+    Args:
+        db (Session): Database session object (has to stay open until the iterator is exhausted)
+        endpoint_table_name (str): Name of the endpoint table
+        request_body (DataRequestBody): JSON input query
+        limit (int): Limit for paged results
+        offset (int): Offset for paged results
+        export_format (str): "arrow" or "parquet"
+        timer (PhaseTimer, optional): Records the time spent in each phase. Defaults to None.
+
+    Returns:
+        tuple: (total_row_count, Iterator[bytes] of the file)
+    """
+    if timer is None:
+        timer = PhaseTimer()
+    check_export_format(export_format)
+    data_query, _, (row_count, rows), batches = start_data_query_batches(db, endpoint_table_name, request_body, limit, offset, log, timer)
+    row_count = row_count or 0
+    # Typed from the columns rather than the first batch so values of later batches can't fall outside of it
+    schema = get_arrow_schema(data_query)
+    return row_count, _export_data_rows(rows, batches, export_format, schema, row_count, endpoint_table_name, log)
+
+
+def _export_data_rows(first_rows, batches, export_format, schema, row_count, endpoint_table_name, log):
+    rows_returned = len(first_rows)
+
+    def count_rows():
+        nonlocal rows_returned
+        for _, rows in batches:
+            rows_returned += len(rows)
+            yield rows
+
+    yield from export_rows(first_rows, count_rows(), export_format, schema)
+    log.info(f"Exported {rows_returned} rows out of {row_count} results as {export_format}")
+    observe_row_counts('data', endpoint_table_name, rows_returned, row_count)
+
+
+def _stream_data_rows(first_batch, batches, query_sql, endpoint_table_name, get_next_url, log):
+    # The response headers (including Server-Timing) are sent before the body so the rest of the fetching isn't timed
+    row_count, rows = first_batch
+    row_count = row_count or 0
+    rows_returned = len(rows)
+    yield '{"result": [' + ', '.join(json.dumps(row) for row in rows)
+    try:
+        for batch_row_count, rows in batches:
+            if rows:
+                yield (', ' if rows_returned else '') + ', '.join(json.dumps(row) for row in rows)
+            rows_returned += len(rows)
+    except Exception as e:
+        # The 200 status was sent with the first batch. The document is closed with the error instead of being cut off
+        # so it stays valid json, and next_url is null since the page is incomplete
+        error = e if isinstance(e, CDABaseException) else convert_exceptions(e, log)
+        log.error(f"Streaming failed after {rows_returned} rows out of {row_count} results: {error.message}")
+        observe_error(error.name)
+        error_json = json.dumps({'error_type': error.name, 'message': error.message})
+        yield f'], "query_sql": {json.dumps(query_sql)}, "total_row_count": {row_count}, "next_url": null, "error": {error_json}}}'
+        return
+    yield f'], "query_sql": {json.dumps(query_sql)}, "total_row_count": {row_count}, "next_url": {json.dumps(get_next_url(row_count))}}}'
+    log.info(f"Streamed {rows_returned} rows out of {row_count} results")
+    observe_row_counts('data', endpoint_table_name, rows_returned, row_count)
 
 
 # TODO
-def summary_query(db, endpoint_table_name, request_body, log):
+def summary_query(db, endpoint_table_name, request_body, log, timer=None, approximate=False):
     """Generates json formatted summary data based on input query
 
     Args:
         db (Session): Database session object
         endpoint_tablename (str): Name of the endpoint table
         request_body (SummaryRequestBody): JSON input query
+        timer (PhaseTimer, optional): Records the time spent in each phase. Defaults to None.
+        approximate (bool, optional): Summarize a sample of the filtered rows and scale the counts. Defaults to False.
 
     Returns:
         SummaryResponseObj:
         {
             'result': [{'summary': 'data'}],
-            'query_sql': 'SQL statement used to generate result'
+            'query_sql': 'SQL statement used to generate result',
+            'sample_rate': 'fraction of the rows summarized (approximate only)',
+            'error_bounds': [{'summary': '95% error bound of each count'}] (approximate only)
         }
     """
+    if timer is None:
+        timer = PhaseTimer()
+    if PRECOMPUTED_SUMMARIES_ENABLED and not approximate:
+        warm_precomputed_summaries()
+        precomputed_summary_key = PRECOMPUTED_SUMMARIES.get_key(DB_INFO, endpoint_table_name, request_body)
+        if precomputed_summary_key is not None:
+            precomputed_summary = PRECOMPUTED_SUMMARIES.get(precomputed_summary_key)
+            if precomputed_summary is not None:
+                log.info('Serving the precomputed summary')
+                PRECOMPUTED_SUMMARY_HITS.labels(endpoint_table_name).inc()
+                observe_result('summary', endpoint_table_name, precomputed_summary)
+                return precomputed_summary
     log.debug('Building summary query')
+    with timer.phase('build'):
+        try:
+            summary_query = SummaryQuery(db, DB_INFO, endpoint_table_name, request_body, log, approximate=approximate)
+        except (SystemNotFound, RelationshipError, RelationshipNotFound, MappingError, TableNotFound, ColumnNotFound) as e:
+            log.warning('An error occured when building SummaryQuery. Rebuilding DatabaseInfo')
+            Base = load_base()
+            DB_INFO.reset(Base)
+            log.info('DatabaseInfo has been rebuilt. Rebuilding SummaryQuery')
+            summary_query = SummaryQuery(db, DB_INFO, endpoint_table_name, request_body, log, approximate=approximate)
+        log.debug(summary_query)
+        query = summary_query.get_query()
+
+    with timer.phase('compile'):
+        query_sql = query_to_string(query)
+    log.debug(f'Query:\n{"-"*60}\n{query_sql}\n{"-"*60}')
+
+    summary_snapshot = get_summary_snapshot(DB_INFO)
+    if (summary_snapshot is not None) and summary_snapshot.can_summarize(summary_query):
+        # The filtered endpoint IDs are already in memory so the summary is computed from the snapshot instead of the database
+        log.info("Summarizing from the in-memory snapshot")
+        SUMMARY_SNAPSHOT_HITS.labels(endpoint_table_name).inc()
+        with timer.phase('execute'):
+            result = summary_snapshot.summarize(summary_query)
+        log.info(f"Snapshot summary time: {timer.get('execute')}s")
+    else:
+        with timer.phase('admission'):
+            admission_action = check_query_admission(db, query.statement, 'summary', log)
+
+        # Get results from the database
+        log.info("Running the query")
+        with get_admission_lane_context(admission_action, timer):
+            with timer.phase('execute'):
+                cursor_result = db.execute(query.statement)
+            with timer.phase('fetch'):
+                result = cursor_result.all()
+        log.info(f"Query execution time: {timer.get('execute') + timer.get('fetch')}s")
+        result = [row for (row,) in result] # [({column1: value},), ({column2: value},)] -> [{column1: value}, {column2: value}]
+
+    # Format the results
+    with timer.phase('format'):
+        error_bounds = None
+        if summary_query.sample_rate is not None:
+            scaled_results = [scale_sampled_summary(row, summary_query.sample_rate, summary_query.sampled_count_keys) for row in result]
+            result = [scaled_row for scaled_row, _ in scaled_results]
+            error_bounds = [row_error_bounds for _, row_error_bounds in scaled_results]
+        controlled_term_column_names = get_controlled_term_column_names(summary_query)
+        if controlled_term_column_names:
+            result = decode_controlled_terms(result, DB_INFO.controlled_term_map, controlled_term_column_names)
+            if error_bounds is not None:
+                error_bounds = decode_controlled_terms(error_bounds, DB_INFO.controlled_term_map, controlled_term_column_names)
+    log.info(f"Row formatting time: {timer.get('format')}s")
+
+
+    # Fake return for now
+    ret = {"result": result, "query_sql": query_sql}
+    if summary_query.sample_rate is not None:
+        ret["sample_rate"] = summary_query.sample_rate
+        ret["error_bounds"] = error_bounds
+    observe_result('summary', endpoint_table_name, ret)
+    return ret
+
+
+def precompute_summary(endpoint_table_name, request_body):
+    db = session()
     try:
-        summary_query = SummaryQuery(db, DB_INFO, endpoint_table_name, request_body, log)
-    except (SystemNotFound, RelationshipError, RelationshipNotFound, MappingError, TableNotFound, ColumnNotFound) as e:
-        log.warning('An error occured when building SummaryQuery. Rebuilding DatabaseInfo')
-        Base = load_base()
-        DB_INFO.reset(Base)
-        log.info('DatabaseInfo has been rebuilt. Rebuilding SummaryQuery')
-        summary_query = SummaryQuery(db, DB_INFO, endpoint_table_name, request_body, log)
-    log.debug(summary_query)
-    query = summary_query.get_query()
+        return summary_query(db, endpoint_table_name, SummaryRequestBody(**request_body), get_logger('precomputed_summaries'))
+    finally:
+        db.close()
+
+
+def warm_precomputed_summaries():
+    """Starts precomputing the summaries of the current release in the background (once per release)"""
+    if PRECOMPUTED_SUMMARIES_ENABLED:
+        PRECOMPUTED_SUMMARIES.start_warming(DB_INFO, precompute_summary)
 
-    log.debug(f'Query:\n{"-"*60}\n{query_to_string(query)}\n{"-"*60}')
+
+def data_summary_query(db, endpoint_table_name, request_body, limit, offset, log, timer=None):
+    """Generates a page of json formatted row data and the summary of the same query in one statement.
+    The filtered preselect is built once and shared by the data and summary parts of the statement
+
+    Args:
+        db (Session): Database session object
+        endpoint_table_name (str): Name of the endpoint table
+        request_body (DataRequestBody): JSON input query
+        limit (int): Limit for paged results
+        offset (int): Offset for paged results
+        timer (PhaseTimer, optional): Records the time spent in each phase. Defaults to None.
+
+    Returns:
+        DataSummaryResponseObj:
+        {
+            'result': [{'column': 'data'}],
+            'query_sql': 'SQL statement used to generate result',
+            'total_row_count': 'total rows of data for query generated (not paged)',
+            'next_url': 'URL to acquire next paged result',
+            'summary': [{'summary': 'data'}]
+        }
+    """
+    if timer is None:
+        timer = PhaseTimer()
+    log.info("Building data summary query")
+    with timer.phase('build'):
+        try:
+            data_query = DataQuery(db, DB_INFO, endpoint_table_name, request_body, log)
+            summary_query = SummaryQuery(db, DB_INFO, endpoint_table_name, request_body, log, filtered_preselect_source=data_query)
+        except (SystemNotFound, RelationshipError, RelationshipNotFound, MappingError, TableNotFound, ColumnNotFound) as e:
+            log.warning('An error occured when building DataQuery and SummaryQuery. Rebuilding DatabaseInfo')
+            Base = load_base()
+            DB_INFO.reset(Base)
+            log.info('DatabaseInfo has been rebuilt. Rebuilding DataQuery and SummaryQuery')
+            data_query = DataQuery(db, DB_INFO, endpoint_table_name, request_body, log)
+            summary_query = SummaryQuery(db, DB_INFO, endpoint_table_name, request_body, log, filtered_preselect_source=data_query)
+        log.debug(data_query)
+        log.debug(summary_query)
+
+        # Both parts reference the same filtered_preselect CTE so it is only rendered (and evaluated) once
+        data_page = data_query.get_query().offset(offset).limit(limit).cte('data_page')
+        query = db.query(
+            db.query(func.coalesce(func.json_agg(data_page.c.json_results), func.json_build_array())).scalar_subquery().label('data_results'),
+            db.query(func.max(data_page.c.total_row_count)).scalar_subquery().label('total_row_count'),
+            summary_query.get_query().scalar_subquery().label('summary_results'),
+        )
+
+    with timer.phase('compile'):
+        query_sql = query_to_string(query)
+    log.debug(f'Query:\n{"-"*100}\n{query_sql}\n{"-"*100}')
+
+    with timer.phase('admission'):
+        admission_action = check_query_admission(db, query.statement, 'summary', log)
 
     # Get results from the database
     log.info("Running the query")
-    q_start_time = time.time()
-    result = query.all()
-    query_time = time.time() - q_start_time
-    log.info(f"Query execution time: {query_time}s")
+    with get_admission_lane_context(admission_action, timer):
+        with timer.phase('execute'):
+            cursor_result = db.execute(query.statement)
+        with timer.phase('fetch'):
+            data_result, row_count, summary_result = cursor_result.one()
+    log.info(f"Query execution time: {timer.get('execute') + timer.get('fetch')}s")
 
     # Format the results
-    f_start_time = time.time()
-    result = [row for (row,) in result] # [({column1: value},), ({column2: value},)] -> [{column1: value}, {column2: value}]
-    format_time = time.time() - f_start_time
-    log.info(f"Row formatting time: {format_time}s")
-
-
-    # Fake return for now
-    ret = {"result": result, "query_sql": query_to_string(query)}
+    with timer.phase('format'):
+        if row_count is None:
+            row_count = 0
+        summary_result = [summary_result]
+        controlled_term_column_names = get_controlled_term_column_names(data_query)
+        if controlled_term_column_names:
+            data_result = decode_controlled_terms(data_result, DB_INFO.controlled_term_map, controlled_term_column_names)
+        controlled_term_column_names = get_controlled_term_column_names(summary_query)
+        if controlled_term_column_names:
+            summary_result = decode_controlled_terms(summary_result, DB_INFO.controlled_term_map, controlled_term_column_names)
+    log.info(f"Row formatting time: {timer.get('format')}s")
+    log.info(f"Returning {len(data_result)} rows out of {row_count} results with summary | limit={limit} & offset={offset}")
+
+    ret = {"result": data_result, "query_sql": query_sql, "total_row_count": row_count, "next_url": "", "summary": summary_result}
+    observe_result('data_summary', endpoint_table_name, ret)
     return ret
 
 
@@ -152,12 +489,13 @@ def columns_query(db, log):
     return columns_query.get_result()
 
 
-def column_values_query(db, column_name, data_source_string, limit, offset, log):
+def column_values_query(db, column_name, data_source_string, limit, offset, log, timer=None):
     """Generates json formatted frequency results based on query for specific column
 
     Args:
         db (Session): Database session object
         TODO
+        timer (PhaseTimer, optional): Records the time spent in each phase. Defaults to None.
 
     Returns:
         FrequencyResponseObj:
@@ -166,37 +504,53 @@ def column_values_query(db, column_name, data_source_string, limit, offset, log)
             'query_sql': 'SQL statement used to generate result'
         }
     """
+    if timer is None:
+        timer = PhaseTimer()
     log.info("Building column_values query")
-    try:
-        column_values_query = ColumnValuesQuery(db, DB_INFO, column_name, data_source_string, log)
-    except (SystemNotFound, RelationshipError, RelationshipNotFound, MappingError, TableNotFound, ColumnNotFound) as e:
-        log.warning('An error occured when building ColumnValuesQuery. Rebuilding DatabaseInfo')
-        Base = load_base()
-        DB_INFO.reset(Base)
-        log.info('DatabaseInfo has been rebuilt. Rebuilding ColumnValuesQuery')
-        column_values_query = ColumnValuesQuery(db, DB_INFO, column_name, data_source_string, log)
+    with timer.phase('build'):
+        try:
+            column_values_query = ColumnValuesQuery(db, DB_INFO, column_name, data_source_string, log)
+        except (SystemNotFound, RelationshipError, RelationshipNotFound, MappingError, TableNotFound, ColumnNotFound) as e:
+            log.warning('An error occured when building ColumnValuesQuery. Rebuilding DatabaseInfo')
+            Base = load_base()
+            DB_INFO.reset(Base)
+            log.info('DatabaseInfo has been rebuilt. Rebuilding ColumnValuesQuery')
+            column_values_query = ColumnValuesQuery(db, DB_INFO, column_name, data_source_string, log)
     
     
-    query = column_values_query.get_query()
-    total_count_query = column_values_query.get_total_count_query()
+        query = column_values_query.get_query()
+        total_count_query = column_values_query.get_total_count_query()
 
-    log.debug(f'Query:\n{"-"*60}\n{query_to_string(query)}\n{"-"*60}')
+    with timer.phase('compile'):
+        query_sql = query_to_string(query)
+    log.debug(f'Query:\n{"-"*60}\n{query_sql}\n{"-"*60}')
     log.debug(f'Total Count Query:\n{"-"*100}\n{query_to_string(total_count_query)}\n{"-"*100}')
 
     # Execute query
-    start_time = time.time()
-    result = query.offset(offset).limit(limit).all()
-    result = [row for (row,) in result]
+    if column_values_query.column_info.controlled_term:
+        # Ordered by name in the database so only the page is decoded
+        def format_rows(rows):
+            return decode_controlled_terms([row for (row,) in rows], DB_INFO.controlled_term_map, {column_values_query.column_info.name})
+    else:
+        def format_rows(rows):
+            return [row for (row,) in rows]
+
+    with timer.phase('execute'):
+        cursor_result = execute_server_side(db, query.offset(offset).limit(limit).statement)
+    result = []
+    for rows in fetch_formatted_batches(cursor_result, format_rows, timer):
+        result.extend(rows)
 
     # Execute total_count query
-    total_count = total_count_query.scalar()
+    with timer.phase('execute'):
+        total_count = total_count_query.scalar()
 
-    query_time = time.time() - start_time
-    log.info(f"Query execution time: {query_time}s")
+    log.info(f"Query execution time: {timer.get('execute') + timer.get('fetch')}s")
     log.info(f"Returning {len(result)} rows out of {total_count} results | limit={limit} & offset={offset}")
 
     # Return the results
-    ret = {"result": result, "query_sql": query_to_string(query), "total_row_count": total_count, "next_url": ""}
+    ret = {"result": result, "query_sql": query_sql, "total_row_count": total_count, "next_url": ""}
+    observe_result('column_values', column_values_query.column_info.selectable_table_info.name, ret)
     return ret
 
 
@@ -221,3 +575,55 @@ def release_metadata_query(db, log):
     log.info(f"Returning {len(result)} results")
 
     return {"result": result}
+
+
+def create_cohort_query(ids, log):
+    """Stores a list of IDs server-side so it can be referenced in filters with a cohort handle
+
+    Args:
+        ids (list): IDs making up the cohort
+
+    Returns:
+        CohortResponseObj:
+        {
+            'handle': 'cohort handle',
+            'filter_reference': '@cohort:<handle>',
+            'id_count': 'number of unique IDs in the cohort',
+            'expires_in': 'seconds until the cohort expires'
+        }
+    """
+    log.info("Building cohort")
+    unique_ids = list(dict.fromkeys(ids))
+    if len(unique_ids) < 1:
+        raise InvalidCohortError('Cohort must contain at least one ID')
+    if len(unique_ids) > COHORT_MAX_SIZE:
+        raise InvalidCohortError(f'Cohort contains {len(unique_ids)} unique IDs which is more than the maximum of {COHORT_MAX_SIZE}')
+    if len(set([type(id) for id in unique_ids])) > 1:
+        raise InvalidCohortError('Cohort IDs must either be all strings or all integers')
+
+    # Sorted tuples keep the stored cohort compact and give the database an ordered list to probe with
+    handle = uuid.uuid4().hex[:16]
+    COHORT_STORE.set(handle, tuple(sorted(unique_ids)))
+    log.info(f"Stored cohort {handle} with {len(unique_ids)} unique IDs")
+    return get_cohort_query(handle, log)
+
+
+def get_cohort_query(handle, log):
+    """Returns information about a stored cohort
+
+    Args:
+        handle (str): Cohort handle
+
+    Returns:
+        CohortResponseObj
+    """
+    ids = COHORT_STORE.get(handle)
+    if ids is None:
+        raise CohortNotFound(f'Cohort not found: "{handle}". Cohorts expire so it may need to be uploaded again')
+    expires_in = COHORT_STORE.expires_in(handle)
+    return {
+        "handle": handle,
+        "filter_reference": f"@cohort:{handle}",
+        "id_count": len(ids),
+        "expires_in": int(expires_in) if expires_in is not None else None
+    }
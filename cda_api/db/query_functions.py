@@ -1,7 +1,10 @@
 import itertools
+import math
+from os import getenv
 
 import sqlparse
-from sqlalchemy import CTE, Label, and_, distinct, func, or_, SelectLabelStyle, union_all, union, label
+from sqlalchemy import CTE, TypeDecorator, bindparam, Label, String, and_, distinct, func, or_, SelectLabelStyle, union_all, union, label, literal, type_coerce
+from sqlalchemy.dialects.postgresql import ARRAY, array
 from sqlalchemy.exc import CompileError
 
 
@@ -10,6 +13,38 @@ from cda_api import RelationshipNotFound, get_logger, TableNotFound
 
 log = get_logger("Setup: query_functions.py")
 
+# Bound arrays with more values than this are rendered as a placeholder in query_sql and the logs
+QUERY_SQL_MAX_ARRAY_VALUES = int(getenv("QUERY_SQL_MAX_ARRAY_VALUES", 100))
+
+
+class BoundArray(TypeDecorator):
+    """Array parameter type (ex. large "in" lists, cohorts and cached preselect IDs) that is still bound as one
+    parameter when executed but rendered as a placeholder by query_to_string() when it holds many values,
+    so the query_sql returned with every response doesn't grow with the number of values"""
+    impl = ARRAY
+    cache_ok = True
+
+    def __init__(self, item_type, placeholder=None):
+        super().__init__(item_type)
+        self.placeholder = placeholder
+
+    def literal_processor(self, dialect):
+        impl_processor = self.impl_instance.literal_processor(dialect)
+
+        def process(value):
+            if self.placeholder is not None:
+                return f"'{{...}}' /* {self.placeholder} */"
+            if len(value) > QUERY_SQL_MAX_ARRAY_VALUES:
+                return f"'{{...}}' /* {len(value)} values */"
+            return impl_processor(value)
+
+        return process
+
+
+# Returns a single array parameter holding the values. A placeholder replaces the values in query_sql regardless of their number
+def bind_array(values, item_type, placeholder=None):
+    return bindparam(None, list(values), type_=BoundArray(item_type, placeholder))
+
 
 # Generates compiled SQL string from query object
 def query_to_string(q, indented=False) -> str:
@@ -63,19 +98,38 @@ def apply_match_all_and_some_filters(query, match_all_db_filters, match_some_db_
     return query
 
 def get_selectable_db_column_and_possible_join(column_info, column_func = None, full_join = False, outer_join = True):
+    # controlled_term columns are selected as their id_alias and decoded after fetch (see decode_controlled_terms)
     join = None
     db_column = column_info.db_column
-    if column_info.controlled_term:
-        db_info = column_info.parent_table_info.database_info
-        aliased_controlled_term_db_table = db_info.get_table_info('controlled_term').db_table.alias(f'ct_{column_info.name}')
-        db_column = aliased_controlled_term_db_table.columns['name']
-        on_clause = column_info.db_column == aliased_controlled_term_db_table.columns['id_alias']
-        join = {'target': aliased_controlled_term_db_table, 'onclause': on_clause, 'full': full_join, 'isouter': outer_join}
     if column_func:
         db_column = column_func(db_column)
     db_column = db_column.label(column_info.name)
     return db_column, join
 
+# Replaces controlled_term id_alias values with their names for the controlled_term columns found in the results
+def decode_controlled_terms(result, controlled_term_map, controlled_term_column_names):
+    if isinstance(result, list):
+        return [decode_controlled_terms(item, controlled_term_map, controlled_term_column_names) for item in result]
+    if isinstance(result, dict):
+        decoded_result = {}
+        for key, value in result.items():
+            if key in controlled_term_column_names:
+                decoded_result[key] = decode_controlled_term_value(value, controlled_term_map)
+            else:
+                decoded_result[key] = decode_controlled_terms(value, controlled_term_map, controlled_term_column_names)
+        return decoded_result
+    return result
+
+
+def decode_controlled_term_value(value, controlled_term_map):
+    if isinstance(value, list):
+        # Arrays were aggregated on id_alias so need to be re-sorted by name
+        return sorted([controlled_term_map.get(item, item) for item in value], key=lambda name: (name is None, str(name)))
+    if isinstance(value, int) and not isinstance(value, bool):
+        return controlled_term_map.get(value, value)
+    return value
+
+
 def build_virtual_foreign_arrays(db,foreign_table_info, virtual_table_info, virtual_column_infos, filtered_preselect, log):
     virtual_table_relationship = foreign_table_info.get_table_relationship(virtual_table_info)
     if virtual_table_relationship.requires_mapping_table:
@@ -275,59 +329,78 @@ def foreign_table_distinct_count(db, endpoint_preselect, endpoint_table_info, fo
     return entity_count_select
 
 
-# Gets statistics of a row for numeric columns
-def numeric_summary(db, column):
-    column_subquery = db.query(
-        func.min(column).label("min"),
-        func.max(column).label("max"),
-        func.round(func.avg(column)).label("mean"),
-        func.percentile_disc(0.5).within_group(column).label("median"),
-        func.percentile_disc(0.25).within_group(column).label("lower_quartile"),
-        func.percentile_disc(0.75).within_group(column).label("upper_quartile"),
-    ).subquery("subquery")
-    # Get the row_to_json of the subquery
-    column_json = db.query(func.row_to_json(column_subquery.table_valued())
-                           .label(f"{column.name}_stats")).cte(f"json_{column.name}")
-    # Apply an array aggregation
-    numeric_array_agg = db.query(func.array_agg(get_cte_column(column_json, f"{column.name}_stats"))).scalar_subquery()
-    return numeric_array_agg
-
-
-# Gets the categorical(grouped) json counts of a row
-def basic_categorical_summary(db, column):
-    column_preselect = db.query(column, func.count().label("count_result")).group_by(column).subquery("subquery")
-    # Get the row_to_json of the subquery
-    column_json = db.query(func.row_to_json(column_preselect.table_valued())
-                           .label(f"{column.name}_categories")).cte(f"json_{column.name}")
-    # Apply an array aggregation
-    categorical_array_agg = db.query(func.array_agg(get_cte_column(column_json, f"{column.name}_categories"))).scalar_subquery()
-    return categorical_array_agg
-
+# Fractions of the median, lower_quartile and upper_quartile (in that order) computed by one percentile_disc() call
+NUMERIC_SUMMARY_FRACTIONS = [0.5, 0.25, 0.75]
+
+# Gets statistics of every numeric column of a table preselect in a single aggregate pass
+# Returns a map of column name to a subquery of the column's json array: [{min, max, mean, median, lower_quartile, upper_quartile}]
+def numeric_summaries(db, columns, cte_name):
+    aggregate_columns = []
+    for column in columns:
+        aggregate_columns.extend([
+            func.min(column).label(f"{column.name}_min"),
+            func.max(column).label(f"{column.name}_max"),
+            func.round(func.avg(column)).label(f"{column.name}_mean"),
+            func.percentile_disc(array(NUMERIC_SUMMARY_FRACTIONS)).within_group(column).label(f"{column.name}_percentiles"),
+        ])
+    statistics_cte = db.query(*aggregate_columns).cte(cte_name)
+
+    column_summaries = {}
+    for column in columns:
+        percentiles = type_coerce(get_cte_column(statistics_cte, f"{column.name}_percentiles"), ARRAY(column.type))
+        column_json = func.json_build_object(
+            literal("min"), get_cte_column(statistics_cte, f"{column.name}_min"),
+            literal("max"), get_cte_column(statistics_cte, f"{column.name}_max"),
+            literal("mean"), get_cte_column(statistics_cte, f"{column.name}_mean"),
+            literal("median"), percentiles[1],
+            literal("lower_quartile"), percentiles[2],
+            literal("upper_quartile"), percentiles[3],
+        )
+        column_summaries[column.name] = db.query(func.json_build_array(column_json)).scalar_subquery()
+    return column_summaries
+
+
+# Gets the categorical(grouped) json counts of every column of a table preselect in a single GROUPING SETS pass
+# Returns a map of column name to a subquery of the column's json array: [{column: value, count_result: count}]
+def basic_categorical_summaries(db, columns, cte_name):
+    # grouping() tells the rows of a column's own grouping set apart from its null values in the other sets
+    grouping_columns = [func.grouping(column).label(f"{column.name}_grouping") for column in columns]
+    counts_cte = db.query(*columns, *grouping_columns, func.count().label("count_result")) \
+                   .group_by(func.grouping_sets(*columns)) \
+                   .cte(cte_name)
+    count_result = get_cte_column(counts_cte, "count_result")
+
+    column_summaries = {}
+    for column in columns:
+        column_json = func.json_build_object(literal(column.name, String), get_cte_column(counts_cte, column.name), literal("count_result"), count_result)
+        column_summaries[column.name] = db.query(func.array_agg(column_json)) \
+                                          .filter(get_cte_column(counts_cte, f"{column.name}_grouping") == 0) \
+                                          .scalar_subquery()
+    return column_summaries
+
+# Gets the categorical json counts of a foreign table column where entities with no value are counted under null
+# Each value counts the distinct entities having it and the nulls are a single count, so the union only combines the
+# already aggregated rows instead of every (entity, value) pair
 def null_aware_categorical_summary(db, db_column, connecting_column, summarizable_column_info, filter_table_cte_column):
-    non_null_cte = db.query(db_column, connecting_column) \
-                    .filter(db_column.is_not(None)) \
-                    .group_by(connecting_column, db_column) \
-                    .cte(f'{db_column.name}_non_nulls')
-    
+    non_null_counts = db.query(db_column, func.count(distinct(connecting_column)).label('count_result')) \
+                        .filter(db_column.is_not(None)) \
+                        .group_by(db_column)
+
     null_column_info = summarizable_column_info.null_column_info
     if null_column_info is not None:
-        null_connecting_column = null_column_info.parent_table_info.primary_key_column_info.db_column.label(connecting_column.name)
-        null_cte = db.query(label(db_column.name, None), null_connecting_column) \
-                     .filter(null_connecting_column.in_(filter_table_cte_column)) \
-                     .filter(null_column_info.labeled_db_column == True)
-        
+        null_connecting_column = null_column_info.parent_table_info.primary_key_column_info.db_column
+        null_count = db.query(label(db_column.name, None), func.count().label('count_result')) \
+                       .filter(null_connecting_column.in_(filter_table_cte_column)) \
+                       .filter(null_column_info.labeled_db_column == True)
+
     else: # virtual table column nulls ie: file_anatomic_site and 
-        null_connecting_column = summarizable_column_info.parent_table_info.null_table_info.primary_key_column_info.db_column.label(connecting_column.name)
-        null_cte = db.query(label(db_column.name, None), null_connecting_column) \
-                     .filter(null_connecting_column.in_(filter_table_cte_column))
-        
-    null_cte = null_cte.cte(f'{db_column.name}_nulls')
-    
-    union_subquery = union_all(db.query(non_null_cte.c), db.query(null_cte.c)).set_label_style(SelectLabelStyle.LABEL_STYLE_NONE).subquery(f'{db_column.name}_union')
-    union_column = get_cte_column(union_subquery, db_column.name)
-    count_subquery = db.query(union_column,func.count().label('count_result')) \
-                        .group_by(union_column) \
-                        .subquery(f'{db_column.name}_count_subquery') 
+        null_connecting_column = summarizable_column_info.parent_table_info.null_table_info.primary_key_column_info.db_column
+        null_count = db.query(label(db_column.name, None), func.count().label('count_result')) \
+                       .filter(null_connecting_column.in_(filter_table_cte_column))
+    # Only include null when there are entities without a value
+    null_count = null_count.having(func.count() > 0)
+
+    count_subquery = union_all(non_null_counts, null_count).set_label_style(SelectLabelStyle.LABEL_STYLE_NONE).subquery(f'{db_column.name}_count_subquery')
 
     categorical_array_agg = db.query(
                         func.array_agg(
@@ -372,4 +445,54 @@ def data_source_counts(db, data_source_columns):
     data_source_preselect = db.query(*data_source_counts).subquery("subquery")
     # Get the row_to_json of the subquery
     data_source_json = db.query(func.row_to_json(data_source_preselect.table_valued()))
-    return data_source_json
\ No newline at end of file
+    return data_source_json
+
+
+# z value of a two sided 95% confidence interval
+APPROXIMATE_Z_VALUE = 1.96
+
+# Estimate and 95% error bound of a count taken over a Bernoulli sample of the rows
+def scale_sampled_count(count, sample_rate):
+    # A count of zero in the sample still leaves room for rows that weren't sampled
+    error_bound = APPROXIMATE_Z_VALUE * math.sqrt(max(count, 1) * (1 - sample_rate)) / sample_rate
+    return round(count / sample_rate), math.ceil(error_bound)
+
+def scale_sampled_summary(summary, sample_rate, sampled_count_keys):
+    """Scales the counts of a summary computed over a sample of the filtered endpoint rows up to the full population
+
+    Args:
+        summary (dict): Summary row as returned by the summary query
+        sample_rate (float): Fraction of the endpoint rows that were summarized
+        sampled_count_keys (set[str]): Keys of the summary counting endpoint rows (total_count, the endpoint's
+                                       categorical summaries and data_source), the only counts that scale with the sample
+
+    Returns:
+        tuple[dict, dict]: Scaled summary and the error bound of each scaled count in the same shape.
+        Distinct counts of related entities (ex. subject_count of a file summary) don't grow linearly with the sample:
+        they are the entities found in the sample, returned as is without a bound. So are numeric summaries
+        (min, max, mean and quartiles), which are the sample's own statistics
+    """
+    scaled_summary = {}
+    error_bounds = {}
+    for key, value in summary.items():
+        if key not in sampled_count_keys:
+            scaled_summary[key] = value
+        elif isinstance(value, int):
+            scaled_summary[key], error_bounds[key] = scale_sampled_count(value, sample_rate)
+        elif isinstance(value, dict):
+            # data_source combination counts
+            scaled_summary[key] = {}
+            error_bounds[key] = {}
+            for name, count in value.items():
+                scaled_summary[key][name], error_bounds[key][name] = scale_sampled_count(count, sample_rate)
+        elif isinstance(value, list) and value and isinstance(value[0], dict) and ('count_result' in value[0].keys()):
+            # Categorical summaries
+            scaled_summary[key] = []
+            error_bounds[key] = []
+            for category in value:
+                count, error_bound = scale_sampled_count(category['count_result'], sample_rate)
+                scaled_summary[key].append(category | {'count_result': count})
+                error_bounds[key].append(category | {'count_result': error_bound})
+        else:
+            scaled_summary[key] = value
+    return scaled_summary, error_bounds
\ No newline at end of file
@@ -0,0 +1,178 @@
+import json
+from itertools import chain
+from os import getenv
+
+from sqlalchemy import ARRAY, Boolean, Integer, Numeric
+
+from cda_api import InvalidExportFormat
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Rows per Parquet row group. Fetched batches are buffered until a row group is full
+EXPORT_PARQUET_ROW_GROUP_SIZE = int(getenv("EXPORT_PARQUET_ROW_GROUP_SIZE", 100000))
+
+EXPORT_MEDIA_TYPES = {'arrow': 'application/vnd.apache.arrow.stream', 'parquet': 'application/vnd.apache.parquet'}
+
+
+def check_export_format(export_format):
+    if export_format not in EXPORT_MEDIA_TYPES.keys():
+        raise InvalidExportFormat(f"format must be one of: json, {', '.join(EXPORT_MEDIA_TYPES.keys())}")
+    if pyarrow is None:
+        raise InvalidExportFormat(f"format={export_format} requires pyarrow which is not installed on this server")
+
+
+class ChunkSink:
+    """Write-only file object for the Arrow writers that hands out what was written since the last take().
+    Reports the total number of bytes written as its position since Parquet records offsets in its footer"""
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def writable(self):
+        return True
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def get_arrow_type(column_info):
+    """Returns the Arrow type of a column's values as they appear in formatted rows.
+    controlled_term columns are decoded to their names and dates come out of row_to_json() as strings
+
+    Args:
+        column_info (ColumnInfo): Selected column
+
+    Returns:
+        pyarrow.DataType: Type of the column's values
+    """
+    if column_info.controlled_term:
+        return pyarrow.string()
+    return _get_arrow_type(column_info.db_column.type)
+
+
+def _get_arrow_type(column_type):
+    if isinstance(column_type, ARRAY):
+        return pyarrow.list_(_get_arrow_type(column_type.item_type))
+    if isinstance(column_type, Boolean):
+        return pyarrow.bool_()
+    if isinstance(column_type, Integer):
+        return pyarrow.int64()
+    if isinstance(column_type, Numeric):
+        return pyarrow.float64()
+    return pyarrow.string()
+
+
+def get_arrow_schema(data_query):
+    """Builds the schema of an export from the types of the data query's columns before any row is fetched.
+    Array columns become list types and collated (json) columns lists of structs with a field per column
+
+    Args:
+        data_query (DataQuery): Data query being exported
+
+    Returns:
+        pyarrow.Schema: Schema of the export
+    """
+    fields = []
+    for select_column in data_query.select_columns:
+        construct_type, column_infos = data_query.select_column_info_map[select_column.name]
+        if construct_type is None:
+            arrow_type = get_arrow_type(column_infos[0])
+        elif construct_type == 'array':
+            arrow_type = pyarrow.list_(get_arrow_type(column_infos[0]))
+        else:
+            # Collated columns are named <table>_columns. Columns of the table's virtual tables are arrays inside each object
+            table_name = select_column.name.removesuffix('_columns')
+            arrow_type = pyarrow.list_(pyarrow.struct([
+                (column_info.name, get_arrow_type(column_info) if column_info.parent_table_info.name == table_name else pyarrow.list_(get_arrow_type(column_info)))
+                for column_info in column_infos
+            ]))
+        fields.append((select_column.name, arrow_type))
+    return pyarrow.schema(fields)
+
+
+# Converts values that don't fit the schema as they are (ex. a numeric string in an integer column).
+# Raises pyarrow.ArrowInvalid when a value can't be converted
+def _coerce_value(value, arrow_type):
+    if value is None:
+        return None
+    if pyarrow.types.is_string(arrow_type):
+        if isinstance(value, str):
+            return value
+        return json.dumps(value) if isinstance(value, (dict, list)) else str(value)
+    if pyarrow.types.is_list(arrow_type):
+        return [_coerce_value(item, arrow_type.value_type) for item in value]
+    if pyarrow.types.is_struct(arrow_type):
+        return {field.name: _coerce_value(value.get(field.name), field.type) for field in arrow_type}
+    return pyarrow.scalar(value).cast(arrow_type).as_py()
+
+
+def to_record_batch(rows, schema):
+    try:
+        return pyarrow.RecordBatch.from_pylist(rows, schema=schema)
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+        rows = [{field.name: _coerce_value(row.get(field.name), field.type) for field in schema} for row in rows]
+        return pyarrow.RecordBatch.from_pylist(rows, schema=schema)
+
+
+def export_rows(first_rows, batches, export_format, schema):
+    """Converts fetched batches of rows to an Arrow IPC stream or a Parquet file and yields its bytes as they are written
+
+    Args:
+        first_rows (list[dict]): First batch of formatted rows
+        batches (Iterator[list[dict]]): Remaining batches of formatted rows
+        export_format (str): "arrow" or "parquet"
+        schema (pyarrow.Schema): Schema of the export (see get_arrow_schema())
+
+    Yields:
+        bytes: Next part of the file
+    """
+    sink = ChunkSink()
+    if export_format == 'arrow':
+        writer = pyarrow.ipc.new_stream(sink, schema)
+        for rows in chain([first_rows], batches):
+            if rows:
+                writer.write_batch(to_record_batch(rows, schema))
+                yield sink.take()
+        writer.close()
+        yield sink.take()
+        return
+
+    writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    pending_batches = []
+    pending_row_count = 0
+    for rows in chain([first_rows], batches):
+        if rows:
+            pending_batches.append(to_record_batch(rows, schema))
+            pending_row_count += len(rows)
+        if pending_row_count >= EXPORT_PARQUET_ROW_GROUP_SIZE:
+            writer.write_table(pyarrow.Table.from_batches(pending_batches, schema), row_group_size=EXPORT_PARQUET_ROW_GROUP_SIZE)
+            pending_batches = []
+            pending_row_count = 0
+            yield sink.take()
+    if pending_batches:
+        writer.write_table(pyarrow.Table.from_batches(pending_batches, schema), row_group_size=EXPORT_PARQUET_ROW_GROUP_SIZE)
+    writer.close()
+    yield sink.take()
@@ -1,13 +1,33 @@
+from contextlib import asynccontextmanager
+
 import uvicorn
 from fastapi import FastAPI, status, Request
 from fastapi.responses import JSONResponse
 
 from cda_api import get_logger, CDABaseException
-from cda_api.routers import column_values, columns, data, release_metadata, summary
+from cda_api.classes.PhaseTimer import PhaseTimer
+from cda_api.compression import CompressionMiddleware, RESPONSE_COMPRESSION_ENABLED
+from cda_api.metrics import observe_request, observe_error
+from cda_api.routers import batch, cohort, column_values, columns, data, data_summary, metrics, release_metadata, summary
 from cda_api.classes.models import ClientError, InternalError
+from cda_api.db import DB_INFO
+from cda_api.db.query_builders import warm_precomputed_summaries
+from cda_api.classes.BitmapIndex import BITMAP_INDEX_LOADER
+from cda_api.classes.ColumnValueIndex import COLUMN_VALUE_INDEXES
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Landing page summaries are computed in the background so the first requests don't have to wait on them
+    warm_precomputed_summaries()
+    # So are the value lists used to expand wildcard filters and the bitmap index
+    COLUMN_VALUE_INDEXES.start_building(DB_INFO)
+    BITMAP_INDEX_LOADER.start_loading(DB_INFO)
+    yield
+
 
 # Establish FastAPI "app" used for decorators on api endpoint functions
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 
 # Set up logger
@@ -60,10 +80,60 @@ app.include_router(router=columns.router,
                             "model": InternalError
                         }
                 })
+app.include_router(router=data_summary.router,
+                   responses={
+                        400: {
+                            "model": ClientError
+                        },
+                        500: {
+                            "model": InternalError
+                        }
+                })
+app.include_router(router=batch.router,
+                   responses={
+                        400: {
+                            "model": ClientError
+                        },
+                        500: {
+                            "model": InternalError
+                        }
+                })
+app.include_router(router=metrics.router)
+app.include_router(router=cohort.router,
+                   responses={
+                        400: {
+                            "model": ClientError
+                        },
+                        500: {
+                            "model": InternalError
+                        }
+                })
+
+@app.middleware("http")
+async def phase_timing_middleware(request: Request, call_next):
+    """Reports the time spent in each phase of the request in the Server-Timing header and request metrics.
+    Time not recorded by the query builders (response validation and JSON encoding) is reported as serialize"""
+    phase_timer = PhaseTimer()
+    request.state.phase_timer = phase_timer
+    response = await call_next(request)
+    phase_timer.record('serialize', max(phase_timer.get_elapsed() - phase_timer.get_recorded(), 0))
+    phase_timer.record('total', phase_timer.get_elapsed())
+    response.headers['Server-Timing'] = phase_timer.get_server_timing_header()
+    route = request.scope.get('route')
+    if route is not None:
+        observe_request(route, response.status_code, phase_timer)
+    return response
+
+
+# Added after the timing middleware so it wraps it and compresses the response with its Server-Timing header set
+if RESPONSE_COMPRESSION_ENABLED:
+    app.add_middleware(CompressionMiddleware)
+
 
 @app.exception_handler(CDABaseException)
 def cda_exception_handler(request: Request, exc: CDABaseException):
     """Custom handler"""
+    observe_error(exc.name)
     return JSONResponse(
         status_code=exc.status_code,
         content= {'error_type':exc.name, 'message':exc.message}
@@ -0,0 +1,148 @@
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, REGISTRY
+
+from cda_api.classes.TTLCache import TTLCache
+from cda_api.db.connection import engine
+
+# Buckets (seconds) covering sub-millisecond phases up to multi-minute summaries
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000, 10000000)
+
+REQUEST_COUNT = Counter(
+    'cda_api_requests',
+    'Requests handled by router, endpoint table and status code',
+    ['router', 'endpoint_table', 'status'],
+)
+REQUEST_DURATION = Histogram(
+    'cda_api_request_duration_seconds',
+    'Request latency by router and endpoint table',
+    ['router', 'endpoint_table'],
+    buckets=DURATION_BUCKETS,
+)
+PHASE_DURATION = Histogram(
+    'cda_api_phase_duration_seconds',
+    'Time spent in each phase of a request (build, compile, execute, fetch, format, serialize)',
+    ['endpoint', 'phase'],
+    buckets=DURATION_BUCKETS,
+)
+ROWS_RETURNED = Histogram(
+    'cda_api_rows_returned',
+    'Rows returned in a response',
+    ['router', 'endpoint_table'],
+    buckets=ROW_BUCKETS,
+)
+TOTAL_ROW_COUNT = Histogram(
+    'cda_api_total_row_count',
+    'total_row_count of a response (rows matching the query before paging)',
+    ['router', 'endpoint_table'],
+    buckets=ROW_BUCKETS,
+)
+ERROR_COUNT = Counter(
+    'cda_api_errors',
+    'Errors returned by CDABaseException subclass',
+    ['error_type'],
+)
+ADMISSION_DECISIONS = Counter(
+    'cda_api_admission_decisions',
+    'Pre-flight EXPLAIN decisions by query type (admit or the over budget action)',
+    ['query_type', 'decision'],
+)
+LANE_WAIT = Histogram(
+    'cda_api_lane_wait_seconds',
+    'Time requests spent queued for a scheduler lane',
+    ['lane'],
+    buckets=DURATION_BUCKETS,
+)
+LANE_REJECTED = Counter(
+    'cda_api_lane_rejected',
+    'Requests rejected because the scheduler lane queue was full',
+    ['lane'],
+)
+# Read from the scheduler lanes when scraped
+LANE_QUEUE_DEPTH = Gauge('cda_api_lane_queue_depth', 'Requests waiting for a scheduler lane', ['lane'])
+LANE_ACTIVE = Gauge('cda_api_lane_active', 'Requests running in a scheduler lane', ['lane'])
+COALESCED_REQUESTS = Counter(
+    'cda_api_coalesced_requests',
+    'Requests answered by an identical request already in flight',
+    ['endpoint'],
+)
+PRECOMPUTED_SUMMARY_HITS = Counter(
+    'cda_api_precomputed_summary_hits',
+    'Summary requests served from the summaries precomputed for the release',
+    ['endpoint_table'],
+)
+SUMMARY_SNAPSHOT_HITS = Counter(
+    'cda_api_summary_snapshot_hits',
+    'Summary requests computed from the in-memory summary snapshot (SUMMARY_ENGINE=numpy) instead of the database',
+    ['endpoint_table'],
+)
+PRESELECT_REFINEMENTS = Counter(
+    'cda_api_preselect_refinements',
+    'Filtered preselects built by applying only the added MATCH_ALL filters to a cached preselect',
+)
+DATABASE_INFO_REBUILDS = Counter(
+    'cda_api_database_info_rebuilds',
+    'Times DatabaseInfo was rebuilt after a query failed to build',
+)
+
+# Read from the connection pool when scraped
+POOL_SIZE = Gauge('cda_api_db_pool_size', 'Configured size of the database connection pool')
+POOL_SIZE.set_function(lambda: engine.pool.size())
+POOL_CHECKED_OUT = Gauge('cda_api_db_pool_checked_out', 'Database connections currently in use')
+POOL_CHECKED_OUT.set_function(lambda: engine.pool.checkedout())
+POOL_CHECKED_IN = Gauge('cda_api_db_pool_checked_in', 'Idle database connections in the pool')
+POOL_CHECKED_IN.set_function(lambda: engine.pool.checkedin())
+POOL_OVERFLOW = Gauge('cda_api_db_pool_overflow', 'Database connections open beyond the pool size')
+POOL_OVERFLOW.set_function(lambda: engine.pool.overflow())
+
+
+class CacheCollector:
+    """Reports the hits, misses and size of every TTLCache when scraped"""
+    def collect(self):
+        hits = CounterMetricFamily('cda_api_cache_hits', 'Cache lookups that found an entry', labels=['cache'])
+        misses = CounterMetricFamily('cda_api_cache_misses', 'Cache lookups that did not find an entry', labels=['cache'])
+        entries = GaugeMetricFamily('cda_api_cache_entries', 'Entries currently held in the cache', labels=['cache'])
+        for name, cache in TTLCache.instances.items():
+            hits.add_metric([name], cache.hits)
+            misses.add_metric([name], cache.misses)
+            entries.add_metric([name], len(cache))
+        yield hits
+        yield misses
+        yield entries
+
+
+REGISTRY.register(CacheCollector())
+
+
+# Returns the router and endpoint table labels for a route (ex. '/data/file' -> ('data', 'file'))
+def get_route_labels(route):
+    path_components = [component for component in route.path.split('/') if component]
+    if not path_components:
+        return '', ''
+    router = path_components[0]
+    endpoint_table = ''
+    if (len(path_components) > 1) and (not path_components[-1].startswith('{')):
+        endpoint_table = path_components[-1]
+    return router, endpoint_table
+
+
+def observe_request(route, status_code, phase_timer):
+    router, endpoint_table = get_route_labels(route)
+    REQUEST_COUNT.labels(router, endpoint_table, str(status_code)).inc()
+    REQUEST_DURATION.labels(router, endpoint_table).observe(phase_timer.get('total'))
+    for phase, seconds in phase_timer.phases.items():
+        PHASE_DURATION.labels(route.path, phase).observe(seconds)
+
+
+def observe_result(router, endpoint_table, result):
+    observe_row_counts(router, endpoint_table, len(result['result']), result.get('total_row_count'))
+
+
+def observe_row_counts(router, endpoint_table, rows_returned, total_row_count=None):
+    ROWS_RETURNED.labels(router, endpoint_table).observe(rows_returned)
+    if total_row_count is not None:
+        TOTAL_ROW_COUNT.labels(router, endpoint_table).observe(total_row_count)
+
+
+def observe_error(error_type):
+    ERROR_COUNT.labels(error_type).inc()
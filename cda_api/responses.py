@@ -0,0 +1,58 @@
+import json
+from os import getenv
+
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from cda_api import get_logger
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+log = get_logger('responses.py')
+
+# Return /data, /summary, /data_summary and /column_values results without validating them against their response
+# models and encode them with orjson (off by default, falls back to the standard library json without orjson)
+FAST_JSON_RESPONSES = getenv("FAST_JSON_RESPONSES", "false").lower() == "true"
+
+if FAST_JSON_RESPONSES and (orjson is None):
+    log.warning('FAST_JSON_RESPONSES is set but orjson is not installed. Encoding responses with json instead')
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse encoded with orjson when it is installed.
+    Content has to be made of JSON types already (which row_to_json()/json_build_object() results are)"""
+    def render(self, content):
+        if orjson is not None:
+            return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def build_response(result, response_model):
+    """Returns the result of a query builder as the endpoint's response.
+    With FAST_JSON_RESPONSES the result is encoded directly instead of being validated against the response model
+    (and copied) first. Only the top level is shaped like the model: missing fields are set to their default and
+    fields the model doesn't have are dropped
+
+    Args:
+        result (dict): Result of the query builder
+        response_model (type[BaseModel]): Response model of the endpoint
+
+    Returns:
+        dict | FastJSONResponse: The result itself or its encoded response
+    """
+    if not FAST_JSON_RESPONSES:
+        return result
+    content = {name: result.get(name, field.default) for name, field in response_model.model_fields.items()}
+    return FastJSONResponse(content=content)
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """StreamingResponse over a LaneStream that closes it (ending its query and freeing its lane slot) once the response
+    is sent, fails or is cancelled. Starlette doesn't close the body iterator itself when the client disconnects"""
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.body_iterator.aclose()
@@ -0,0 +1,46 @@
+from fastapi import APIRouter, Depends, Request
+from sqlalchemy.orm import Session
+
+from cda_api import get_logger, get_query_id
+from cda_api.application_functions import handle_router_errors
+from cda_api.db import get_db
+from cda_api.db.batch import batch_query
+from cda_api.classes.models import BatchRequestBody, BatchResponseObj
+
+router = APIRouter(prefix="/batch", tags=["batch"])
+
+
+@router.post("/")
+async def batch_endpoint(request: Request, request_body: BatchRequestBody, db: Session = Depends(get_db)) -> BatchResponseObj:
+    """Runs several /data, /summary and /column_values requests against the same snapshot of the database in one round trip
+
+    Args:
+        request (Request): HTTP request object
+        request_body (BatchRequestBody): List of sub-requests
+        db (Session, optional): Database session object. Defaults to Depends(get_db).
+
+    Returns:
+        BatchResponseObj:
+        {
+            'results': [
+                {
+                    'endpoint': 'endpoint of the sub-request',
+                    'status_code': 'status code the sub-request would have returned on its own',
+                    'result': 'response of the sub-request',
+                    'error_type': 'error type if the sub-request failed',
+                    'message': 'error message if the sub-request failed'
+                }
+            ]
+        }
+    """
+    qid = get_query_id()
+    log = get_logger(qid, logger_type='query')
+    log.info(f"batch endpoint hit: {request.client}")
+    log.info(f"{request.url}")
+
+    try:
+        result = await batch_query(db, request_body.REQUESTS, log)
+        log.info("Success")
+    except Exception as e:
+        handle_router_errors(e, log)
+    return result
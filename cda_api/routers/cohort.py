@@ -0,0 +1,97 @@
+from fastapi import APIRouter, Request, UploadFile
+
+from cda_api import InvalidCohortError, get_logger, get_query_id
+from cda_api.application_functions import handle_router_errors
+from cda_api.db.query_builders import create_cohort_query, get_cohort_query
+from cda_api.classes.models import CohortRequestBody, CohortResponseObj
+
+router = APIRouter(prefix="/cohort", tags=["cohort"])
+
+
+@router.post("/")
+def create_cohort_endpoint(request: Request, request_body: CohortRequestBody) -> CohortResponseObj:
+    """Stores a list of IDs server-side and returns a handle which can be used in place of the list in filters
+
+    Args:
+        request (Request): HTTP request object
+        request_body (CohortRequestBody): JSON list of IDs
+
+    Returns:
+        CohortResponseObj:
+        {
+            'handle': 'cohort handle',
+            'filter_reference': '@cohort:<handle> (ex. "subject_id in @cohort:<handle>")',
+            'id_count': 'number of unique IDs in the cohort',
+            'expires_in': 'seconds until the cohort expires'
+        }
+    """
+    qid = get_query_id()
+    log = get_logger(qid, logger_type='query')
+    log.info(f"cohort endpoint hit: {request.client}")
+    log.info(f"{request.url}")
+
+    try:
+        result = create_cohort_query(request_body.IDS, log)
+        log.info("Success")
+    except Exception as e:
+        handle_router_errors(e, log)
+    return result
+
+
+@router.post("/file")
+def create_cohort_from_file_endpoint(request: Request, file: UploadFile) -> CohortResponseObj:
+    """Stores a newline delimited file of IDs server-side and returns a handle which can be used in place of the list in filters
+
+    Args:
+        request (Request): HTTP request object
+        file (UploadFile): Newline delimited file of IDs
+
+    Returns:
+        CohortResponseObj:
+        {
+            'handle': 'cohort handle',
+            'filter_reference': '@cohort:<handle> (ex. "subject_id in @cohort:<handle>")',
+            'id_count': 'number of unique IDs in the cohort',
+            'expires_in': 'seconds until the cohort expires'
+        }
+    """
+    qid = get_query_id()
+    log = get_logger(qid, logger_type='query')
+    log.info(f"cohort/file endpoint hit: {request.client}")
+    log.info(f"{request.url}")
+
+    try:
+        try:
+            ids = [line.strip() for line in file.file.read().decode('utf-8').splitlines() if line.strip()]
+        except UnicodeDecodeError:
+            raise InvalidCohortError('Cohort file must be a utf-8 encoded, newline delimited list of IDs')
+        # Files of alias IDs should filter integer columns
+        if ids and all(id.isdigit() for id in ids):
+            ids = [int(id) for id in ids]
+        result = create_cohort_query(ids, log)
+        log.info("Success")
+    except Exception as e:
+        handle_router_errors(e, log)
+    return result
+
+
+@router.get("/{handle}")
+def get_cohort_endpoint(request: Request, handle: str) -> CohortResponseObj:
+    """Returns information about a stored cohort
+
+    Args:
+        request (Request): HTTP request object
+        handle (str): Cohort handle
+
+    Returns:
+        CohortResponseObj
+    """
+    qid = get_query_id()
+    log = get_logger(qid, logger_type='query')
+    log.info(f"cohort/{handle} endpoint hit: {request.client}")
+
+    try:
+        result = get_cohort_query(handle, log)
+    except Exception as e:
+        handle_router_errors(e, log)
+    return result
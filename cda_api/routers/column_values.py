@@ -1,3 +1,5 @@
+from functools import partial
+
 from fastapi import APIRouter, Depends, Request
 from sqlalchemy.orm import Session
 
@@ -5,13 +7,15 @@ from cda_api import get_logger, get_query_id
 from cda_api.application_functions import handle_router_errors
 from cda_api.db import get_db
 from cda_api.db.query_builders import column_values_query
+from cda_api.responses import build_response
+from cda_api.scheduler import run_in_lane
 from cda_api.classes.models import ColumnValuesResponseObj
 
 router = APIRouter(prefix="/column_values", tags=["column_values"])
 
 
 @router.post("/{column}")
-def column_values_endpoint(
+async def column_values_endpoint(
     request: Request,
     column: str,
     data_source: str = "",
@@ -37,14 +41,16 @@ def column_values_endpoint(
 
     try:
         # Get paged query result
-        result = column_values_query(
+        result = await run_in_lane('column_values', partial(
+            column_values_query,
             db,
             column_name=column,
             data_source_string=data_source,
             limit=limit,
             offset=offset,
             log=log,
-        )
+            timer=request.state.phase_timer,
+        ), request.state.phase_timer)
         if limit != None:
             if offset == None:
                 offset = 0
@@ -60,4 +66,4 @@ def column_values_endpoint(
 
     except Exception as e:
         handle_router_errors(e, log)
-    return result
+    return build_response(result, ColumnValuesResponseObj)
@@ -1,3 +1,5 @@
+from functools import partial
+
 from fastapi import APIRouter, Depends, Request
 from sqlalchemy.orm import Session
 
@@ -5,13 +7,14 @@ from cda_api import get_logger, get_query_id
 from cda_api.application_functions import handle_router_errors
 from cda_api.db import get_db
 from cda_api.db.query_builders import columns_query
+from cda_api.scheduler import run_in_lane
 from cda_api.classes.models import ColumnResponseObj
 
 router = APIRouter(prefix="/columns", tags=["columns"])
 
 
 @router.get("/")
-def columns_endpoint(request: Request, db: Session = Depends(get_db)) -> ColumnResponseObj:
+async def columns_endpoint(request: Request, db: Session = Depends(get_db)) -> ColumnResponseObj:
     """_summary_
 
     Args:
@@ -24,7 +27,7 @@ def columns_endpoint(request: Request, db: Session = Depends(get_db)) -> ColumnR
     qid = get_query_id()
     log = get_logger(qid)
     try:
-        result = columns_query(db, log)
+        result = await run_in_lane('metadata', partial(columns_query, db, log), request.state.phase_timer)
     except Exception as e:
         handle_router_errors(e, log)
     return result
@@ -1,19 +1,80 @@
+from functools import partial
+from os import getenv
+
 from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
 
 from cda_api import EmptyQueryError, get_logger, get_query_id
 from cda_api.application_functions import handle_router_errors
 from cda_api.db import get_db
-from cda_api.db.query_builders import data_query
+from cda_api.db.query_builders import data_query, export_data_query, stream_data_query
+from cda_api.coalescing import run_coalesced
+from cda_api.exports import EXPORT_MEDIA_TYPES
+from cda_api.responses import ClosingStreamingResponse, build_response
+from cda_api.scheduler import run_in_lane, run_stream_in_lane
 from cda_api.classes.models import PagedResponseObj, DataRequestBody
 
 # API router object. Defines /data endpoint options
 router = APIRouter(prefix="/data", tags=["data"])
 
+# Pages of at least this many rows are streamed unless the request sets stream=false.
+# 0 (default) only streams requests with stream=true, since streamed pages report errors after the first batch in the body
+DATA_STREAM_MIN_LIMIT = int(getenv("DATA_STREAM_MIN_LIMIT", 0))
+
+
+def should_stream(stream, limit):
+    if stream is not None:
+        return stream
+    return (DATA_STREAM_MIN_LIMIT > 0) and (limit is not None) and (limit >= DATA_STREAM_MIN_LIMIT)
+
+
+def get_next_url(request, total_row_count, limit, offset):
+    if (offset != None) and (limit != None):
+        if total_row_count > offset + limit:
+            return request.url.components.geturl().replace(f"offset={offset}", f"offset={offset+limit}")
+        return ""
+    return None
+
+
+async def stream_rows(request, endpoint_table_name, request_body, limit, offset, db, log):
+    # Streamed responses are written as the rows are fetched so they aren't coalesced with identical requests
+    query = partial(
+        stream_data_query, db, endpoint_table_name=endpoint_table_name, request_body=request_body, limit=limit, offset=offset, log=log,
+        get_next_url=partial(get_next_url, request, limit=limit, offset=offset), timer=request.state.phase_timer
+    )
+    # The lane slot is kept until the last batch is fetched
+    chunks = await run_stream_in_lane('data', query, request.state.phase_timer)
+    return ClosingStreamingResponse(chunks, media_type="application/json")
+
+
+async def export_rows(request, endpoint_table_name, request_body, limit, offset, export_format, db, log):
+    # Columnar files have no room for the response fields so the total row count and next page go in the headers
+    query = partial(
+        export_data_query, db, endpoint_table_name=endpoint_table_name, request_body=request_body, limit=limit, offset=offset, log=log,
+        export_format=export_format, timer=request.state.phase_timer
+    )
+    total_row_count = 0
+
+    def start_export():
+        nonlocal total_row_count
+        total_row_count, chunks = query()
+        return chunks
+
+    # The lane slot is kept until the last batch is fetched
+    chunks = await run_stream_in_lane('data', start_export, request.state.phase_timer)
+    headers = {
+        'Content-Disposition': f'attachment; filename="{endpoint_table_name}.{export_format}"',
+        'X-Total-Row-Count': str(total_row_count),
+    }
+    next_url = get_next_url(request, total_row_count, limit, offset)
+    if next_url:
+        headers['Link'] = f'<{next_url}>; rel="next"'
+    return ClosingStreamingResponse(chunks, media_type=EXPORT_MEDIA_TYPES[export_format], headers=headers)
+
 
 @router.post("/file")
-def file_fetch_rows_endpoint(
-    request: Request, request_body: DataRequestBody, limit: int = 100, offset: int = 0, db: Session = Depends(get_db)
+async def file_fetch_rows_endpoint(
+    request: Request, request_body: DataRequestBody, limit: int = 100, offset: int = 0, stream: bool | None = None, format: str = "json", db: Session = Depends(get_db)
 ) -> PagedResponseObj:
     """File data endpoint that returns json formatted row data based on input query
 
@@ -22,6 +83,8 @@ def file_fetch_rows_endpoint(
         request_body (DataRequestBody): JSON input query
         limit (int, optional): Limit for paged results. Defaults to 100.
         offset (int, optional): Offset for paged results. Defaults to 0.
+        stream (bool, optional): Write the rows to the response as they are fetched instead of all at once. Defaults to False (or to streaming pages of DATA_STREAM_MIN_LIMIT rows or more when it is set).
+        format (str, optional): json, or parquet/arrow to download the rows as a Parquet file or Arrow IPC stream. Defaults to "json".
         db (Session, optional): Database session object. Defaults to Depends(get_db).
 
     Returns:
@@ -41,8 +104,15 @@ def file_fetch_rows_endpoint(
     log.info(f"{request.url}")
 
     try:
+        if format != "json":
+            log.info(f"Exporting the result as {format}")
+            return await export_rows(request, "file", request_body, limit, offset, format, db, log)
+        if should_stream(stream, limit):
+            log.info("Streaming the result")
+            return await stream_rows(request, "file", request_body, limit, offset, db, log)
         # Get paged query result
-        result = data_query(db, endpoint_table_name="file", request_body=request_body, limit=limit, offset=offset, log=log)
+        query = partial(data_query, db, endpoint_table_name="file", request_body=request_body, limit=limit, offset=offset, log=log, timer=request.state.phase_timer)
+        result = await run_coalesced('/data/file', request_body, partial(run_in_lane, 'data', query, request.state.phase_timer), request.state.phase_timer, limit=limit, offset=offset)
         if (offset != None) and (limit != None):
             if result["total_row_count"] > offset + limit:
                 next_url = request.url.components.geturl().replace(f"offset={offset}", f"offset={offset+limit}")
@@ -53,12 +123,12 @@ def file_fetch_rows_endpoint(
     except Exception as e:
         handle_router_errors(e, log)
 
-    return result
+    return build_response(result, PagedResponseObj)
 
 
 @router.post("/subject")
-def subject_fetch_rows_endpoint(
-    request: Request, request_body: DataRequestBody, limit: int = 100, offset: int = 0, db: Session = Depends(get_db)
+async def subject_fetch_rows_endpoint(
+    request: Request, request_body: DataRequestBody, limit: int = 100, offset: int = 0, stream: bool | None = None, format: str = "json", db: Session = Depends(get_db)
 ) -> PagedResponseObj:
     """Subject data endpoint that returns json formatted row data based on input query
 
@@ -67,6 +137,8 @@ def subject_fetch_rows_endpoint(
         request_body (DataRequestBody): JSON input query
         limit (int, optional): Limit for paged results. Defaults to 100.
         offset (int, optional): Offset for paged results. Defaults to 0.
+        stream (bool, optional): Write the rows to the response as they are fetched instead of all at once. Defaults to False (or to streaming pages of DATA_STREAM_MIN_LIMIT rows or more when it is set).
+        format (str, optional): json, or parquet/arrow to download the rows as a Parquet file or Arrow IPC stream. Defaults to "json".
         db (Session, optional): Database session object. Defaults to Depends(get_db).
 
     Returns:
@@ -86,8 +158,15 @@ def subject_fetch_rows_endpoint(
     log.info(f"{request.url}")
 
     try:
+        if format != "json":
+            log.info(f"Exporting the result as {format}")
+            return await export_rows(request, "subject", request_body, limit, offset, format, db, log)
+        if should_stream(stream, limit):
+            log.info("Streaming the result")
+            return await stream_rows(request, "subject", request_body, limit, offset, db, log)
         # Get paged query result
-        result = data_query(db, endpoint_table_name="subject", request_body=request_body, limit=limit, offset=offset, log=log)
+        query = partial(data_query, db, endpoint_table_name="subject", request_body=request_body, limit=limit, offset=offset, log=log, timer=request.state.phase_timer)
+        result = await run_coalesced('/data/subject', request_body, partial(run_in_lane, 'data', query, request.state.phase_timer), request.state.phase_timer, limit=limit, offset=offset)
         if limit != None:
             if offset == None:
                 offset = 0
@@ -100,4 +179,4 @@ def subject_fetch_rows_endpoint(
     except Exception as e:
         handle_router_errors(e, log)
 
-    return result
\ No newline at end of file
+    return build_response(result, PagedResponseObj)
\ No newline at end of file
@@ -0,0 +1,120 @@
+from functools import partial
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy.orm import Session
+
+from cda_api import EmptyQueryError, get_logger, get_query_id
+from cda_api.application_functions import handle_router_errors
+from cda_api.db import get_db
+from cda_api.db.query_builders import data_summary_query
+from cda_api.coalescing import run_coalesced
+from cda_api.responses import build_response
+from cda_api.scheduler import run_in_lane
+from cda_api.classes.models import DataSummaryResponseObj, DataRequestBody
+
+# API router object. Defines /data_summary endpoint options
+router = APIRouter(prefix="/data_summary", tags=["data_summary"])
+
+
+@router.post("/file")
+async def file_data_summary_endpoint(
+    request: Request, request_body: DataRequestBody, limit: int = 100, offset: int = 0, db: Session = Depends(get_db)
+) -> DataSummaryResponseObj:
+    """File endpoint that returns a page of json formatted row data along with the summary of the same query.
+    Equivalent to calling /data/file and /summary/file with the same body but only filters once
+
+    Args:
+        request (Request): HTTP request object
+        request_body (DataRequestBody): JSON input query
+        limit (int, optional): Limit for paged results. Defaults to 100.
+        offset (int, optional): Offset for paged results. Defaults to 0.
+        db (Session, optional): Database session object. Defaults to Depends(get_db).
+
+    Returns:
+        DataSummaryResponseObj:
+        {
+            'result': [{'column': 'data'}],
+            'query_sql': 'SQL statement used to generate result',
+            'total_row_count': 'total rows of data for query generated (not paged)',
+            'next_url': 'URL to acquire next paged result',
+            'summary': [{'summary': 'data'}]
+        }
+    """
+    qid = get_query_id()
+    log = get_logger(qid, logger_type='query')
+    log.info(f"data_summary/file endpoint hit: {request.client}")
+    log.info(f"DataRequestBody: {request_body.as_string()}")
+    log.info(f"{request.url}")
+    if request_body.is_empty():
+        e = EmptyQueryError("Must provide either/both of 'MATCH_ALL' or 'MATCH_SOME' within the request body")
+        log.exception(e)
+        raise HTTPException(status_code=404, detail=str(e))
+
+    try:
+        # Get paged query result and summary
+        query = partial(data_summary_query, db, endpoint_table_name="file", request_body=request_body, limit=limit, offset=offset, log=log, timer=request.state.phase_timer)
+        result = await run_coalesced('/data_summary/file', request_body, partial(run_in_lane, 'summary', query, request.state.phase_timer), request.state.phase_timer, limit=limit, offset=offset)
+        if limit != None:
+            if offset == None:
+                offset = 0
+            if result["total_row_count"] > offset + limit:
+                next_url = request.url.components.geturl().replace(f"offset={offset}", f"offset={offset+limit}")
+                result["next_url"] = next_url
+        else:
+            result["next_url"] = None
+        log.info("Success")
+    except Exception as e:
+        handle_router_errors(e, log)
+    return build_response(result, DataSummaryResponseObj)
+
+
+@router.post("/subject")
+async def subject_data_summary_endpoint(
+    request: Request, request_body: DataRequestBody, limit: int = 100, offset: int = 0, db: Session = Depends(get_db)
+) -> DataSummaryResponseObj:
+    """Subject endpoint that returns a page of json formatted row data along with the summary of the same query.
+    Equivalent to calling /data/subject and /summary/subject with the same body but only filters once
+
+    Args:
+        request (Request): HTTP request object
+        request_body (DataRequestBody): JSON input query
+        limit (int, optional): Limit for paged results. Defaults to 100.
+        offset (int, optional): Offset for paged results. Defaults to 0.
+        db (Session, optional): Database session object. Defaults to Depends(get_db).
+
+    Returns:
+        DataSummaryResponseObj:
+        {
+            'result': [{'column': 'data'}],
+            'query_sql': 'SQL statement used to generate result',
+            'total_row_count': 'total rows of data for query generated (not paged)',
+            'next_url': 'URL to acquire next paged result',
+            'summary': [{'summary': 'data'}]
+        }
+    """
+    qid = get_query_id()
+    log = get_logger(qid, logger_type='query')
+    log.info(f"data_summary/subject endpoint hit: {request.client}")
+    log.info(f"DataRequestBody: {request_body.as_string()}")
+    log.info(f"{request.url}")
+    if request_body.is_empty():
+        e = EmptyQueryError("Must provide either/both of 'MATCH_ALL' or 'MATCH_SOME' within the request body")
+        log.exception(e)
+        raise HTTPException(status_code=404, detail=str(e))
+
+    try:
+        # Get paged query result and summary
+        query = partial(data_summary_query, db, endpoint_table_name="subject", request_body=request_body, limit=limit, offset=offset, log=log, timer=request.state.phase_timer)
+        result = await run_coalesced('/data_summary/subject', request_body, partial(run_in_lane, 'summary', query, request.state.phase_timer), request.state.phase_timer, limit=limit, offset=offset)
+        if limit != None:
+            if offset == None:
+                offset = 0
+            if result["total_row_count"] > offset + limit:
+                next_url = request.url.components.geturl().replace(f"offset={offset}", f"offset={offset+limit}")
+                result["next_url"] = next_url
+        else:
+            result["next_url"] = None
+        log.info("Success")
+    except Exception as e:
+        handle_router_errors(e, log)
+    return build_response(result, DataSummaryResponseObj)
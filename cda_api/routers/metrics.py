@@ -0,0 +1,16 @@
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+router = APIRouter(prefix="/metrics", tags=["metrics"])
+
+
+# Served without a trailing slash (scrapers don't expect a redirect) and left out of the OpenAPI schema so it isn't generated into cda-client
+@router.get("", include_in_schema=False)
+def metrics_endpoint() -> Response:
+    """Prometheus metrics: request counts and latency, phase timings, rows returned, connection pool usage,
+    cache hit ratios, DatabaseInfo rebuilds and error counts
+
+    Returns:
+        Response: Prometheus text exposition format
+    """
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
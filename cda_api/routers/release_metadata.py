@@ -1,3 +1,5 @@
+from functools import partial
+
 from fastapi import APIRouter, Depends, Request
 from sqlalchemy.orm import Session
 
@@ -5,6 +7,7 @@ from cda_api import get_logger, get_query_id
 from cda_api.application_functions import handle_router_errors
 from cda_api.db import get_db
 from cda_api.db.query_builders import release_metadata_query
+from cda_api.scheduler import run_in_lane
 from cda_api.classes.models import ReleaseMetadataObj
 
 router = APIRouter(prefix="/release_metadata", tags=["release_metadata"])
@@ -12,7 +15,7 @@ router = APIRouter(prefix="/release_metadata", tags=["release_metadata"])
 
 # TODO - include count(*) for all tables
 @router.get("/")
-def release_metadata_endpoint(request: Request, db: Session = Depends(get_db)) -> ReleaseMetadataObj:
+async def release_metadata_endpoint(request: Request, db: Session = Depends(get_db)) -> ReleaseMetadataObj:
     """_summary_
 
     Args:
@@ -28,7 +31,7 @@ def release_metadata_endpoint(request: Request, db: Session = Depends(get_db)) -
     log.info(f"{request.url}")
 
     try:
-        result = release_metadata_query(db, log)
+        result = await run_in_lane('metadata', partial(release_metadata_query, db, log), request.state.phase_timer)
         log.info("Success")
     except Exception as e:
         handle_router_errors(e, log)
@@ -1,3 +1,5 @@
+from functools import partial
+
 from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
 
@@ -5,18 +7,22 @@ from cda_api import EmptyQueryError, get_logger, get_query_id
 from cda_api.application_functions import handle_router_errors
 from cda_api.db import get_db
 from cda_api.db.query_builders import summary_query
+from cda_api.coalescing import run_coalesced
+from cda_api.responses import build_response
+from cda_api.scheduler import run_in_lane
 from cda_api.classes.models import SummaryResponseObj, SummaryRequestBody
 
 router = APIRouter(prefix="/summary", tags=["summary"])
 
 
 @router.post("/file")
-def file_summary_endpoint(request: Request, request_body: SummaryRequestBody, db: Session = Depends(get_db)) -> SummaryResponseObj:
+async def file_summary_endpoint(request: Request, request_body: SummaryRequestBody, approximate: bool = False, db: Session = Depends(get_db)) -> SummaryResponseObj:
     """_summary_
 
     Args:
         request (Request): _description_
         request_body (SummaryRequestBody): _description_
+        approximate (bool, optional): Summarize a sample of the filtered rows and return error bounds. Defaults to False.
         db (Session, optional): _description_. Defaults to Depends(get_db).
 
     Returns:
@@ -34,20 +40,22 @@ def file_summary_endpoint(request: Request, request_body: SummaryRequestBody, db
         raise HTTPException(status_code=404, detail=str(e))
 
     try:
-        result = summary_query(db, endpoint_table_name="file", request_body=request_body, log=log)
+        query = partial(summary_query, db, endpoint_table_name="file", request_body=request_body, log=log, timer=request.state.phase_timer, approximate=approximate)
+        result = await run_coalesced('/summary/file', request_body, partial(run_in_lane, 'summary', query, request.state.phase_timer), request.state.phase_timer, approximate=approximate)
         log.info("Success")
     except Exception as e:
         handle_router_errors(e, log)
-    return result
+    return build_response(result, SummaryResponseObj)
 
 
 @router.post("/subject")
-def subject_summary_endpoint(request: Request, request_body: SummaryRequestBody, db: Session = Depends(get_db)) -> SummaryResponseObj:
+async def subject_summary_endpoint(request: Request, request_body: SummaryRequestBody, approximate: bool = False, db: Session = Depends(get_db)) -> SummaryResponseObj:
     """_summary_
 
     Args:
         request (Request): _description_
         request_body (SummaryRequestBody): _description_
+        approximate (bool, optional): Summarize a sample of the filtered rows and return error bounds. Defaults to False.
         db (Session, optional): _description_. Defaults to Depends(get_db).
 
     Returns:
@@ -65,8 +73,9 @@ def subject_summary_endpoint(request: Request, request_body: SummaryRequestBody,
         raise HTTPException(status_code=404, detail=str(e))
 
     try:
-        result = summary_query(db, endpoint_table_name="subject", request_body=request_body, log=log)
+        query = partial(summary_query, db, endpoint_table_name="subject", request_body=request_body, log=log, timer=request.state.phase_timer, approximate=approximate)
+        result = await run_coalesced('/summary/subject', request_body, partial(run_in_lane, 'summary', query, request.state.phase_timer), request.state.phase_timer, approximate=approximate)
         log.info("Success")
     except Exception as e:
         handle_router_errors(e, log)
-    return result
\ No newline at end of file
+    return build_response(result, SummaryResponseObj)
\ No newline at end of file
@@ -0,0 +1,255 @@
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from functools import partial
+from os import getenv
+
+import anyio
+
+from cda_api import LaneQueueFull, get_logger
+from cda_api.db.connection import DB_MAX_OVERFLOW, DB_POOL_SIZE
+from cda_api.metrics import LANE_ACTIVE, LANE_QUEUE_DEPTH, LANE_REJECTED, LANE_WAIT
+
+log = get_logger('scheduler.py')
+
+
+class LaneSlot:
+    """Slot of a lane taken by run(). The work can hand it back early (ex. when its query is moved to the low_priority lane)"""
+    def __init__(self, lane):
+        self.lane = lane
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.lane.limiter.release_on_behalf_of(self)
+            self.lane._finish()
+
+
+class QueryLane:
+    """Bounded concurrency lane for one class of endpoint work.
+    Work beyond the lane's concurrency waits in the lane's queue and is rejected with LaneQueueFull once max_queue are waiting.
+    Only work that can't start right away counts as waiting.
+
+    run() is used by async endpoints and runs the work on a worker thread once it has a slot so queued requests never hold a thread.
+    run_stream() does the same for work returning an iterator that is consumed while the response is sent and keeps the slot until it is closed.
+    hold() is used by work that is already on a worker thread (ex. over budget queries moved to the low_priority lane)."""
+    def __init__(self, name, concurrency, max_queue):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.limiter = anyio.CapacityLimiter(concurrency)
+        self._semaphore = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._active = 0
+        LANE_QUEUE_DEPTH.labels(name).set_function(self.get_queue_depth)
+        LANE_ACTIVE.labels(name).set_function(self.get_active)
+
+    def __repr__(self):
+        return f"QueryLane({self.name}, concurrency={self.concurrency}, max_queue={self.max_queue})"
+
+    def get_queue_depth(self):
+        return self._waiting
+
+    def get_active(self):
+        return self._active
+
+    def _enqueue(self):
+        with self._lock:
+            if self._waiting >= self.max_queue:
+                LANE_REJECTED.labels(self.name).inc()
+                raise LaneQueueFull(f'Too many {self.name} requests are queued. Please try again shortly')
+            self._waiting += 1
+        return time.perf_counter()
+
+    def _dequeue(self):
+        with self._lock:
+            self._waiting -= 1
+
+    # enqueue_time is None for work that got a slot without waiting
+    def _start(self, enqueue_time, phase_timer):
+        wait_time = 0.0 if enqueue_time is None else time.perf_counter() - enqueue_time
+        with self._lock:
+            if enqueue_time is not None:
+                self._waiting -= 1
+            self._active += 1
+        LANE_WAIT.labels(self.name).observe(wait_time)
+        if phase_timer is not None:
+            phase_timer.record('queue', wait_time)
+
+    def _finish(self):
+        with self._lock:
+            self._active -= 1
+
+    async def _acquire(self, slot, phase_timer):
+        try:
+            self.limiter.acquire_on_behalf_of_nowait(slot)
+            self._start(None, phase_timer)
+            return
+        except anyio.WouldBlock:
+            pass
+        enqueue_time = self._enqueue()
+        try:
+            await self.limiter.acquire_on_behalf_of(slot)
+        except anyio.get_cancelled_exc_class():
+            # Cancelled (ex. client disconnected) while still waiting for the lane
+            self._dequeue()
+            raise
+        self._start(enqueue_time, phase_timer)
+
+    @asynccontextmanager
+    async def occupy(self, phase_timer=None):
+        """Holds a slot of the lane from async code (ex. for the whole of a /batch request)"""
+        slot = LaneSlot(self)
+        await self._acquire(slot, phase_timer)
+        try:
+            yield slot
+        finally:
+            slot.release()
+
+    async def run(self, func, phase_timer=None):
+        slot = LaneSlot(self)
+        await self._acquire(slot, phase_timer)
+        try:
+            return await anyio.to_thread.run_sync(partial(_run_with_slot, slot, func))
+        finally:
+            slot.release()
+
+    async def run_stream(self, func, phase_timer=None):
+        """Runs work returning an iterator (ex. the chunks of a streamed response) and keeps the slot until the iterator
+        is exhausted or closed, so the rows fetched while the response is sent count against the lane too
+
+        Args:
+            func (Callable): Returns an iterator. Runs on a worker thread like run()
+            phase_timer (PhaseTimer, optional): Records the time spent waiting for the lane. Defaults to None.
+
+        Returns:
+            LaneStream: Async iterator over the items of func's iterator. Has to be closed with aclose()
+        """
+        slot = LaneSlot(self)
+        await self._acquire(slot, phase_timer)
+        try:
+            iterator = await anyio.to_thread.run_sync(partial(_run_with_slot, slot, func))
+        except BaseException:
+            slot.release()
+            raise
+        return LaneStream(iterator, slot)
+
+    @contextmanager
+    def hold(self, phase_timer=None):
+        if self._semaphore.acquire(blocking=False):
+            self._start(None, phase_timer)
+        else:
+            enqueue_time = self._enqueue()
+            self._semaphore.acquire()
+            self._start(enqueue_time, phase_timer)
+        try:
+            yield
+        finally:
+            self._finish()
+            self._semaphore.release()
+
+
+class LaneStream:
+    """Async iterator over the iterator returned by work run with QueryLane.run_stream().
+    Each item is produced on a worker thread. aclose() closes the iterator (ending its query) and hands the lane slot back"""
+    def __init__(self, iterator, slot):
+        self.iterator = iterator
+        self.slot = slot
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            item = await anyio.to_thread.run_sync(next, self.iterator, _END_OF_STREAM)
+        except BaseException:
+            await self.aclose()
+            raise
+        if item is _END_OF_STREAM:
+            await self.aclose()
+            raise StopAsyncIteration
+        return item
+
+    async def aclose(self):
+        if self.closed:
+            return
+        self.closed = True
+        # Also runs when the response was cancelled (ex. the client disconnected)
+        with anyio.CancelScope(shield=True):
+            try:
+                close = getattr(self.iterator, 'close', None)
+                if close is not None:
+                    await anyio.to_thread.run_sync(close)
+            finally:
+                self.slot.release()
+
+
+_END_OF_STREAM = object()
+
+# Slot held by the work running on the current worker thread (None outside of run())
+_thread_state = threading.local()
+
+
+def _run_with_slot(slot, func):
+    _thread_state.slot = slot
+    try:
+        return func()
+    finally:
+        _thread_state.slot = None
+
+
+# Default (concurrency, max queued) per lane. The concurrency totals 11 (the batch lane counts the session each running
+# /batch keeps open), which leaves DB_POOL_HEADROOM connections of SQLAlchemy's default pool (5 + 10 overflow) to
+# background work (precomputed summaries, indexes and snapshots)
+LANE_DEFAULTS = {
+    'metadata': (1, 100),
+    'column_values': (2, 50),
+    'data': (4, 50),
+    'summary': (2, 20),
+    'low_priority': (1, 10),
+    'batch': (1, 10),
+}
+# Connections of the pool kept free of lane work
+DB_POOL_HEADROOM = int(getenv("DB_POOL_HEADROOM", 4))
+
+# Configured with <LANE>_LANE_CONCURRENCY and <LANE>_LANE_MAX_QUEUE (ex. SUMMARY_LANE_CONCURRENCY)
+LANES = {
+    name: QueryLane(
+        name,
+        int(getenv(f"{name.upper()}_LANE_CONCURRENCY", concurrency)),
+        int(getenv(f"{name.upper()}_LANE_MAX_QUEUE", max_queue)),
+    )
+    for name, (concurrency, max_queue) in LANE_DEFAULTS.items()
+}
+
+if sum(lane.concurrency for lane in LANES.values()) + DB_POOL_HEADROOM > DB_POOL_SIZE + DB_MAX_OVERFLOW:
+    log.warning(f'Lane concurrency ({sum(lane.concurrency for lane in LANES.values())}) plus DB_POOL_HEADROOM ({DB_POOL_HEADROOM}) '
+                f'exceeds the database pool ({DB_POOL_SIZE} + {DB_MAX_OVERFLOW} overflow). Requests may wait on the pool instead of their lane')
+
+
+async def run_in_lane(lane_name, func, phase_timer=None):
+    return await LANES[lane_name].run(func, phase_timer)
+
+
+async def run_stream_in_lane(lane_name, func, phase_timer=None):
+    return await LANES[lane_name].run_stream(func, phase_timer)
+
+
+@contextmanager
+def _run_in_low_priority_lane(phase_timer):
+    # The query is moved rather than nested: the slot of the lane it was dispatched to is handed back first
+    slot = getattr(_thread_state, 'slot', None)
+    if slot is not None:
+        anyio.from_thread.run_sync(slot.release)
+    with LANES['low_priority'].hold(phase_timer):
+        yield
+
+
+# Moves the execution of a query the admission check sent to the low_priority lane into that lane
+def get_admission_lane_context(admission_action, phase_timer=None):
+    if admission_action == 'low_priority':
+        return _run_in_low_priority_lane(phase_timer)
+    return nullcontext()
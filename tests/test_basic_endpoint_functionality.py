@@ -57,6 +57,14 @@ def test_columns_endpoint():
     assert response.status_code == 200
 
 
+def test_metrics_endpoint():
+    client.post("/data/subject", json={"MATCH_ALL": ["subject_id_alias < 1"]})
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert 'cda_api_requests_total{endpoint_table="subject",router="data",status="200"}' in response.text
+    assert "cda_api_db_pool_checked_out" in response.text
+
+
 
 
 ################################ data/subject testing ################################
@@ -89,6 +97,460 @@ def test_data_subject_endpoint_offset_too_big():
     assert len(response.json()["result"]) == 0
 
 
+def test_data_subject_endpoint_server_timing():
+    response = client.post("/data/subject", json={"MATCH_ALL": ["subject_id_alias < 10"]})
+    assert response.status_code == 200
+    phases = [phase.split(";")[0] for phase in response.headers["Server-Timing"].split(", ")]
+    assert phases == ["queue", "build", "compile", "admission", "execute", "fetch", "format", "serialize", "total"]
+
+
+def test_data_subject_endpoint_query_cost_exceeded(monkeypatch):
+    from cda_api.db import admission
+    monkeypatch.setattr(admission, "QUERY_ADMISSION_ENABLED", True)
+    monkeypatch.setitem(admission.QUERY_BUDGETS, "data", {"cost": 0, "rows": 0})
+    response = client.post("/data/subject", json={"MATCH_ALL": ["subject_id_alias < 100"]})
+    assert response.status_code == 400
+    assert response.json()["error_type"] == "QueryCostExceeded"
+
+
+def test_summary_subject_endpoint_coalesced_requests():
+    from concurrent.futures import ThreadPoolExecutor
+    # Same filters in a different order share one execution
+    request_bodies = [{"MATCH_ALL": ["subject_id_alias < 100", "sex = female"]}, {"MATCH_ALL": ["sex = female", "subject_id_alias < 100"]}] * 2
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        responses = list(executor.map(lambda request_body: client.post("/summary/subject", json=request_body), request_bodies))
+    assert all(response.status_code == 200 for response in responses)
+    assert all(response.json() == responses[0].json() for response in responses)
+
+
+def test_single_flight_shares_execution():
+    import anyio
+    from cda_api.coalescing import SingleFlight
+    single_flight = SingleFlight()
+    calls = []
+    results = []
+
+    async def query():
+        calls.append(1)
+        await anyio.sleep(0.1)
+        return {"result": [1]}
+
+    async def request():
+        results.append(await single_flight.run("key", query, "/summary/subject"))
+
+    async def main():
+        async with anyio.create_task_group() as task_group:
+            for _ in range(3):
+                task_group.start_soon(request)
+
+    anyio.run(main)
+    assert len(calls) == 1
+    assert results == [{"result": [1]}] * 3
+
+
+def test_data_subject_endpoint_lane_queue_full(monkeypatch):
+    from cda_api.scheduler import LANES
+    monkeypatch.setattr(LANES["data"], "max_queue", 0)
+    response = client.post("/data/subject", json={"MATCH_ALL": ["subject_id_alias < 10"]})
+    assert response.status_code == 503
+    assert response.json()["error_type"] == "LaneQueueFull"
+    # Other lanes are unaffected
+    response = client.get("/columns/")
+    assert response.status_code == 200
+
+
+def test_data_summary_subject_endpoint():
+    request_body = {"MATCH_ALL": ["subject_id_alias < 100"]}
+    response = client.post("/data_summary/subject?limit=10", json=request_body)
+    assert response.status_code == 200
+    data_response = client.post("/data/subject?limit=10", json=request_body).json()
+    summary_response = client.post("/summary/subject", json=request_body).json()
+    assert response.json()["result"] == data_response["result"]
+    assert response.json()["total_row_count"] == data_response["total_row_count"]
+    assert response.json()["next_url"] == data_response["next_url"].replace("/data/", "/data_summary/")
+    assert response.json()["summary"] == summary_response["result"]
+
+
+def test_data_subject_endpoint_in_list_array_binding(monkeypatch):
+    from cda_api.classes import shared_class_functions
+    from cda_api.db import filter_functions
+    monkeypatch.setattr(shared_class_functions, "PRESELECT_CACHE_ENABLED", False)
+    years = list(range(1800, 1950))
+    causes = ["cancer related"] + [f"not a cause {i}" for i in range(150)]
+    request_bodies = [
+        {"MATCH_ALL": [f"subject_id_alias in {list(range(300))}"]},
+        {"MATCH_ALL": [f"year_of_birth not in {years}"]},
+        {"MATCH_ALL": [f"cause_of_death not in {causes}"]},
+    ]
+    # Lists over IN_LIST_ARRAY_THRESHOLD are bound as an array (= ANY / != ALL) and shown as a placeholder in query_sql
+    array_responses = [client.post("/data/subject", json=body, params={"limit": 500}).json() for body in request_bodies]
+    for response in array_responses:
+        assert "values */" in response["query_sql"]
+        assert "1849" not in response["query_sql"]
+    monkeypatch.setattr(filter_functions, "IN_LIST_ARRAY_THRESHOLD", 1000)
+    for body, array_response in zip(request_bodies, array_responses):
+        inline_response = client.post("/data/subject", json=body, params={"limit": 500}).json()
+        assert "values */" not in inline_response["query_sql"]
+        assert inline_response["total_row_count"] == array_response["total_row_count"]
+        assert inline_response["result"] == array_response["result"]
+
+
+def test_data_subject_endpoint_json_literals_in_list():
+    response = client.post("/data/subject", json={"MATCH_ALL": ["subject_id_alias in [1, null]"]})
+    assert response.status_code == 400
+
+
+def test_data_subject_endpoint_reuses_filtered_preselect(monkeypatch):
+    from cda_api.classes import shared_class_functions
+    from cda_api.db import PRESELECT_CACHE
+    monkeypatch.setattr(shared_class_functions, "PRESELECT_CACHE_ENABLED", True)
+    request_body = {"MATCH_ALL": ["subject_id_alias < 100"]}
+    full_page = client.post("/data/subject?limit=10&offset=0", json=request_body).json()
+    hits = PRESELECT_CACHE.hits
+    first_page = client.post("/data/subject?limit=5&offset=0", json=request_body).json()
+    second_page = client.post("/data/subject?limit=5&offset=5", json=request_body).json()
+    summary = client.post("/summary/subject", json=request_body).json()
+    assert PRESELECT_CACHE.hits == hits + 3
+    assert first_page["total_row_count"] == second_page["total_row_count"] == full_page["total_row_count"]
+    assert first_page["result"] + second_page["result"] == full_page["result"]
+    assert summary["result"][0]["total_count"] == full_page["total_row_count"]
+    # The cached IDs are bound as one array and only referenced in query_sql
+    assert "subject_alias values of the filtered_preselect */" in first_page["query_sql"]
+
+
+def test_data_subject_endpoint_over_budget_preselect_not_rejected(monkeypatch):
+    from cda_api.classes import shared_class_functions
+    from cda_api.db import admission
+    monkeypatch.setattr(shared_class_functions, "PRESELECT_CACHE_ENABLED", True)
+    monkeypatch.setattr(admission, "QUERY_OVER_BUDGET_ACTION", "reject")
+    # Only the materialization probe is over budget: it is skipped instead of rejecting the request
+    monkeypatch.setattr(shared_class_functions, "is_within_budget", lambda db, statement, query_type, log: False)
+    response = client.post("/data/subject", json={"MATCH_ALL": ["subject_id_alias < 50"]})
+    assert response.status_code == 200
+    assert "values of the filtered_preselect */" not in response.json()["query_sql"]
+
+
+def test_is_within_budget_never_rejects(monkeypatch):
+    from sqlalchemy import select, literal
+    from cda_api import get_logger
+    from cda_api.db import admission
+    from cda_api.db.connection import session
+    monkeypatch.setattr(admission, "QUERY_ADMISSION_ENABLED", True)
+    monkeypatch.setattr(admission, "QUERY_OVER_BUDGET_ACTION", "reject")
+    monkeypatch.setitem(admission.QUERY_BUDGETS, "data", {"cost": -1, "rows": -1})
+    db = session()
+    try:
+        assert admission.is_within_budget(db, select(literal(1)), "data", get_logger()) is False
+    finally:
+        db.close()
+
+
+def test_sort_preselect_rows():
+    from cda_api.classes.shared_class_functions import sort_preselect_rows
+    rows = [(3, None), (1, 2), (3, None), (1, None), (1, 1)]
+    assert sort_preselect_rows(rows) == [(1, 1), (1, 2), (1, None), (3, None)]
+
+
+def test_summary_subject_endpoint_refines_cached_preselect(monkeypatch):
+    from cda_api.classes import shared_class_functions
+    from prometheus_client import REGISTRY
+    base_body = {"MATCH_ALL": ["subject_id_alias < 1000"]}
+    refined_body = {"MATCH_ALL": ["subject_id_alias < 1000", "sex = female"]}
+    monkeypatch.setattr(shared_class_functions, "PRESELECT_CACHE_ENABLED", True)
+    client.post("/summary/subject", json=base_body)
+    refinements = REGISTRY.get_sample_value("cda_api_preselect_refinements_total")
+    refined = client.post("/summary/subject", json=refined_body).json()
+    assert REGISTRY.get_sample_value("cda_api_preselect_refinements_total") == refinements + 1
+    # Evaluating every filter gives the same result
+    monkeypatch.setattr(shared_class_functions, "PRESELECT_CACHE_ENABLED", False)
+    full = client.post("/summary/subject", json=refined_body).json()
+    assert refined["result"] == full["result"]
+
+
+def test_summary_subject_endpoint_bitmap_index(monkeypatch):
+    import pytest
+    pytest.importorskip("pyroaring")
+    from cda_api.classes import shared_class_functions
+    from cda_api.classes.BitmapIndex import BitmapIndex
+    from cda_api.db import DB_INFO
+    monkeypatch.setattr(shared_class_functions, "PRESELECT_CACHE_ENABLED", False)
+    request_bodies = [
+        {"MATCH_ALL": ["sex = female"]},
+        {"MATCH_ALL": ["sex != FEMALE"]},
+        {"MATCH_SOME": ["sex in ['female', 'male']", "subject_data_at_gdc = true"]},
+        {"MATCH_ALL": ["subject_data_at_pdc is not true", "sex not in ['female']"]},
+    ]
+    sql_responses = [client.post("/summary/subject", json=request_body).json()["result"] for request_body in request_bodies]
+    bitmap_index = BitmapIndex(DB_INFO)
+    monkeypatch.setattr(shared_class_functions, "get_bitmap_index", lambda db_info: bitmap_index)
+    bitmap_responses = [client.post("/summary/subject", json=request_body).json()["result"] for request_body in request_bodies]
+    assert bitmap_responses == sql_responses
+
+
+def test_scheduler_lane_without_queue_accepts_when_idle():
+    import anyio
+    from cda_api.scheduler import QueryLane
+    # Requests that start right away aren't queued, so a lane with max_queue=0 only rejects while it is busy
+    lane = QueryLane("test_idle", 1, 0)
+    assert anyio.run(lane.run, lambda: 42) == 42
+    assert lane.get_queue_depth() == 0
+    assert lane.get_active() == 0
+
+
+def test_column_value_index_match():
+    from cda_api.classes.ColumnValueIndex import ColumnValueIndex
+    # Upper values come from the database, which keeps "ß" where Python's upper() would return "SS"
+    rows = [("Lung", "LUNG"), ("lung, NOS", "LUNG, NOS"), ("Bronchus", "BRONCHUS"), ("Straße", "STRAßE"), (None, None)]
+    column_value_index = ColumnValueIndex(None, rows)
+    assert column_value_index.match("lung%") == ["Lung", "lung, NOS"]
+    assert column_value_index.match("%nos") == ["lung, NOS"]
+    assert column_value_index.match("_ung") == ["Lung"]
+    assert column_value_index.match("%CHU%") == ["Bronchus"]
+    assert column_value_index.match("%") == ["Lung", "lung, NOS", "Bronchus", "Straße"]
+    assert column_value_index.match("strasse") == []
+    assert column_value_index.match("stra%") == ["Straße"]
+    # Non-ASCII patterns are left to the database
+    assert column_value_index.match("straße") is None
+
+
+def test_data_subject_endpoint_expanded_like(monkeypatch):
+    from cda_api.classes import FilterInfo as filter_info_module
+    from cda_api.classes import shared_class_functions
+    from cda_api.classes.ColumnValueIndex import COLUMN_VALUE_INDEXES, can_expand
+    from cda_api.db import DB_INFO
+    monkeypatch.setattr(shared_class_functions, "PRESELECT_CACHE_ENABLED", False)
+    COLUMN_VALUE_INDEXES._build(DB_INFO, DB_INFO.release_key)
+    column_info = next(column_info for column_info in DB_INFO.get_table_info("subject").column_infos
+                       if can_expand(column_info) and COLUMN_VALUE_INDEXES.get(DB_INFO, column_info) is not None)
+    request_bodies = [
+        {"MATCH_ALL": [f"{column_info.name} like a*"]},
+        {"MATCH_ALL": [f"{column_info.name} like *E*"]},
+        {"MATCH_ALL": [f"{column_info.name} like *"]},
+        {"MATCH_ALL": [f"{column_info.name} not like a*"]},
+    ]
+    expanded_responses = [client.post("/data/subject?limit=100", json=request_body).json() for request_body in request_bodies]
+    monkeypatch.setattr(filter_info_module, "get_column_value_index", lambda db_info, column_info: None)
+    like_responses = [client.post("/data/subject?limit=100", json=request_body).json() for request_body in request_bodies]
+    for expanded_response, like_response in zip(expanded_responses, like_responses):
+        assert expanded_response["total_row_count"] == like_response["total_row_count"]
+        assert expanded_response["result"] == like_response["result"]
+
+
+def test_summary_subject_endpoint_single_pass_summaries():
+    response = client.post("/summary/subject", json={"MATCH_ALL": ["subject_id_alias < 100"]})
+    assert response.status_code == 200
+    query_sql = response.json()["query_sql"]
+    # One aggregate pass per table for categorical and numeric columns instead of one per column
+    assert query_sql.count("GROUPING SETS") == 1
+    assert query_sql.count("subject_numeric_summaries AS") <= 1
+
+
+def test_summary_subject_endpoint_precomputed(monkeypatch):
+    import time
+    from cda_api.classes.PrecomputedSummaries import PRECOMPUTED_SUMMARIES
+    from cda_api.db import DB_INFO
+    from cda_api.db import query_builders
+    from prometheus_client import REGISTRY
+    request_body = {"MATCH_ALL": [], "MATCH_SOME": []}
+    query_builders.warm_precomputed_summaries()
+    key = (DB_INFO.release_key, "subject", None)
+    for _ in range(600):
+        if PRECOMPUTED_SUMMARIES.get(key) is not None:
+            break
+        time.sleep(1)
+    # The labelled sample only exists once a subject summary has been served from the precomputed summaries
+    hits = REGISTRY.get_sample_value("cda_api_precomputed_summary_hits_total", {"endpoint_table": "subject"}) or 0
+    precomputed = client.post("/summary/subject", json=request_body).json()
+    assert REGISTRY.get_sample_value("cda_api_precomputed_summary_hits_total", {"endpoint_table": "subject"}) == hits + 1
+    monkeypatch.setattr(query_builders, "PRECOMPUTED_SUMMARIES_ENABLED", False)
+    assert client.post("/summary/subject", json=request_body).json() == precomputed
+
+
+def test_precomputed_summaries_retry_failures(monkeypatch):
+    import time
+    from cda_api.classes import PrecomputedSummaries as precomputed_summaries_module
+    from cda_api.db import DB_INFO
+    monkeypatch.setattr(precomputed_summaries_module, "PRECOMPUTED_SUMMARIES_RETRY_SECONDS", 0)
+    precomputed_summaries = precomputed_summaries_module.PrecomputedSummaries(["subject"])
+    calls = []
+
+    def summarize(endpoint_table_name, request_body):
+        calls.append(request_body)
+        if len(calls) == 1:
+            raise Exception("database unavailable")
+        return {"result": [], "query_sql": None}
+
+    key = (DB_INFO.release_key, "subject", None)
+    for _ in range(2):
+        precomputed_summaries.start_warming(DB_INFO, summarize)
+        for _ in range(100):
+            if not precomputed_summaries.warming:
+                break
+            time.sleep(0.1)
+    # The failed summary isn't marked done and is computed by the next warm
+    assert precomputed_summaries.get(key) is not None
+    assert precomputed_summaries.complete
+    assert calls.count({"MATCH_ALL": [], "MATCH_SOME": []}) == 2
+
+def test_summary_subject_endpoint_approximate():
+    request_body = {"MATCH_ALL": ["sex = female"]}
+    exact = client.post("/summary/subject", json=request_body).json()
+    response = client.post("/summary/subject?approximate=true", json=request_body)
+    assert response.status_code == 200
+    approximate = response.json()
+    assert exact["sample_rate"] is None
+    assert 0 < approximate["sample_rate"] <= 1
+    estimate = approximate["result"][0]["total_count"]
+    error_bound = approximate["error_bounds"][0]["total_count"]
+    assert abs(estimate - exact["result"][0]["total_count"]) <= error_bound
+    # The sample is deterministic
+    assert client.post("/summary/subject?approximate=true", json=request_body).json() == approximate
+
+
+def test_summary_file_endpoint_approximate_related_counts():
+    request_body = {"MATCH_ALL": ["file_data_at_gdc = true", "file_id_alias < 100000"]}
+    exact = client.post("/summary/file", json=request_body).json()["result"][0]
+    approximate = client.post("/summary/file?approximate=true", json=request_body).json()
+    # Only counts of sampled files are scaled. The subjects found in the sample are returned as is, without a bound
+    assert "total_count" in approximate["error_bounds"][0]
+    assert "subject_count" not in approximate["error_bounds"][0]
+    assert approximate["result"][0]["subject_count"] <= exact["subject_count"]
+
+
+def test_summary_subject_endpoint_numpy_engine(monkeypatch):
+    import json
+    import time
+    import pytest
+    pytest.importorskip("numpy")
+    from prometheus_client import REGISTRY
+    from cda_api.classes import SummarySnapshot
+    from cda_api.classes import shared_class_functions
+    from cda_api.db import DB_INFO
+    request_bodies = [
+        {"MATCH_ALL": ["sex = female"]},
+        {"MATCH_ALL": ["subject_id_alias < 100"]},
+        {"MATCH_SOME": ["sex in ['female', 'male']", "subject_data_at_gdc = true"]},
+        {"MATCH_ALL": ["subject_id_alias < 0"]},
+    ]
+
+    # Categorical summaries are unordered
+    def normalize(result):
+        return [
+            {key: sorted(value, key=json.dumps) if isinstance(value, list) and value and "count_result" in value[0] else value for key, value in row.items()}
+            for row in result
+        ]
+
+    def get_hits():
+        return REGISTRY.get_sample_value("cda_api_summary_snapshot_hits_total", {"endpoint_table": "subject"}) or 0
+
+    sql_responses = [normalize(client.post("/summary/subject", json=request_body).json()["result"]) for request_body in request_bodies]
+    # The snapshot summarizes IDs that are already in memory, here from the filtered preselect cache
+    monkeypatch.setattr(shared_class_functions, "PRESELECT_CACHE_ENABLED", True)
+    monkeypatch.setattr(SummarySnapshot, "SUMMARY_ENGINE", "numpy")
+    monkeypatch.setattr(DB_INFO, "summary_snapshot", None)
+    # The first requests are summarized in the database while the snapshot loads in the background
+    for _ in range(60):
+        fallback_responses = [normalize(client.post("/summary/subject", json=request_body).json()["result"]) for request_body in request_bodies]
+        assert fallback_responses == sql_responses
+        if not DB_INFO.summary_snapshot.loading:
+            break
+        time.sleep(1)
+    assert not DB_INFO.summary_snapshot.loading
+    hits = get_hits()
+    numpy_responses = [normalize(client.post("/summary/subject", json=request_body).json()["result"]) for request_body in request_bodies]
+    assert get_hits() == hits + len(request_bodies)
+    assert numpy_responses == sql_responses
+
+
+def test_numpy_numeric_summary():
+    import math
+    import pytest
+    np = pytest.importorskip("numpy")
+    from cda_api.classes.SummarySnapshot import numeric_summary
+    empty = [{"min": None, "max": None, "mean": None, "median": None, "lower_quartile": None, "upper_quartile": None}]
+    assert numeric_summary(np.array([], dtype=np.float64), True) == empty
+    assert numeric_summary(np.array([math.nan, math.nan]), True) == empty
+    # Nulls are ignored. percentile_disc() picks values of the column for even and odd lengths
+    assert numeric_summary(np.array([4, math.nan, 1, 3, 2], dtype=np.float64), True) == [{"min": 1, "max": 4, "mean": 3, "median": 2, "lower_quartile": 1, "upper_quartile": 3}]
+    assert numeric_summary(np.array([3, 1, 2], dtype=np.float64), True) == [{"min": 1, "max": 3, "mean": 2, "median": 2, "lower_quartile": 1, "upper_quartile": 3}]
+    # Floats round their mean half to even, exact numerics half away from zero and keep their fractions
+    assert numeric_summary(np.array([2.0, 3.0]), False, True)[0]["mean"] == 2
+    assert numeric_summary(np.array([2.0, 3.0]), False, False)[0]["mean"] == 3
+    numeric = numeric_summary(np.array([0.5, 1.25, 2.0]), False, False)[0]
+    assert (numeric["min"], numeric["median"], numeric["max"]) == (0.5, 1.25, 2)
+    assert numeric_summary(np.array([-0.5, -1.5]), False, False)[0]["mean"] == -1
+
+
+def test_numpy_categorical_summary():
+    import pytest
+    np = pytest.importorskip("numpy")
+    from cda_api.classes.SummarySnapshot import categorical_summary
+    codes = np.array([0, 1, 0, 2], dtype=np.int32)
+    assert categorical_summary("sex", codes, ["female", "male", None]) == [
+        {"sex": "female", "count_result": 2},
+        {"sex": "male", "count_result": 1},
+        {"sex": None, "count_result": 1},
+    ]
+    # Categories without filtered rows are left out and no rows gives None like array_agg()
+    assert categorical_summary("sex", np.array([1], dtype=np.int32), ["female", "male"]) == [{"sex": "male", "count_result": 1}]
+    assert categorical_summary("sex", np.array([], dtype=np.int32), ["female", "male"]) is None
+
+
+def test_numpy_data_source_summary():
+    import pytest
+    np = pytest.importorskip("numpy")
+    from cda_api.classes.SummarySnapshot import data_source_summary
+    # -1 is null, which matches neither true nor false
+    data_source_values = {"subject_data_at_gdc": np.array([1, 1, 0, -1], dtype=np.int8), "subject_data_at_pdc": np.array([1, 0, 0, 1], dtype=np.int8)}
+    assert data_source_summary(data_source_values) == {"gdc_exclusive": 1, "pdc_exclusive": 0, "gdc_pdc": 1}
+    empty_values = {"subject_data_at_gdc": np.array([], dtype=np.int8), "subject_data_at_pdc": np.array([], dtype=np.int8)}
+    assert data_source_summary(empty_values) == {"gdc_exclusive": 0, "pdc_exclusive": 0, "gdc_pdc": 0}
+
+
+def test_batch_endpoint():
+    request_body = {"MATCH_ALL": ["subject_id_alias < 100"]}
+    response = client.post(
+        "/batch/",
+        json={
+            "REQUESTS": [
+                {"endpoint": "/data/subject", "body": request_body, "params": {"limit": 10}},
+                {"endpoint": "/summary/subject", "body": request_body},
+                {"endpoint": "/column_values/sex", "params": {"data_source": "GDC"}},
+                {"endpoint": "/data/subject", "body": {"MATCH_ALL": ["FAKE_COLUMN = 42"]}},
+            ]
+        },
+    )
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [result["status_code"] for result in results] == [200, 200, 200, 400]
+    assert results[0]["result"] == client.post("/data/subject?limit=10", json=request_body).json() | {"next_url": ""}
+    assert results[1]["result"] == client.post("/summary/subject", json=request_body).json()
+    assert results[3]["error_type"] == "ColumnNotFound"
+
+
+def test_batch_endpoint_concurrent(monkeypatch):
+    from cda_api.db import batch
+    request_body = {"MATCH_ALL": ["subject_id_alias < 100"]}
+    batch_request = {
+        "REQUESTS": [
+            {"endpoint": "/data/subject", "body": request_body, "params": {"limit": 10}},
+            {"endpoint": "/summary/subject", "body": request_body},
+            {"endpoint": "/data/subject", "body": request_body, "params": {"limit": 10, "offset": 10}},
+        ]
+    }
+    sequential_results = client.post("/batch/", json=batch_request).json()["results"]
+    # Sub-requests finding the batch session busy run on sessions importing its snapshot
+    monkeypatch.setattr(batch, "BATCH_CONCURRENCY", 3)
+    concurrent_results = client.post("/batch/", json=batch_request).json()["results"]
+    assert concurrent_results == sequential_results
+
+
+def test_batch_endpoint_unsupported_endpoint():
+    response = client.post("/batch/", json={"REQUESTS": [{"endpoint": "/columns"}]})
+    assert response.status_code == 200
+    assert response.json()["results"][0]["error_type"] == "InvalidBatchRequest"
+
+
 def test_data_subject_endpoint_column_not_found():
     response = client.post(
         "/data/subject",
@@ -99,6 +561,20 @@ def test_data_subject_endpoint_column_not_found():
     assert response.json() == expected_response_json
 
 
+def test_data_subject_endpoint_cohort_reference(monkeypatch):
+    from cda_api.classes import shared_class_functions
+    monkeypatch.setattr(shared_class_functions, "PRESELECT_CACHE_ENABLED", False)
+    ids = list(range(0, 50))
+    cohort = client.post("/cohort/", json={"IDS": ids}).json()
+    response = client.post("/data/subject", json={"MATCH_ALL": [f"subject_id_alias in {cohort['filter_reference']}"]}, params={"limit": 100})
+    assert response.status_code == 200
+    expected = client.post("/data/subject", json={"MATCH_ALL": [f"subject_id_alias in {ids}"]}, params={"limit": 100}).json()
+    assert response.json()["result"] == expected["result"]
+    # The cohort is shown by its reference instead of its IDs
+    assert cohort["filter_reference"] in response.json()["query_sql"]
+    assert "ARRAY[0, 1" not in response.json()["query_sql"]
+
+
 ################################ data/file testing ################################
 def test_data_file_endpoint_query_generation():
     response = client.post(
@@ -121,6 +597,126 @@ def test_data_file_endpoint_offset_and_limit():
     assert len(response.json()["result"]) == 10
 
 
+def test_data_file_endpoint_fetches_in_batches(monkeypatch):
+    from cda_api.db import query_builders
+    expected = client.post("/data/file", json={"MATCH_ALL": ["file_id_alias < 100"]}, params={"limit": 25}).json()
+    monkeypatch.setattr(query_builders, "FETCH_BATCH_SIZE", 7)
+    response = client.post("/data/file", json={"MATCH_ALL": ["file_id_alias < 100"]}, params={"limit": 25})
+    assert response.status_code == 200
+    assert response.json() == expected
+
+
+def test_data_file_endpoint_stream():
+    params = {"offset": 10, "limit": 10}
+    expected = client.post("/data/file", json={"MATCH_ALL": ["file_id_alias < 100"]}, params=params).json()
+    response = client.post("/data/file", json={"MATCH_ALL": ["file_id_alias < 100"]}, params={**params, "stream": True})
+    assert response.status_code == 200
+    result = response.json()
+    assert result["result"] == expected["result"]
+    assert result["total_row_count"] == expected["total_row_count"]
+    assert result["next_url"].replace("&stream=true", "") == expected["next_url"]
+
+
+def test_data_file_endpoint_stream_by_limit(monkeypatch):
+    from cda_api.routers import data
+    from cda_api.scheduler import LANES
+    # Streaming is opt-in by default
+    assert not data.should_stream(None, 100000)
+    monkeypatch.setattr(data, "DATA_STREAM_MIN_LIMIT", 10)
+    expected = client.post("/data/file", json={"MATCH_ALL": ["file_id_alias < 100"]}, params={"limit": 10, "stream": False})
+    assert "content-length" in expected.headers
+    response = client.post("/data/file", json={"MATCH_ALL": ["file_id_alias < 100"]}, params={"limit": 10})
+    assert "content-length" not in response.headers
+    assert response.json()["result"] == expected.json()["result"]
+    # The data lane slot is held until the last batch is fetched and handed back afterwards
+    assert LANES["data"].get_active() == 0
+
+
+def test_data_file_endpoint_stream_error(monkeypatch):
+    from sqlalchemy.exc import OperationalError
+    from cda_api.db import query_builders
+    from cda_api.scheduler import LANES
+    get_data_rows_formatter = query_builders.get_data_rows_formatter
+
+    def get_failing_formatter(data_query):
+        format_rows = get_data_rows_formatter(data_query)
+        batches = []
+
+        def format_or_fail(rows):
+            batches.append(rows)
+            if len(batches) > 1:
+                raise OperationalError("FETCH", {}, Exception("connection lost"))
+            return format_rows(rows)
+
+        return format_or_fail
+
+    monkeypatch.setattr(query_builders, "FETCH_BATCH_SIZE", 5)
+    monkeypatch.setattr(query_builders, "get_data_rows_formatter", get_failing_formatter)
+    response = client.post("/data/file", json={"MATCH_ALL": ["file_id_alias < 100"]}, params={"limit": 20, "stream": True})
+    assert response.status_code == 200
+    # The document is closed with the error instead of being cut off
+    result = response.json()
+    assert len(result["result"]) == 5
+    assert result["next_url"] is None
+    assert result["error"]["error_type"] == "DatabaseConnectionDrop"
+    assert LANES["data"].get_active() == 0
+
+def test_data_file_endpoint_fast_json_response(monkeypatch):
+    from cda_api import responses
+    expected = client.post("/data/file", json={"MATCH_ALL": ["file_id_alias < 100"]}, params={"limit": 10}).json()
+    monkeypatch.setattr(responses, "FAST_JSON_RESPONSES", True)
+    response = client.post("/data/file", json={"MATCH_ALL": ["file_id_alias < 100"]}, params={"limit": 10})
+    assert response.status_code == 200
+    assert response.json() == expected
+
+
+def test_data_file_endpoint_compression():
+    expected = client.post("/data/file", json={"MATCH_ALL": ["file_id_alias < 100"]}, params={"limit": 50}, headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in expected.headers
+    response = client.post("/data/file", json={"MATCH_ALL": ["file_id_alias < 100"]}, params={"limit": 50}, headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.json() == expected.json()
+    small_response = client.post("/data/file", json={"MATCH_ALL": ["file_id_alias < 0"]}, headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small_response.headers
+
+
+def test_data_file_endpoint_parquet_and_arrow_export():
+    import io
+    import pytest
+    pyarrow = pytest.importorskip("pyarrow")
+    import pyarrow.ipc
+    import pyarrow.parquet
+    expected = client.post("/data/file", json={"MATCH_ALL": ["file_id_alias < 100"]}, params={"limit": 50}).json()
+    response = client.post("/data/file", json={"MATCH_ALL": ["file_id_alias < 100"]}, params={"limit": 50, "format": "parquet"})
+    assert response.status_code == 200
+    assert response.headers["x-total-row-count"] == str(expected["total_row_count"])
+    assert pyarrow.parquet.read_table(io.BytesIO(response.content)).to_pylist() == expected["result"]
+    response = client.post("/data/file", json={"MATCH_ALL": ["file_id_alias < 100"]}, params={"limit": 50, "format": "arrow"})
+    assert response.status_code == 200
+    assert pyarrow.ipc.open_stream(response.content).read_all().to_pylist() == expected["result"]
+
+
+def test_data_file_endpoint_export_schema_from_column_types(monkeypatch):
+    import io
+    import pytest
+    pyarrow = pytest.importorskip("pyarrow")
+    import pyarrow.parquet
+    from cda_api.db import query_builders
+    # The schema comes from the column types, not the first batch, so it is the same for an empty export
+    empty = client.post("/data/file", json={"MATCH_ALL": ["file_id_alias < 0"]}, params={"format": "parquet"})
+    assert pyarrow.parquet.read_schema(io.BytesIO(empty.content)).field("file_id_alias").type == pyarrow.int64()
+    monkeypatch.setattr(query_builders, "FETCH_BATCH_SIZE", 3)
+    expected = client.post("/data/file", json={"MATCH_ALL": ["file_id_alias < 100"]}, params={"limit": 20}).json()
+    response = client.post("/data/file", json={"MATCH_ALL": ["file_id_alias < 100"]}, params={"limit": 20, "format": "parquet"})
+    assert pyarrow.parquet.read_table(io.BytesIO(response.content)).to_pylist() == expected["result"]
+
+def test_data_file_endpoint_invalid_export_format():
+    response = client.post("/data/file", json={"MATCH_ALL": ["file_id_alias < 100"]}, params={"format": "csv"})
+    assert response.status_code == 400
+    assert response.json()["error_type"] == "InvalidExportFormat"
+
+
 def test_data_file_endpoint_offset_too_big():
     response = client.post("/data/file", json={"MATCH_ALL": ["file_id_alias < 10"]}, params={"offset": 10})
     assert response.status_code == 200
@@ -240,6 +836,27 @@ def test_column_values_endpoint_offset_too_big():
     assert response.status_code == 200
     assert len(response.json()["result"]) == 0 # There should be less than 100 values for sex in the data which should the yield no data
 
+def test_column_values_endpoint_controlled_term_values_are_names():
+    column = 'sex'
+    response = client.post(
+        f"/column_values/{column}",
+    )
+    assert response.status_code == 200
+    values = [row[column] for row in response.json()["result"] if row[column] is not None]
+    assert len(values) > 0
+    assert all(isinstance(value, str) for value in values) # controlled_term id_alias values should be decoded to their names
+    assert values == sorted(values)
+
+
+def test_column_values_endpoint_controlled_term_paging():
+    column = 'sex'
+    full_result = client.post(f"/column_values/{column}").json()["result"]
+    response = client.post(f"/column_values/{column}", params={"offset": 1, "limit": 1})
+    assert response.status_code == 200
+    assert response.json()["result"] == full_result[1:2]
+    assert response.json()["total_row_count"] == len(full_result)
+    assert "controlled_term_names" in response.json()["query_sql"]
+
 
 ################################ /release_metadata testing ################################
 def test_release_metadata_endpoint_return_structure(): # Should be a dictionary containing one key "result" which is a list of dictionaries
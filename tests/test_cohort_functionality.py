@@ -0,0 +1,110 @@
+from cda_api import app
+from fastapi.testclient import TestClient
+
+client = TestClient(app)
+
+
+################################ /cohort testing ################################
+def test_create_cohort():
+    response = client.post(
+        "/cohort/",
+        json={"IDS": [1, 2, 3, 3]},
+    )
+    assert response.status_code == 200
+    assert response.json()["id_count"] == 3
+    assert response.json()["filter_reference"] == f'@cohort:{response.json()["handle"]}'
+
+
+def test_create_cohort_from_file():
+    response = client.post(
+        "/cohort/file",
+        files={"file": ("ids.txt", b"1\n2\n\n3\n")},
+    )
+    assert response.status_code == 200
+    assert response.json()["id_count"] == 3
+
+
+def test_create_empty_cohort():
+    response = client.post(
+        "/cohort/",
+        json={"IDS": []},
+    )
+    assert response.status_code == 400
+    assert response.json()["error_type"] == "InvalidCohortError"
+
+
+def test_get_cohort():
+    handle = client.post("/cohort/", json={"IDS": [1, 2]}).json()["handle"]
+    response = client.get(f"/cohort/{handle}")
+    assert response.status_code == 200
+    assert response.json()["id_count"] == 2
+
+
+def test_get_unknown_cohort():
+    response = client.get("/cohort/FAKE_HANDLE")
+    assert response.status_code == 400
+    assert response.json()["error_type"] == "CohortNotFound"
+
+
+def test_data_filter_with_cohort():
+    filter_reference = client.post("/cohort/", json={"IDS": [1, 2, 3]}).json()["filter_reference"]
+    response = client.post(
+        "/data/subject",
+        json={"MATCH_ALL": [f"subject_id_alias in {filter_reference}"]},
+    )
+    expected_response = client.post(
+        "/data/subject",
+        json={"MATCH_ALL": ["subject_id_alias in [1, 2, 3]"]},
+    )
+    assert response.status_code == 200
+    assert response.json()["result"] == expected_response.json()["result"]
+
+
+def test_summary_filter_with_cohort():
+    filter_reference = client.post("/cohort/", json={"IDS": [1, 2, 3]}).json()["filter_reference"]
+    response = client.post(
+        "/summary/subject",
+        json={"MATCH_ALL": [f"subject_id_alias in {filter_reference}"]},
+    )
+    assert response.status_code == 200
+
+
+def test_data_filter_with_unknown_cohort():
+    response = client.post(
+        "/data/subject",
+        json={"MATCH_ALL": ["subject_id_alias in @cohort:FAKE_HANDLE"]},
+    )
+    assert response.status_code == 400
+    assert response.json()["error_type"] == "CohortNotFound"
+
+
+def test_cohort_reference_with_invalid_operator():
+    filter_reference = client.post("/cohort/", json={"IDS": [1, 2, 3]}).json()["filter_reference"]
+    response = client.post(
+        "/data/subject",
+        json={"MATCH_ALL": [f"subject_id_alias = {filter_reference}"]},
+    )
+    assert response.status_code == 400
+    assert response.json()["error_type"] == "ParsingError"
+
+
+def test_database_cohort_store_shared_between_workers():
+    from sqlalchemy import text
+
+    from cda_api.classes.CohortStore import DatabaseCohortStore
+    from cda_api.db.connection import session
+
+    # Two stores on the same table stand in for two worker processes
+    creating_worker = DatabaseCohortStore("cda_api", "test_cohort_store", 3600, 10)
+    other_worker = DatabaseCohortStore("cda_api", "test_cohort_store", 3600, 10)
+    try:
+        creating_worker.set("test_handle", (1, 2, 3))
+        assert other_worker.get("test_handle") == (1, 2, 3)
+        assert 0 < other_worker.expires_in("test_handle") <= 3600
+        assert other_worker.get("FAKE_HANDLE") is None
+        assert other_worker.expires_in("FAKE_HANDLE") is None
+    finally:
+        db = session()
+        db.execute(text('DROP TABLE IF EXISTS cda_api.test_cohort_store'))
+        db.commit()
+        db.close()